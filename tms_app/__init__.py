@@ -0,0 +1,3 @@
+"""
+TMS dashboard application package: database layer, shared helpers and pages.
+"""
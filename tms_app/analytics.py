@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Clinic-wide cohort and adherence metrics, computed from the Parquet snapshot.
+
+Nothing here queries the live tables: sessions, slots, patients, protocols
+and treatment courses come from tms_app/snapshot.py, and the metrics are
+pandas group-bys over them, cached per snapshot export.
+
+A course is a treatment_courses row with the sessions booked for it; a
+patient's sessions without a course count as one course of their own.
+Metrics by breakdown (protocol, diagnosis or month):
+
+- Patients / Courses: patients and courses with at least one session
+- Course completion: share of those courses that are done; a course row is
+  done when it is 'Completed' (all sessions booked) with none still
+  scheduled, sessions without a course when the patient is 'Completed'
+- Sessions / course: mean completed sessions of the completed courses
+- Days to start: median days from referral to the patient's first session
+- Completed / Missed sessions, and Missed % of the two
+- Treatment hours: slot time of the completed sessions
+
+Course metrics use the course's first session (its protocol and month);
+session metrics use each session's own protocol and month.
+"""
+import pandas as pd
+import streamlit as st
+
+from tms_app.snapshot import load_snapshot, snapshot_state
+
+BREAKDOWNS = {"Protocol": "protocol", "Diagnosis": "diagnosis", "Month": "month"}
+METRIC_COLUMNS = ["Patients", "Courses", "Course Completion %", "Sessions / Course", "Days to Start",
+                  "Completed Sessions", "Missed Sessions", "Missed %", "Treatment Hours"]
+
+
+def _session_frame():
+    """One row per session with its protocol name, patient diagnosis, month and treated minutes"""
+    sessions = load_snapshot("sessions", ["id", "patient_id", "session_date", "status", "protocol_id", "course_id"])
+    slots = load_snapshot("slots", ["session_id", "status", "slot_duration"])
+    patients = load_snapshot("patients").set_index("id")
+    protocols = load_snapshot("protocols", ["id", "protocol_name"]).set_index("id")["protocol_name"]
+
+    sessions["protocol"] = sessions["protocol_id"].map(protocols).fillna("(none)")
+    sessions["diagnosis"] = sessions["patient_id"].map(patients["primary_diagnosis"]).fillna("(not recorded)")
+    sessions["month"] = pd.to_datetime(sessions["session_date"]).dt.strftime("%Y-%m")
+    completed_slots = slots[slots["status"] == "Completed"]
+    sessions["minutes"] = sessions["id"].map(completed_slots.groupby("session_id")["slot_duration"].sum()).fillna(0)
+    return sessions, patients
+
+def _course_frame(sessions, patients):
+    """One row per course with sessions: first session's protocol/month, counts and days to start"""
+    courses = load_snapshot("courses", ["id", "status"]).set_index("id")["status"]
+    # Sessions without a course: one pseudo course per patient, keyed by the negative patient id
+    sessions["course"] = sessions["course_id"].fillna(-sessions["patient_id"]).astype(int)
+    first = sessions.sort_values(["session_date", "id"]).groupby("course").first()
+    counts = pd.crosstab(sessions["course"], sessions["status"])
+    has_row = first.index.isin(courses.index)
+    scheduled = counts["Scheduled"] if "Scheduled" in counts else 0
+    done = (pd.Series(first.index.map(courses), index=first.index) == "Completed") & (scheduled == 0)
+    patient_done = first["patient_id"].map(patients["status"]).eq("Completed")
+    first_course = first.reset_index().sort_values(["session_date", "id"]).groupby("patient_id")["course"].first()
+    days_to_start = (pd.to_datetime(first["session_date"])
+                     - pd.to_datetime(first["patient_id"].map(patients["referred_date"]))).dt.days
+    frame = pd.DataFrame({
+        "patient_id": first["patient_id"],
+        "protocol": first["protocol"],
+        "diagnosis": first["diagnosis"],
+        "month": first["month"],
+        "completed_sessions": counts.get("Completed", 0),
+        "course_completed": done.where(has_row, patient_done),
+        "days_to_start": days_to_start.where(first.index.isin(first_course)),
+    })
+    return frame
+
+def _metrics(sessions, course_frame, key):
+    """The METRIC_COLUMNS table grouped by `key` (a column name, or None for one 'All' row)"""
+    if key is None:
+        sessions, course_frame = sessions.assign(all="All"), course_frame.assign(all="All")
+        key = "all"
+    by_course = course_frame.groupby(key)
+    by_session = sessions.groupby(key)
+    completed = sessions["status"] == "Completed"
+    missed = sessions["status"] == "Missed"
+    table = pd.DataFrame({
+        "Patients": by_course["patient_id"].nunique(),
+        "Courses": by_course.size(),
+        "Course Completion %": by_course["course_completed"].mean() * 100,
+        "Sessions / Course": course_frame[course_frame["course_completed"]]
+            .groupby(key)["completed_sessions"].mean(),
+        "Days to Start": by_course["days_to_start"].median(),
+        "Completed Sessions": completed.groupby(sessions[key]).sum(),
+        "Missed Sessions": missed.groupby(sessions[key]).sum(),
+        "Treatment Hours": by_session["minutes"].sum() / 60,
+    })
+    attended = table["Completed Sessions"] + table["Missed Sessions"]
+    table["Missed %"] = table["Missed Sessions"] / attended.where(attended > 0) * 100
+    for column in ("Patients", "Courses", "Completed Sessions", "Missed Sessions"):
+        table[column] = table[column].fillna(0).astype(int)
+    return table[METRIC_COLUMNS].round(1)
+
+@st.cache_data(show_spinner="Computing clinic metrics...")
+def _cohort_metrics(exported_at):
+    sessions, patients = _session_frame()
+    if sessions.empty:
+        return {}
+    course_frame = _course_frame(sessions, patients)
+    tables = {"All": _metrics(sessions, course_frame, None).rename_axis(None)}
+    for label, key in BREAKDOWNS.items():
+        tables[label] = _metrics(sessions, course_frame, key).rename_axis(label)
+    return tables
+
+def cohort_metrics():
+    """{"All": one-row table, "Protocol"/"Diagnosis"/"Month": tables by breakdown}; None without a
+    snapshot, {} if it has no sessions.
+
+    Cached per snapshot export, so a new export is picked up on the next call.
+    """
+    exported_at = snapshot_state().get("exported_at")
+    if not exported_at:
+        return None
+    return _cohort_metrics(exported_at)
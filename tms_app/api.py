@@ -0,0 +1,422 @@
+# -*- coding: utf-8 -*-
+"""
+Headless JSON API over the dashboard data layer, for machine clients
+(EMR feed, TMS device log) that should not have to drive Streamlit.
+
+Run with:  python -m tms_app.api --host 127.0.0.1 --port 8600
+
+Every request needs ``Authorization: Bearer <token>`` where the token is in
+the API_TOKENS secret (list) or the TMS_API_TOKENS environment variable
+(comma separated). List endpoints are keyset paginated (``limit``, ``sort``,
+``desc``, ``after`` = the ``next_cursor`` of the previous page); GET responses
+carry an ETag and honour If-None-Match.
+
+    GET  /patients?status=Pending%20Review
+    GET  /patients/<id>/sessions
+    GET  /schedule?date=YYYY-MM-DD   (items + the day's staff)
+    GET  /roster?from=YYYY-MM-DD&to=YYYY-MM-DD
+    GET  /protocols
+    GET  /holidays
+    POST /patients/bulk     [{"name", "mrn", "age", "gender", "primary_diagnosis",
+                              "referred_date", "allowed_time"}]  (upsert by MRN)
+    POST /sessions/bulk     [{"session_id", "status", "side_effects", "remarks"}]
+    POST /holidays/bulk     [{"date", "name", "skip_enabled"}]   (upsert by date)
+
+Bulk rows are validated before anything is written; a bad batch gets a 400
+with ``rows``: [{"row", "error"}]. A batch naming the same MRN, session or
+date twice keeps its last row.
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import os
+import re
+from datetime import date, datetime, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import streamlit as st
+from psycopg2.extras import execute_values
+
+from tms_app.data import SCHEDULE_COLUMNS, get_daily_schedule, get_roster, get_staff_for_date
+from tms_app.db import get_conn, raise_errors
+from tms_app.pagination import fetch_keyset_page
+
+MAX_PAGE_SIZE = 500
+MAX_BULK_ROWS = 5000
+PATIENT_STATUSES = ("Pending Review", "Review Done", "Started", "Paused", "Completed")
+SESSION_STATUSES = ("Scheduled", "Completed", "Missed")
+
+# name -> base query (selects `id` first), columns, sortable field -> SQL column
+LIST_VIEWS = {
+    "patients": dict(
+        query="""SELECT id, name, mrn, age, gender, primary_diagnosis, referred_date, status, allowed_time
+                 FROM patients""",
+        columns=["id", "name", "mrn", "age", "gender", "primary_diagnosis", "referred_date",
+                 "status", "allowed_time"],
+        sortable={"id": "id", "name": "name", "referred_date": "referred_date"},
+        filters={"status": "status"},
+    ),
+    "sessions": dict(
+        query="""SELECT id, session_number, session_date, protocol_id, status
+                 FROM tms_sessions WHERE patient_id = %s""",
+        columns=["id", "session_number", "session_date", "protocol_id", "status"],
+        sortable={"session_number": "session_number", "session_date": "session_date", "id": "id"},
+        filters={},
+    ),
+    "protocols": dict(
+        query="""SELECT id, protocol_name, waveform_type, burst_pulses, inter_pulse_interval,
+                 pulse_rate, pulses_per_train, num_trains, inter_train_interval, session_duration
+                 FROM protocol_library""",
+        columns=["id", "protocol_name", "waveform_type", "burst_pulses", "inter_pulse_interval",
+                 "pulse_rate", "pulses_per_train", "num_trains", "inter_train_interval",
+                 "session_duration"],
+        sortable={"id": "id", "protocol_name": "protocol_name"},
+        filters={},
+    ),
+    "holidays": dict(
+        query="""SELECT id, holiday_date, holiday_name, skip_enabled FROM holidays
+                 WHERE holiday_date IS NOT NULL""",
+        columns=["id", "holiday_date", "holiday_name", "skip_enabled"],
+        sortable={"holiday_date": "holiday_date", "id": "id"},
+        filters={},
+    ),
+}
+
+
+class ApiError(Exception):
+    def __init__(self, status, message, rows=None):
+        super().__init__(message)
+        self.status = status
+        self.rows = rows
+
+
+# ==================== HELPERS ====================
+
+def _api_tokens():
+    tokens = [t.strip() for t in os.environ.get("TMS_API_TOKENS", "").split(",") if t.strip()]
+    if not tokens:
+        try:
+            tokens = list(st.secrets.get("API_TOKENS", []))
+        except Exception:
+            tokens = []
+    return tokens
+
+
+def _json_default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+def _dumps(payload):
+    return json.dumps(payload, default=_json_default, separators=(",", ":")).encode()
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(_dumps(list(key))).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return sort_value, int(row_id)
+    except Exception:
+        raise ApiError(400, "invalid cursor")
+
+
+def _one(query_args, name, default=None):
+    return query_args.get(name, [default])[0]
+
+
+def list_view(view_name, query_args, params=()):
+    """Keyset-paginated list endpoint shared by all list views"""
+    view = LIST_VIEWS[view_name]
+    sort = _one(query_args, "sort", next(iter(view["sortable"])))
+    if sort not in view["sortable"]:
+        raise ApiError(400, f"sort must be one of {sorted(view['sortable'])}")
+    descending = _one(query_args, "desc", "0") in ("1", "true")
+    try:
+        limit = min(max(int(_one(query_args, "limit", 100)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        raise ApiError(400, "limit must be an integer")
+    after = _one(query_args, "after")
+
+    query, params = view["query"], list(params)
+    for arg, column in view["filters"].items():
+        if _one(query_args, arg) is not None:
+            joiner = " AND " if " WHERE " in query else " WHERE "
+            query += f"{joiner}{column} = %s"
+            params.append(_one(query_args, arg))
+
+    rows, has_next = fetch_keyset_page(
+        query, tuple(params), view["sortable"][sort], descending,
+        decode_cursor(after) if after else None, limit,
+    )
+    sort_index = view["columns"].index(view["sortable"][sort])
+    return {
+        "items": [dict(zip(view["columns"], row)) for row in rows],
+        "next_cursor": encode_cursor((rows[-1][sort_index], rows[-1][0])) if has_next else None,
+    }
+
+
+def _require_rows(body, fields):
+    if not isinstance(body, list) or not body:
+        raise ApiError(400, "body must be a non-empty JSON array")
+    if len(body) > MAX_BULK_ROWS:
+        raise ApiError(413, f"at most {MAX_BULK_ROWS} rows per request")
+    for i, row in enumerate(body):
+        if not isinstance(row, dict) or any(row.get(f) in (None, "") for f in fields):
+            raise ApiError(400, f"row {i}: {', '.join(fields)} are required")
+    return body
+
+
+def _parse_rows(rows, parse_row):
+    """parse_row(row) for every row, or a 400 listing each row it raised ValueError for"""
+    values, errors = [], []
+    for i, row in enumerate(rows):
+        try:
+            values.append(parse_row(row))
+        except (TypeError, ValueError) as e:
+            errors.append({"row": i, "error": str(e)})
+    if errors:
+        raise ApiError(400, f"{len(errors)} invalid row(s)", errors)
+    return values
+
+
+def _int(row, field, required=True):
+    value = row.get(field)
+    if value is None and not required:
+        return None
+    if (isinstance(value, bool) or not isinstance(value, (int, str)) or not str(value).strip().isdigit()
+            or int(value) > 2 ** 31 - 1):
+        raise ValueError(f"{field} must be a whole number")
+    return int(value)
+
+
+def _date(row, field):
+    value = row.get(field)
+    try:
+        return date.fromisoformat(value) if value else None
+    except (TypeError, ValueError):
+        raise ValueError(f"{field} must be YYYY-MM-DD")
+
+
+def _time(row, field):
+    value = row.get(field)
+    try:
+        return time.fromisoformat(value) if value else None
+    except (TypeError, ValueError):
+        raise ValueError(f"{field} must be HH:MM")
+
+
+def _choice(row, field, choices, default=None):
+    value = row.get(field) or default
+    if value not in choices:
+        raise ValueError(f"{field} must be one of {', '.join(choices)}")
+    return value
+
+
+def _last_per_key(values, key_index):
+    """Keep the last row per key, so one statement never touches the same row twice"""
+    return list({value[key_index]: value for value in values}.values())
+
+
+# ==================== BULK WRITES ====================
+
+def bulk_upsert_patients(rows):
+    """Insert or update patients by MRN in one statement; returns [{mrn, id}]"""
+    rows = _require_rows(rows, ["name", "mrn"])
+    values = _last_per_key(_parse_rows(rows, lambda r: (
+        str(r["name"]), str(r["mrn"]), _int(r, "age", required=False), r.get("gender"), r.get("primary_diagnosis"),
+        _date(r, "referred_date") or date.today(),
+        _choice(r, "status", PATIENT_STATUSES, "Pending Review"), _time(r, "allowed_time"),
+    )), 1)
+    with get_conn() as conn:
+        c = conn.cursor()
+        result = execute_values(c, """
+            INSERT INTO patients (name, mrn, age, gender, primary_diagnosis, referred_date, status, allowed_time)
+            VALUES %s
+            ON CONFLICT (mrn) DO UPDATE SET
+                name = EXCLUDED.name, age = EXCLUDED.age, gender = EXCLUDED.gender,
+                primary_diagnosis = EXCLUDED.primary_diagnosis, allowed_time = EXCLUDED.allowed_time
+            RETURNING mrn, id""", values, fetch=True)
+        c.close()
+    return [{"mrn": mrn, "id": pid} for mrn, pid in result]
+
+
+def bulk_update_sessions(rows):
+    """Apply status/notes for many sessions in one statement; returns updated ids"""
+    rows = _require_rows(rows, ["session_id", "status"])
+    values = _last_per_key(_parse_rows(rows, lambda r: (
+        _int(r, "session_id"), _choice(r, "status", SESSION_STATUSES), r.get("side_effects"), r.get("remarks"),
+    )), 0)
+    with get_conn() as conn:
+        c = conn.cursor()
+        result = execute_values(c, """
+            UPDATE tms_sessions ts SET
+                status = v.status,
+                side_effects = COALESCE(v.side_effects, ts.side_effects),
+                remarks = COALESCE(v.remarks, ts.remarks)
+            FROM (VALUES %s) AS v (id, status, side_effects, remarks)
+            WHERE ts.id = v.id
+            RETURNING ts.id""", values, template="(%s::int, %s, %s, %s)", fetch=True)
+        updated = [r[0] for r in result]
+        # Keep the schedule in step with the session status
+        c.execute("""
+            UPDATE daily_slots ds SET status = ts.status
+            FROM tms_sessions ts
+            WHERE ds.session_id = ts.id AND ts.id = ANY(%s) AND ds.status <> ts.status""",
+            (updated,))
+        c.close()
+    return updated
+
+
+def bulk_upsert_holidays(rows):
+    """Insert or update holidays by date in one statement; returns affected dates"""
+    rows = _require_rows(rows, ["date"])
+    values = _last_per_key(_parse_rows(rows, lambda r: (
+        _date(r, "date"), r.get("name"), 0 if r.get("skip_enabled") is False else 1,
+    )), 0)
+    with get_conn() as conn:
+        c = conn.cursor()
+        result = execute_values(c, """
+            INSERT INTO holidays (holiday_date, holiday_name, skip_enabled) VALUES %s
+            ON CONFLICT (holiday_date) DO UPDATE SET
+                holiday_name = EXCLUDED.holiday_name, skip_enabled = EXCLUDED.skip_enabled
+            RETURNING holiday_date""", values, fetch=True)
+        c.close()
+    return [r[0] for r in result]
+
+
+# ==================== ROUTING ====================
+
+def get_schedule(query_args):
+    try:
+        day = date.fromisoformat(_one(query_args, "date", date.today().isoformat()))
+    except ValueError:
+        raise ApiError(400, "date must be YYYY-MM-DD")
+    rows = get_daily_schedule(day)
+    sr_name, jr1_name, jr2_name = get_staff_for_date(day)
+    return {"date": day, "staff": {"sr_name": sr_name, "jr1_name": jr1_name, "jr2_name": jr2_name},
+            "items": [dict(zip(SCHEDULE_COLUMNS, row)) for row in rows]}
+
+
+def get_roster_range(query_args):
+    try:
+        start = date.fromisoformat(_one(query_args, "from", date.today().isoformat()))
+        end = date.fromisoformat(_one(query_args, "to", start.isoformat()))
+    except ValueError:
+        raise ApiError(400, "from/to must be YYYY-MM-DD")
+    if (end - start).days > 366:
+        raise ApiError(400, "at most one year per request")
+    return {"from": start, "to": end, "items": [day._asdict() for day in get_roster(start, end)]}
+
+
+GET_ROUTES = [
+    (re.compile(r"^/patients$"), lambda m, q: list_view("patients", q)),
+    (re.compile(r"^/patients/(\d+)/sessions$"), lambda m, q: list_view("sessions", q, (int(m.group(1)),))),
+    (re.compile(r"^/schedule$"), lambda m, q: get_schedule(q)),
+    (re.compile(r"^/roster$"), lambda m, q: get_roster_range(q)),
+    (re.compile(r"^/protocols$"), lambda m, q: list_view("protocols", q)),
+    (re.compile(r"^/holidays$"), lambda m, q: list_view("holidays", q)),
+]
+
+POST_ROUTES = {
+    "/patients/bulk": bulk_upsert_patients,
+    "/sessions/bulk": bulk_update_sessions,
+    "/holidays/bulk": bulk_upsert_holidays,
+}
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    server_version = "TMSApi/1.0"
+
+    def _send(self, status, payload=None, headers=None):
+        body = _dumps(payload) if payload is not None else b""
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if payload is not None:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self):
+        header = self.headers.get("Authorization", "")
+        token = header[7:] if header.startswith("Bearer ") else ""
+        return bool(token) and any(hmac.compare_digest(token, t) for t in _api_tokens())
+
+    def _dispatch(self, handler):
+        if not self._authorized():
+            return self._send(401, {"error": "unauthorized"})
+        try:
+            with raise_errors():
+                handler()
+        except ApiError as e:
+            payload = {"error": str(e)}
+            if e.rows:
+                payload["rows"] = e.rows
+            self._send(e.status, payload)
+        except Exception as e:
+            self.log_error("request failed: %r", e)
+            self._send(500, {"error": "internal error"})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        for pattern, view in GET_ROUTES:
+            match = pattern.match(url.path)
+            if match:
+                return self._dispatch(lambda: self._get(view, match, parse_qs(url.query)))
+        self._send(404, {"error": "not found"})
+
+    def _get(self, view, match, query_args):
+        body = _dumps(view(match, query_args))
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        if etag in [t.strip() for t in self.headers.get("If-None-Match", "").split(",")]:
+            return self._send(304, headers={"ETag": etag})
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        handler = POST_ROUTES.get(urlparse(self.path).path)
+        if handler is None:
+            return self._send(404, {"error": "not found"})
+        self._dispatch(lambda: self._post(handler))
+
+    def _post(self, handler):
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"null")
+        except ValueError:
+            raise ApiError(400, "body must be JSON")
+        self._send(200, {"results": handler(body)})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TMS dashboard JSON API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8600)
+    args = parser.parse_args(argv)
+
+    if not _api_tokens():
+        parser.error("no API tokens configured (API_TOKENS secret or TMS_API_TOKENS env)")
+    server = ThreadingHTTPServer((args.host, args.port), ApiHandler)
+    print(f"TMS API listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Login gate.
+
+The parsed secrets config is built once per process. streamlit-authenticator is
+only constructed while a session is logging in (or out); once logged in, the
+session carries an HMAC-signed token that is checked on every rerun instead.
+"""
+import base64
+import copy
+import hashlib
+import hmac
+import json
+import time
+
+import streamlit as st
+import streamlit_authenticator as stauth
+
+TOKEN_KEY = "auth_token"
+
+
+@st.cache_resource(show_spinner=False)
+def get_auth_config():
+    """Parsed secrets (credentials + cookie settings), built once per process"""
+    return st.secrets.to_dict()
+
+
+def _sign(payload, key):
+    return hmac.new(key.encode(), payload, hashlib.sha256).hexdigest()
+
+
+def issue_token(username, name, config=None):
+    """Signed session token for a logged-in user, valid for the cookie expiry"""
+    config = config or get_auth_config()
+    expires = int(time.time() + float(config["cookie"]["expiry_days"]) * 86400)
+    payload = base64.urlsafe_b64encode(json.dumps([username, name, expires]).encode())
+    return f"{payload.decode()}.{_sign(payload, config['cookie']['key'])}"
+
+
+def verify_token(token, config=None):
+    """Return (username, name) for a valid, unexpired token, else None"""
+    if not token:
+        return None
+    config = config or get_auth_config()
+    try:
+        payload, signature = token.rsplit(".", 1)
+        if not hmac.compare_digest(signature, _sign(payload.encode(), config["cookie"]["key"])):
+            return None
+        username, name, expires = json.loads(base64.urlsafe_b64decode(payload))
+    except Exception:
+        return None
+    if expires < time.time() or username not in config["credentials"]["usernames"]:
+        return None
+    return username, name
+
+
+def _build_authenticator(config):
+    # Passwords in secrets are already bcrypt hashes; auto_hash would only re-scan them.
+    # Each session gets its own copy because the library updates credentials in place.
+    return stauth.Authenticate(
+        copy.deepcopy(config["credentials"]),
+        config["cookie"]["name"],
+        config["cookie"]["key"],
+        config["cookie"]["expiry_days"],
+        auto_hash=False,
+    )
+
+
+def logout():
+    """Clear the session token and the login cookie"""
+    st.session_state.pop(TOKEN_KEY, None)
+    _build_authenticator(get_auth_config()).logout(location="unrendered")
+
+
+def require_login():
+    """Stop the script unless the session is logged in; returns the user's display name"""
+    config = get_auth_config()
+
+    claims = verify_token(st.session_state.get(TOKEN_KEY), config)
+    if claims is None:
+        authenticator = _build_authenticator(config)
+
+        # --- Login UI ---
+        authenticator.login()
+        auth_status = st.session_state.get("authentication_status")
+
+        if auth_status is None:
+            st.warning("⚠️ Please log in to continue.")
+            st.stop()
+        elif auth_status is False:
+            st.error("❌ Username or password incorrect.")
+            st.stop()
+
+        claims = (st.session_state["username"], st.session_state["name"])
+        st.session_state[TOKEN_KEY] = issue_token(*claims, config)
+
+    if st.sidebar.button("Logout", key="logout_button"):
+        logout()
+        st.rerun()
+
+    return claims[1]
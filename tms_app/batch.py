@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""
+Nightly batch maintenance, as set-based SQL committed in bounded chunks.
+
+Run from cron, e.g.:
+
+    15 22 * * *  cd /srv/tms && python -m tms_app.batch all
+
+Jobs:
+    mark-missed       past-due 'Scheduled' slots and sessions -> 'Missed'
+    complete-courses  'Started' patients with no scheduled sessions left -> 'Completed'
+    materialize-courses
+                      book treatment course sessions falling within the next
+                      COURSE_HORIZON_DAYS (see tms_app/courses.py)
+    plan-next-day     create the missing daily_slots rows for the next clinic day in the
+                      first window with a chair free, not before the patient's allowed
+                      time (sessions that fit nowhere are reported as left over)
+    ensure-partitions create next months' partitions for partitioned tables
+    snapshot          bring the Parquet analytics snapshot up to date (see tms_app/snapshot.py)
+    prune-change-log  drop change feed entries older than CHANGE_LOG_KEEP_DAYS
+    all               the seven jobs above, in that order
+
+    archive           move completed/missed history older than --archive-after-days
+                      into the *_archive tables (e.g. weekly)
+    compact           close the gaps in the next --compact-days days' schedules
+                      (see tms_app/compaction.py)
+    partition-daily-slots
+                      one-time migration of daily_slots to monthly partitions
+
+Each job prints the rows it touched, the number of chunks and the elapsed time;
+the exit code is non-zero if any job failed.
+"""
+import argparse
+import sys
+import time
+from datetime import date, timedelta
+
+from psycopg2.extras import execute_values
+
+from tms_app.change_feed import CHANGE_LOG_KEEP_DAYS
+from tms_app.clinic_calendar import DEFAULT_SESSION_MINUTES, OPEN_MINUTES, build_calendar, clock, load_day_slots
+from tms_app.compaction import apply_compaction, plan_compaction
+from tms_app.courses import COURSE_BOOKED, materialize_courses
+from tms_app.db import get_conn
+from tms_app.partitions import (add_months, archive_history, default_cutoff, ensure_partitions,
+                                month_start, partition_daily_slots)
+from tms_app.snapshot import export_snapshot
+
+DEFAULT_CHUNK_SIZE = 5000
+DEFAULT_ARCHIVE_AFTER_DAYS = 180
+PARTITION_MONTHS_AHEAD = 3
+
+
+def run_chunked(conn, statement, params, chunk_size):
+    """Run a `LIMIT %s` statement until it touches no rows, committing after each chunk.
+
+    The statement must return a single row of counts; returns (totals, chunks).
+    """
+    totals, chunks = None, 0
+    c = conn.cursor()
+    while True:
+        c.execute(statement, (*params, chunk_size))
+        counts = c.fetchone()
+        conn.commit()
+        chunks += 1
+        totals = counts if totals is None else tuple(a + b for a, b in zip(totals, counts))
+        if counts[0] < chunk_size:
+            break
+    c.close()
+    return totals, chunks
+
+
+def mark_missed(conn, today, chunk_size, options):
+    """Past-due 'Scheduled' slots (and their sessions) become 'Missed'"""
+    (slots, slot_sessions), chunks = run_chunked(conn, """
+        WITH batch AS (
+            SELECT id FROM daily_slots
+            WHERE status = 'Scheduled' AND slot_date < %s
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        ), slots AS (
+            UPDATE daily_slots ds SET status = 'Missed'
+            FROM batch WHERE ds.id = batch.id
+            RETURNING ds.session_id
+        ), sessions AS (
+            UPDATE tms_sessions ts SET status = 'Missed'
+            FROM slots WHERE ts.id = slots.session_id AND ts.status = 'Scheduled'
+            RETURNING ts.id
+        )
+        SELECT (SELECT COUNT(*) FROM slots), (SELECT COUNT(*) FROM sessions)
+    """, (today,), chunk_size)
+
+    # Scheduled sessions that never got a slot
+    (orphans,), more_chunks = run_chunked(conn, """
+        WITH batch AS (
+            SELECT id FROM tms_sessions
+            WHERE status = 'Scheduled' AND session_date < %s
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        ), sessions AS (
+            UPDATE tms_sessions ts SET status = 'Missed'
+            FROM batch WHERE ts.id = batch.id
+            RETURNING ts.id
+        )
+        SELECT COUNT(*) FROM sessions
+    """, (today,), chunk_size)
+    return f"{slots} slots, {slot_sessions + orphans} sessions", chunks + more_chunks
+
+
+def complete_courses(conn, today, chunk_size, options):
+    """'Started' patients with completed sessions, none still scheduled and no course sessions left to book become 'Completed'"""
+    (patients,), chunks = run_chunked(conn, """
+        WITH batch AS (
+            SELECT p.id FROM patients p
+            WHERE p.status = 'Started'
+              AND EXISTS (SELECT 1 FROM tms_sessions ts
+                          WHERE ts.patient_id = p.id AND ts.status = 'Completed')
+              AND NOT EXISTS (SELECT 1 FROM tms_sessions ts
+                              WHERE ts.patient_id = p.id AND ts.status = 'Scheduled')
+              AND NOT EXISTS (SELECT 1 FROM treatment_courses tc
+                              WHERE tc.patient_id = p.id AND tc.status IN ('Active', 'Paused')
+                                AND tc.session_count > """ + COURSE_BOOKED + """)
+            ORDER BY p.id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        ), done AS (
+            UPDATE patients p SET status = 'Completed'
+            FROM batch WHERE p.id = batch.id
+            RETURNING p.id
+        )
+        SELECT COUNT(*) FROM done
+    """, (), chunk_size)
+    return f"{patients} patients", chunks
+
+
+def book_courses(conn, today, chunk_size, options):
+    """Book treatment course sessions that fall within the booking horizon"""
+    booked, courses, chunks = materialize_courses(conn, today, chunk_size)
+    return f"{booked} sessions booked, {courses} active courses checked", chunks
+
+
+def next_clinic_day(conn, after):
+    """First day after `after` that is not a Sunday or an enabled holiday (dated or recurring)"""
+    start = after + timedelta(days=1)
+    return build_calendar(conn, start, start + timedelta(days=366)).next_clinic_day(start)
+
+
+def plan_next_day(conn, today, chunk_size, options):
+    """Give the next clinic day's unslotted sessions the first window with a chair free, from the patient's allowed time"""
+    day = next_clinic_day(conn, today)
+    c = conn.cursor()
+    c.execute("""
+        SELECT ts.id, COALESCE(pl.session_duration, %s),
+               EXTRACT(HOUR FROM p.allowed_time)::int * 60 + EXTRACT(MINUTE FROM p.allowed_time)::int
+        FROM tms_sessions ts
+        JOIN patients p ON p.id = ts.patient_id
+        LEFT JOIN protocol_library pl ON pl.id = ts.protocol_id
+        WHERE ts.session_date = %s AND ts.status = 'Scheduled'
+          AND NOT EXISTS (SELECT 1 FROM daily_slots ds WHERE ds.session_id = ts.id)
+        ORDER BY p.allowed_time DESC NULLS LAST, ts.id
+    """, (DEFAULT_SESSION_MINUTES, day))
+    todo = c.fetchall()
+    # Latest allowed time first, so the afternoon isn't taken by sessions that could go earlier
+    schedule = load_day_slots(c, [day])[day]
+    slots = []
+    for session_id, duration, allowed in todo:
+        start = schedule.first_free(duration, allowed or OPEN_MINUTES)
+        if start is not None:
+            schedule.book(start, duration)
+            slots.append((day, session_id, clock(start), duration, "Scheduled"))
+    if slots:
+        execute_values(c, """INSERT INTO daily_slots (slot_date, session_id, scheduled_time, slot_duration, status)
+                             VALUES %s""", slots, page_size=chunk_size)
+    conn.commit()
+    c.close()
+    left = f", {len(todo) - len(slots)} left over with no free chair before closing time" if len(todo) > len(slots) else ""
+    return f"{len(slots)} slots created for {day}{left}", 1
+
+
+def ensure_upcoming_partitions(conn, today, chunk_size, options):
+    """Monthly partitions through PARTITION_MONTHS_AHEAD, so new rows never land in the default partition"""
+    created = ensure_partitions(conn, month_start(today), add_months(month_start(today), PARTITION_MONTHS_AHEAD))
+    return f"{created} partitions created", 1
+
+
+def snapshot(conn, today, chunk_size, options):
+    """Export sessions, slots, parameters and protocols changed since the last run to Parquet"""
+    written, full = export_snapshot(conn)
+    kind = "full rebuild" if full else "incremental"
+    return f"{kind}: " + ", ".join(f"{rows} {name}" for name, rows in written.items()), 1
+
+
+def prune_change_log(conn, today, chunk_size, options):
+    """Change feed entries are only read by open dashboards; drop the old ones"""
+    (deleted,), chunks = run_chunked(conn, """
+        WITH gone AS (
+            DELETE FROM change_log WHERE version IN (
+                SELECT version FROM change_log WHERE changed_at < %s ORDER BY version LIMIT %s)
+            RETURNING 1
+        )
+        SELECT COUNT(*) FROM gone
+    """, (today - timedelta(days=CHANGE_LOG_KEEP_DAYS),), chunk_size)
+    return f"{deleted} change log entries deleted", chunks
+
+
+def archive(conn, today, chunk_size, options):
+    """Move old completed/missed sessions, their slots and parameters into the archive tables"""
+    cutoff = default_cutoff(today, options.archive_after_days)
+    sessions, slots, params, chunks = archive_history(conn, cutoff, chunk_size)
+    return f"{sessions} sessions, {slots} slots, {params} parameter rows before {cutoff}", chunks
+
+
+def compact(conn, today, chunk_size, options):
+    """Re-pack the scheduled slots of the days after today to close the gaps, in one UPDATE"""
+    c = conn.cursor()
+    moves, days = plan_compaction(c, today + timedelta(days=1), today + timedelta(days=options.compact_days))
+    moved = apply_compaction(c, moves)
+    conn.commit()
+    c.close()
+    earlier = sum(day.end_after != day.end_before for day in days)
+    return f"{len(moved)} of {len(moves)} planned moves on {len(days)} days, {earlier} days end earlier", 1
+
+
+def migrate_daily_slots(conn, today, chunk_size, options):
+    """One-time conversion of daily_slots to monthly range partitions"""
+    if partition_daily_slots(conn, PARTITION_MONTHS_AHEAD):
+        return "daily_slots is now partitioned by month", 1
+    return "daily_slots was already partitioned", 1
+
+
+NIGHTLY_JOBS = {
+    "mark-missed": mark_missed,
+    "complete-courses": complete_courses,
+    "materialize-courses": book_courses,
+    "plan-next-day": plan_next_day,
+    "ensure-partitions": ensure_upcoming_partitions,
+    "snapshot": snapshot,
+    "prune-change-log": prune_change_log,
+}
+JOBS = {
+    **NIGHTLY_JOBS,
+    "archive": archive,
+    "compact": compact,
+    "partition-daily-slots": migrate_daily_slots,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TMS nightly batch maintenance")
+    parser.add_argument("job", choices=[*JOBS, "all"])
+    parser.add_argument("--date", type=date.fromisoformat, default=None,
+                        help="treat this day as today (YYYY-MM-DD)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--archive-after-days", type=int, default=DEFAULT_ARCHIVE_AFTER_DAYS,
+                        help="archive job: keep this many days of history in the live tables")
+    parser.add_argument("--compact-days", type=int, default=1,
+                        help="compact job: how many days after today to compact")
+    args = parser.parse_args(argv)
+
+    today = args.date or date.today()
+    jobs = list(NIGHTLY_JOBS) if args.job == "all" else [args.job]
+    failed = False
+    for name in jobs:
+        started = time.perf_counter()
+        try:
+            with get_conn() as conn:
+                summary, chunks = JOBS[name](conn, today, args.chunk_size, args)
+        except Exception as e:
+            failed = True
+            print(f"{name}: FAILED after {time.perf_counter() - started:.2f}s: {e}", file=sys.stderr)
+            continue
+        print(f"{name}: {summary} in {chunks} chunk(s), {time.perf_counter() - started:.2f}s")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
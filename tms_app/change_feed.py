@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Change feed for the schedule tables.
+
+Row triggers on daily_slots and tms_sessions keep `updated_at` current and
+append (version, session_id, date) to `change_log` for every insert, update
+and delete (an update that moves a row to another date is logged for both
+dates). Readers remember the highest version they have applied and ask for
+newer entries on the date they show (data.get_schedule_changes), so checking
+for changes costs one indexed query.
+
+Versions come from a sequence, so a transaction can commit after a later
+version is already visible; readers therefore also re-read the last
+CHANGE_OVERLAP_SECONDS of entries and skip the versions they have seen.
+"""
+
+CHANGE_OVERLAP_SECONDS = 60
+CHANGE_LOG_KEEP_DAYS = 2
+
+# table -> (session id column, date column)
+FEED_TABLES = {
+    "daily_slots": ("session_id", "slot_date"),
+    "tms_sessions": ("id", "session_date"),
+}
+
+
+def create_change_feed(c):
+    """change_log table, updated_at columns and the triggers feeding them (idempotent)"""
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS change_log
+    (version BIGSERIAL PRIMARY KEY,
+     table_name TEXT NOT NULL,
+     session_id INTEGER,
+     change_date DATE,
+     operation TEXT NOT NULL,
+     changed_at TIMESTAMP NOT NULL DEFAULT NOW())
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_change_log_date_changed ON change_log (change_date, changed_at)")
+
+    c.execute("""SELECT tgrelid::regclass::text || '.' || tgname FROM pg_trigger
+                 WHERE tgrelid = ANY(%s::regclass[]) AND NOT tgisinternal""", (list(FEED_TABLES),))
+    existing = {row[0] for row in c.fetchall()}
+    missing = [table for table in FEED_TABLES
+               if {f"{table}.{table}_touch", f"{table}.{table}_change_log"} - existing]
+    if not missing:
+        return
+
+    c.execute("""
+    CREATE OR REPLACE FUNCTION touch_updated_at() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        NEW.updated_at := NOW();
+        RETURN NEW;
+    END $$
+    """)
+    # TG_ARGV: session id column, date column
+    c.execute("""
+    CREATE OR REPLACE FUNCTION log_schedule_change() RETURNS trigger LANGUAGE plpgsql AS $$
+    DECLARE
+        old_row jsonb := CASE WHEN TG_OP <> 'INSERT' THEN to_jsonb(OLD) END;
+        new_row jsonb := CASE WHEN TG_OP <> 'DELETE' THEN to_jsonb(NEW) END;
+    BEGIN
+        IF old_row IS NOT NULL
+           AND (new_row IS NULL OR old_row ->> TG_ARGV[1] IS DISTINCT FROM new_row ->> TG_ARGV[1]) THEN
+            INSERT INTO change_log (table_name, session_id, change_date, operation)
+            VALUES (TG_TABLE_NAME, (old_row ->> TG_ARGV[0])::int, (old_row ->> TG_ARGV[1])::date, TG_OP);
+        END IF;
+        IF new_row IS NOT NULL THEN
+            INSERT INTO change_log (table_name, session_id, change_date, operation)
+            VALUES (TG_TABLE_NAME, (new_row ->> TG_ARGV[0])::int, (new_row ->> TG_ARGV[1])::date, TG_OP);
+        END IF;
+        RETURN NULL;
+    END $$
+    """)
+    for table in missing:
+        id_column, date_column = FEED_TABLES[table]
+        c.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT NOW()")
+        if f"{table}.{table}_touch" not in existing:
+            c.execute(f"""CREATE TRIGGER {table}_touch BEFORE UPDATE ON {table}
+                          FOR EACH ROW EXECUTE FUNCTION touch_updated_at()""")
+        if f"{table}.{table}_change_log" not in existing:
+            c.execute(f"""CREATE TRIGGER {table}_change_log AFTER INSERT OR UPDATE OR DELETE ON {table}
+                          FOR EACH ROW EXECUTE FUNCTION log_schedule_change('{id_column}', '{date_column}')""")
@@ -0,0 +1,378 @@
+# -*- coding: utf-8 -*-
+"""
+Clinic calendar: which days the clinic is open, precomputed for several years.
+
+Closed days are Sundays, dated holidays (`holidays`) and recurring rules
+(`holiday_rules`: a fixed date every year, or the Nth weekday of a month /
+of every month), counting only those with skip enabled. ClinicCalendar keeps
+the open days in a numpy array, so "next clinic day" and "N clinic days from
+here" are array lookups instead of one query per candidate day.
+
+Opening hours, chairs and the default session length live here too, with
+DaySlots: the chairs in use through one day, which booking, plan-next-day
+and the waitlist use to put a new slot only where a chair is free.
+
+Holidays can also be imported from CSV or iCalendar files:
+
+    python -m tms_app.clinic_calendar holidays_2027.ics extra.csv
+"""
+import argparse
+import calendar
+import csv
+import io
+import re
+import sys
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import streamlit as st
+from dateutil.rrule import rrulestr
+from psycopg2.extras import execute_values
+
+from tms_app.db import (
+    create_tables,
+    execute_query,
+    execute_update,
+    get_conn,
+    get_setting,
+    raise_errors,
+    report_error,
+)
+
+OPEN_MINUTES, CLOSE_MINUTES = 9 * 60, 17 * 60
+CLINIC_CHAIRS = int(get_setting("CLINIC_CHAIRS", 2))
+DEFAULT_SESSION_MINUTES = 20
+CLOSED_WEEKDAYS = (6,)  # Sunday
+CALENDAR_YEARS = 5      # years covered after the first year
+RULE_KINDS = {"yearly": "Fixed date every year", "nth_weekday": "Nth weekday of the month"}
+NTH_LABELS = {1: "1st", 2: "2nd", 3: "3rd", 4: "4th", 5: "5th", -1: "Last"}
+CSV_DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%d %b %Y", "%d %B %Y")
+
+
+class HolidayRule(namedtuple("HolidayRule", "id rule_name kind month day weekday nth skip_enabled")):
+    __slots__ = ()
+
+    @property
+    def label(self):
+        month = calendar.month_name[self.month] if self.month else "every month"
+        if self.kind == "yearly":
+            return f"{self.rule_name}: {self.day} {month}"
+        return f"{self.rule_name}: {NTH_LABELS[self.nth]} {calendar.day_name[self.weekday]} of {month}"
+
+
+# ==================== RULES ====================
+
+def nth_weekday(year, month, weekday, nth):
+    """The nth (1-5, or -1 for last) `weekday` of a month, or None if there is no such day"""
+    days = [week[weekday] for week in calendar.monthcalendar(year, month) if week[weekday]]
+    try:
+        return date(year, month, days[nth - 1 if nth > 0 else nth])
+    except IndexError:
+        return None
+
+def expand_rule(rule, start, end):
+    """Dates in start..end that a HolidayRule falls on"""
+    months = [rule.month] if rule.month else range(1, 13)
+    for year in range(start.year, end.year + 1):
+        for month in months:
+            if rule.kind == "yearly":
+                if rule.day > calendar.monthrange(year, month)[1]:
+                    continue  # 29 Feb outside leap years
+                day = date(year, month, rule.day)
+            else:
+                day = nth_weekday(year, month, rule.weekday, rule.nth)
+            if day and start <= day <= end:
+                yield day
+
+def get_holiday_rules():
+    """All recurring holiday rules, as HolidayRule rows"""
+    try:
+        rows = execute_query("""SELECT id, rule_name, kind, month, day, weekday, nth, skip_enabled
+                                FROM holiday_rules ORDER BY id""")
+        return [HolidayRule(*row) for row in rows or []]
+    except Exception as e:
+        report_error(f"Error fetching holiday rules: {e}")
+        return []
+
+def add_holiday_rule(rule_name, kind, month=None, day=None, weekday=None, nth=None, skip_enabled=True):
+    if kind not in RULE_KINDS:
+        raise ValueError(f"Unknown holiday rule kind: {kind}")
+    return execute_update(
+        """INSERT INTO holiday_rules (rule_name, kind, month, day, weekday, nth, skip_enabled)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)""",
+        (rule_name, kind, month, day, weekday, nth, 1 if skip_enabled else 0)
+    )
+
+def delete_holiday_rule(rule_id):
+    return execute_update("DELETE FROM holiday_rules WHERE id = %s", (rule_id,))
+
+# ==================== CALENDAR ====================
+
+class ClinicCalendar:
+    """Open/closed flag for every day in start..end; clinic-day arithmetic is array indexing"""
+
+    def __init__(self, start, end, holidays=()):
+        self.start, self.end = start, end
+        self.holidays = frozenset(holidays)
+        days = np.arange(np.datetime64(start, "D"), np.datetime64(end, "D") + 1)
+        weekdays = (days.astype("int64") + 3) % 7  # 1970-01-01 was a Thursday
+        self.closed = np.isin(weekdays, CLOSED_WEEKDAYS) | \
+            np.isin(days, np.array(sorted(self.holidays), dtype="datetime64[D]"))
+        self.open_days = days[~self.closed]
+        # For every day: index into open_days of the first clinic day on or after it
+        self.next_index = np.searchsorted(self.open_days, days)
+
+    def _offset(self, day):
+        offset = (day - self.start).days
+        if not 0 <= offset < len(self.closed):
+            raise ValueError(f"{day} is outside the clinic calendar ({self.start} to {self.end})")
+        return offset
+
+    def _open_day(self, index):
+        if index >= len(self.open_days):
+            raise ValueError(f"No clinic days left in the calendar (ends {self.end})")
+        return self.open_days[index].astype(object)
+
+    def is_open(self, day):
+        return not self.closed[self._offset(day)]
+
+    def is_holiday(self, day):
+        return day in self.holidays
+
+    def next_clinic_day(self, day):
+        """`day` itself if the clinic is open, else the next clinic day"""
+        return self._open_day(self.next_index[self._offset(day)])
+
+    def add_clinic_days(self, day, count):
+        """The clinic day `count` clinic days after next_clinic_day(day)"""
+        return self._open_day(self.next_index[self._offset(day)] + count)
+
+    def clinic_days(self, day, count, weekdays=None):
+        """`count` consecutive clinic days starting at next_clinic_day(day), optionally only on `weekdays`"""
+        first = self.next_index[self._offset(day)]
+        if weekdays is None:
+            if count:
+                self._open_day(first + count - 1)
+            return self.open_days[first:first + count].astype(object).tolist()
+        candidates = self.open_days[first:]
+        picked = candidates[np.isin((candidates.astype("int64") + 3) % 7, weekdays)][:count]
+        if len(picked) < count:
+            raise ValueError(f"No clinic days left in the calendar (ends {self.end})")
+        return picked.astype(object).tolist()
+
+def holiday_dates(c, start, end):
+    """Skip-enabled holidays in start..end: dated ones plus the recurring rules"""
+    c.execute("""SELECT holiday_date FROM holidays
+                 WHERE skip_enabled = 1 AND holiday_date BETWEEN %s AND %s""", (start, end))
+    dates = {row[0] for row in c.fetchall()}
+    c.execute("""SELECT id, rule_name, kind, month, day, weekday, nth, skip_enabled
+                 FROM holiday_rules WHERE skip_enabled = 1""")
+    for row in c.fetchall():
+        dates.update(expand_rule(HolidayRule(*row), start, end))
+    return dates
+
+def build_calendar(conn, start, end):
+    c = conn.cursor()
+    holidays = holiday_dates(c, start, end)
+    c.close()
+    return ClinicCalendar(start, end, holidays)
+
+def holidays_version():
+    """Fingerprint of the holidays and holiday_rules rows; changes with any edit, from any process"""
+    row = execute_query("""
+        SELECT md5(concat(
+            (SELECT string_agg(concat_ws(':', holiday_date, skip_enabled), ',' ORDER BY holiday_date)
+             FROM holidays),
+            '|',
+            (SELECT string_agg(concat_ws(':', kind, month, day, weekday, nth, skip_enabled), ',' ORDER BY id)
+             FROM holiday_rules)))""", fetch_one=True)
+    return row[0] if row else None
+
+@st.cache_resource(max_entries=16, show_spinner=False)
+def _clinic_calendar(first_year, version):
+    with get_conn() as conn:
+        return build_calendar(conn, date(first_year, 1, 1), date(first_year + CALENDAR_YEARS, 12, 31))
+
+def get_clinic_calendar(first_year=None, version=None):
+    """ClinicCalendar from 1 Jan of first_year (default: last year) for CALENDAR_YEARS more years.
+
+    Cached per process for the current holidays_version(); loops pass one `version` for all calls.
+    """
+    return _clinic_calendar(first_year or date.today().year - 1, version or holidays_version())
+
+# ==================== OPENING HOURS ====================
+
+def clock(minutes):
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+def clock_minutes(text):
+    """'HH:MM' -> minutes after midnight, None if it isn't a time"""
+    try:
+        hours, minutes = str(text).strip().split(":")[:2]
+        return int(hours) * 60 + int(minutes)
+    except (AttributeError, ValueError):
+        return None
+
+class DaySlots:
+    """Chairs in use for every minute of one day, for placing new slots within opening hours"""
+
+    def __init__(self, slots=(), chairs=CLINIC_CHAIRS):
+        slots = [(start, max(duration or 0, 0)) for start, duration in slots]
+        self.chairs = chairs
+        # Old data can hold times past closing, or even past 24:00
+        self.in_use = np.zeros(max([CLOSE_MINUTES] + [start + duration for start, duration in slots]) + 1,
+                               dtype=np.int32)
+        for start, duration in slots:
+            self.book(start, duration)
+
+    def book(self, start, duration):
+        self.in_use[start:start + duration] += 1
+
+    def fits(self, start, duration):
+        """Whether a slot at `start` is within opening hours with a chair free throughout"""
+        return (OPEN_MINUTES <= start and start + duration <= CLOSE_MINUTES
+                and bool((self.in_use[start:start + duration] < self.chairs).all()))
+
+    def first_free(self, duration, not_before=OPEN_MINUTES):
+        """Earliest start from `not_before` with a chair free for `duration` minutes before closing, else None"""
+        lower, duration = max(not_before, OPEN_MINUTES), max(duration, 1)
+        if lower + duration > CLOSE_MINUTES:
+            return None
+        free = self.in_use[lower:CLOSE_MINUTES] < self.chairs
+        fits = np.lib.stride_tricks.sliding_window_view(free, duration).all(axis=1)
+        return lower + int(fits.argmax()) if fits.any() else None
+
+def load_day_slots(c, days, chairs=CLINIC_CHAIRS):
+    """{day: DaySlots} built from the daily_slots rows on `days`"""
+    days = sorted(set(days))
+    c.execute("""SELECT slot_date, split_part(scheduled_time, ':', 1)::int * 60
+                                   + split_part(scheduled_time, ':', 2)::int, COALESCE(slot_duration, %s)
+                 FROM daily_slots WHERE slot_date = ANY(%s) AND scheduled_time <> ''""",
+              (DEFAULT_SESSION_MINUTES, days))
+    by_day = {day: [] for day in days}
+    for day, start, duration in c.fetchall():
+        by_day[day].append((start, duration))
+    return {day: DaySlots(slots, chairs) for day, slots in by_day.items()}
+
+# ==================== IMPORT ====================
+
+def _parse_date(value):
+    value = value.strip()
+    for fmt in CSV_DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            pass
+    raise ValueError(f"unrecognised date {value!r}")
+
+def parse_holiday_csv(text):
+    """[(date, name, skip_enabled)] from CSV with a `date` column and optional `name`, `skip_enabled`"""
+    reader = csv.DictReader(io.StringIO(text))
+    reader.fieldnames = [(name or "").strip().lower().replace("holiday_", "") for name in reader.fieldnames or []]
+    if "date" not in reader.fieldnames:
+        raise ValueError("CSV needs a 'date' column")
+    rows = []
+    for line, row in enumerate(reader, start=2):
+        if not (row.get("date") or "").strip():
+            continue
+        try:
+            day = _parse_date(row["date"])
+        except ValueError as e:
+            raise ValueError(f"line {line}: {e}")
+        skip = (row.get("skip_enabled") or "1").strip().lower() not in ("0", "false", "no", "n")
+        rows.append((day, (row.get("name") or "").strip() or None, skip))
+    return rows
+
+def _ics_text(value):
+    return re.sub(r"\\([,;\\])", r"\1", value).replace("\\n", " ").replace("\\N", " ").strip()
+
+def parse_holiday_ics(text, until=None):
+    """[(date, name, skip_enabled)] for every day of each VEVENT in an iCalendar file.
+
+    Multi-day events give one row per day (DTEND is exclusive); recurring
+    events (RRULE) are expanded up to `until` (default: end of the calendar range),
+    leaving out the occurrences listed in EXDATE.
+    """
+    until = until or date(date.today().year + CALENDAR_YEARS, 12, 31)
+    lines = re.sub(r"\r?\n[ \t]", "", text).splitlines()
+    rows, event = [], None
+    for line in lines:
+        if line == "BEGIN:VEVENT":
+            event = {}
+        elif line == "END:VEVENT" and event is not None:
+            if "DTSTART" not in event:
+                raise ValueError("VEVENT without DTSTART")
+            start = datetime.strptime(event["DTSTART"][:8], "%Y%m%d").date()
+            end = datetime.strptime(event["DTEND"][:8], "%Y%m%d").date() if "DTEND" in event else start
+            length = max((end - start).days, 1)
+            if "RRULE" in event:
+                first = datetime.combine(start, datetime.min.time())
+                # All-day DTSTART is naive, so a UTC UNTIL (...T000000Z, as exported) must be too
+                rule = re.sub(r"(UNTIL=\d{8}(?:T\d{6})?)Z", r"\1", event["RRULE"], flags=re.I)
+                starts = [d.date() for d in rrulestr(rule, dtstart=first)
+                          .between(first, datetime.combine(until, datetime.min.time()), inc=True)]
+            else:
+                starts = [start]
+            excluded = {datetime.strptime(value[:8], "%Y%m%d").date() for value in event.get("EXDATE", [])}
+            starts = [day for day in starts if day not in excluded]
+            name = _ics_text(event.get("SUMMARY", "")) or None
+            rows += [(first_day + timedelta(days=i), name, True)
+                     for first_day in starts for i in range(length)]
+            event = None
+        elif event is not None and ":" in line:
+            key, value = line.split(":", 1)
+            key = key.split(";")[0].upper()
+            if key == "EXDATE":
+                event.setdefault(key, []).extend(v.strip() for v in value.split(",") if v.strip())
+            else:
+                event.setdefault(key, value.strip())
+    return rows
+
+def parse_holiday_file(filename, data):
+    """Parse an uploaded/local .csv or .ics file (bytes)"""
+    text = data.decode("utf-8-sig")
+    if filename.lower().endswith((".ics", ".ical", ".ifb")):
+        return parse_holiday_ics(text)
+    if filename.lower().endswith(".csv"):
+        return parse_holiday_csv(text)
+    raise ValueError(f"{filename}: expected a .csv or .ics file")
+
+def save_holidays(rows):
+    """Upsert (date, name, skip_enabled) rows by date in one statement; returns the number saved"""
+    by_date = {day: (day, name, 1 if skip else 0) for day, name, skip in rows}
+    if not by_date:
+        return 0
+    try:
+        with get_conn() as conn:
+            c = conn.cursor()
+            execute_values(c, """
+                INSERT INTO holidays (holiday_date, holiday_name, skip_enabled) VALUES %s
+                ON CONFLICT (holiday_date) DO UPDATE SET
+                    holiday_name = COALESCE(EXCLUDED.holiday_name, holidays.holiday_name),
+                    skip_enabled = EXCLUDED.skip_enabled""", list(by_date.values()))
+            c.close()
+        return len(by_date)
+    except Exception as e:
+        report_error(f"Error importing holidays: {e}")
+        return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import holidays from CSV / iCalendar files")
+    parser.add_argument("files", nargs="+")
+    args = parser.parse_args(argv)
+
+    rows = []
+    for path in args.files:
+        with open(path, "rb") as f:
+            rows += parse_holiday_file(path, f.read())
+    with raise_errors():
+        create_tables()
+        saved = save_holidays(rows)
+    print(f"Imported {saved} holiday dates from {len(args.files)} file(s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
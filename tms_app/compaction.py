@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Day compaction: re-pack a day's scheduled slots to close the gaps.
+
+calculate_next_slot_time takes the first gap that fits and deleted sessions
+leave holes, so a day fragments and runs past closing time with idle chairs
+earlier on. plan_compaction() works out new start times for the 'Scheduled'
+slots of each day in a range:
+
+- slots keep their order and are placed one by one at the earliest minute
+  with a chair free (CLINIC_CHAIRS) for their whole duration;
+- never before opening time, the patient's allowed_time or the slot ahead of
+  them, and never later than where they are now;
+- other slots (Completed, Missed, ...) and today's slots that have already
+  started stay put.
+
+The moves come back for preview; apply_compaction() writes them in one
+UPDATE and skips any slot that changed since the preview.
+
+    python -m tms_app.batch compact --compact-days 7
+"""
+from collections import namedtuple
+from datetime import datetime
+
+import numpy as np
+
+from tms_app.clinic_calendar import CLINIC_CHAIRS, DEFAULT_SESSION_MINUTES, OPEN_MINUTES
+from tms_app.db import get_conn, report_error
+
+DAY_MINUTES = 24 * 60
+
+
+class SlotMove(namedtuple("SlotMove", "slot_id slot_date patient_name session_number old_time new_time "
+                                      "slot_duration")):
+    __slots__ = ()
+
+
+class DayCompaction(namedtuple("DayCompaction", "slot_date slots moved end_before end_after "
+                                                "idle_before idle_after")):
+    """One day's effect: last slot end and idle chair-minutes between opening and that end, before/after"""
+    __slots__ = ()
+
+
+def _clock(minutes):
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+def _day_stats(starts, durations, chairs):
+    """(minute the last slot ends, idle chair-minutes from opening to then)"""
+    if not len(starts):
+        return None, 0
+    ends = starts + durations
+    end = int(ends.max())
+    busy = np.zeros(max(end, DAY_MINUTES) + 1, dtype=np.int32)
+    np.add.at(busy, starts, 1)
+    np.add.at(busy, ends, -1)
+    in_use = np.minimum(np.cumsum(busy)[OPEN_MINUTES:max(end, OPEN_MINUTES)], chairs)
+    return end, int(chairs * len(in_use) - in_use.sum())
+
+def _compact_day(rows, chairs, not_before):
+    """New start minute per row of one day's (slot_id, start, duration, movable, allowed minute) rows"""
+    # Sized to the day's latest end: old data can hold times past 24:00
+    last_end = max(start + duration for _, start, duration, _, _ in rows)
+    occupancy = np.zeros(max(last_end, DAY_MINUTES) + 1, dtype=np.int32)
+    for _, start, duration, movable, _ in rows:
+        if not movable:
+            occupancy[start:start + duration] += 1
+    new_starts, previous = [], 0
+    for _, start, duration, movable, allowed in rows:
+        if not movable:
+            new_starts.append(start)
+            continue
+        lower = min(max(OPEN_MINUTES, allowed or 0, previous, not_before), start)
+        free = occupancy[lower:start + duration] < chairs
+        fits = np.lib.stride_tricks.sliding_window_view(free, duration).all(axis=1)
+        new = lower + int(fits.argmax()) if fits.any() else start
+        occupancy[new:new + duration] += 1
+        new_starts.append(new)
+        previous = new
+    return new_starts
+
+def plan_compaction(c, start, end, chairs=CLINIC_CHAIRS, now=None):
+    """Compaction of every day in start..end: ([SlotMove], [DayCompaction]) for days with slots"""
+    now = now or datetime.now()
+    c.execute("""
+        SELECT ds.id, ds.slot_date,
+               split_part(ds.scheduled_time, ':', 1)::int * 60 + split_part(ds.scheduled_time, ':', 2)::int,
+               GREATEST(COALESCE(ds.slot_duration, %s), 1), ds.status = 'Scheduled',
+               EXTRACT(HOUR FROM p.allowed_time)::int * 60 + EXTRACT(MINUTE FROM p.allowed_time)::int,
+               p.name, ts.session_number
+        FROM daily_slots ds
+        JOIN tms_sessions ts ON ts.id = ds.session_id
+        JOIN patients p ON p.id = ts.patient_id
+        WHERE ds.slot_date BETWEEN %s AND %s AND ds.scheduled_time <> ''""",
+        (DEFAULT_SESSION_MINUTES, start, end))
+    by_day = {}
+    for slot_id, day, minute, duration, scheduled, allowed, name, number in c.fetchall():
+        by_day.setdefault(day, []).append((slot_id, minute, duration, scheduled, allowed, name, number))
+
+    moves, days = [], []
+    for day in sorted(by_day):
+        slots = sorted(by_day[day], key=lambda slot: (slot[1], slot[0]))
+        # Today: slots that have started stay, and nothing moves into the past
+        not_before = now.hour * 60 + now.minute + 1 if day == now.date() else 0
+        if day < now.date():
+            not_before = DAY_MINUTES
+        rows = [(slot_id, minute, duration, scheduled and minute >= not_before, allowed)
+                for slot_id, minute, duration, scheduled, allowed, _, _ in slots]
+        new_starts = _compact_day(rows, chairs, not_before)
+
+        durations = np.array([slot[2] for slot in slots])
+        before = _day_stats(np.array([slot[1] for slot in slots]), durations, chairs)
+        after = _day_stats(np.array(new_starts), durations, chairs)
+        moved = [SlotMove(slot_id, day, name, number, _clock(minute), _clock(new), duration)
+                 for (slot_id, minute, duration, _, _, name, number), new in zip(slots, new_starts) if new != minute]
+        moves += moved
+        days.append(DayCompaction(day, len(slots), len(moved), _clock(before[0]), _clock(after[0]),
+                                  before[1], after[1]))
+    return moves, days
+
+def apply_compaction(c, moves):
+    """Write the moves in one UPDATE; slots changed since the plan are left alone. Returns the moved slot ids"""
+    if not moves:
+        return []
+    c.execute("""
+        UPDATE daily_slots ds SET scheduled_time = m.new_time
+        FROM unnest(%s::int[], %s::date[], %s::text[], %s::text[]) AS m (id, slot_date, old_time, new_time)
+        WHERE ds.id = m.id AND ds.slot_date = m.slot_date AND ds.status = 'Scheduled'
+          AND split_part(ds.scheduled_time, ':', 1)::int * 60 + split_part(ds.scheduled_time, ':', 2)::int
+              = split_part(m.old_time, ':', 1)::int * 60 + split_part(m.old_time, ':', 2)::int
+        RETURNING ds.id""",
+        ([move.slot_id for move in moves], [move.slot_date for move in moves],
+         [move.old_time for move in moves], [move.new_time for move in moves]))
+    return [row[0] for row in c.fetchall()]
+
+# ==================== DASHBOARD ====================
+
+def preview_compaction(start, end):
+    """plan_compaction for the dashboard; None on error"""
+    try:
+        with get_conn() as conn:
+            c = conn.cursor()
+            plan = plan_compaction(c, start, end)
+            c.close()
+        return plan
+    except Exception as e:
+        report_error(f"Error planning compaction: {e}")
+        return None
+
+def compact_schedule(moves):
+    """Apply previewed moves; returns the ids of the slots moved, or None on error"""
+    try:
+        with get_conn() as conn:
+            c = conn.cursor()
+            moved = apply_compaction(c, moves)
+            c.close()
+        return moved
+    except Exception as e:
+        report_error(f"Error compacting schedule: {e}")
+        return None
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+"""
+Treatment courses: a whole course of sessions as one row.
+
+A course is (patient, protocol, start date, number of sessions, weekdays,
+preferred time). Its sessions are worked out from the clinic calendar when
+they are shown; only those within COURSE_HORIZON_DAYS are written to
+tms_sessions / daily_slots (at booking, and by the nightly
+`materialize-courses` job), never on a day before today. Booked rows carry
+the course_id, so a course's remaining sessions are always session_count
+minus its booked rows, archived ones (tms_sessions_archive) included. Once
+all of them are booked the course is 'Completed'.
+
+Changing the protocol, pausing, resuming or cancelling updates the course
+row and, at most, the rows inside the horizon.
+"""
+from collections import namedtuple
+from datetime import date, timedelta
+
+from psycopg2.extras import execute_values
+
+from tms_app.clinic_calendar import (
+    CALENDAR_YEARS,
+    DEFAULT_SESSION_MINUTES,
+    OPEN_MINUTES,
+    build_calendar,
+    clock,
+    clock_minutes,
+    get_clinic_calendar,
+    holidays_version,
+    load_day_slots,
+)
+from tms_app.db import get_conn, get_setting, report_error
+
+COURSE_HORIZON_DAYS = int(get_setting("COURSE_HORIZON_DAYS", 14))
+COURSE_WEEKDAYS = [0, 1, 2, 3, 4, 5]  # Monday-Saturday
+DEFAULT_COURSE_SESSIONS = 14
+
+COURSE_SELECT = """
+    SELECT tc.id, tc.patient_id, tc.protocol_id, pl.protocol_name, tc.start_date, tc.session_count,
+           tc.weekdays, tc.preferred_time, tc.status,
+           live.booked + archived.booked AS booked, GREATEST(live.last_booked, archived.last_booked) AS last_booked
+    FROM treatment_courses tc
+    LEFT JOIN protocol_library pl ON pl.id = tc.protocol_id
+    CROSS JOIN LATERAL (SELECT COUNT(*) AS booked, MAX(session_date) AS last_booked
+                        FROM tms_sessions WHERE course_id = tc.id) live
+    CROSS JOIN LATERAL (SELECT COUNT(*) AS booked, MAX(session_date) AS last_booked
+                        FROM tms_sessions_archive WHERE course_id = tc.id) archived
+"""
+COURSE_ORDER = " ORDER BY tc.start_date, tc.id"
+# Sessions booked for course `tc`, live and archived
+COURSE_BOOKED = """((SELECT COUNT(*) FROM tms_sessions ts WHERE ts.course_id = tc.id)
+                    + (SELECT COUNT(*) FROM tms_sessions_archive tsa WHERE tsa.course_id = tc.id))"""
+
+
+class Course(namedtuple("Course", "id patient_id protocol_id protocol_name start_date session_count "
+                                  "weekdays preferred_time status booked last_booked")):
+    __slots__ = ()
+
+    @property
+    def remaining(self):
+        return max(self.session_count - self.booked, 0)
+
+    @property
+    def next_day(self):
+        """First day the unbooked sessions can fall on"""
+        if self.last_booked and self.last_booked >= self.start_date:
+            return self.last_booked + timedelta(days=1)
+        return self.start_date
+
+    def planned_dates(self, calendar, today=None):
+        """Dates of the sessions not booked yet, from today on (none unless the course is Active)"""
+        if self.status != "Active" or not self.remaining:
+            return []
+        return calendar.clinic_days(max(self.next_day, today or date.today()), self.remaining, self.weekdays)
+
+
+def _fetch_courses(c, where, params):
+    c.execute(COURSE_SELECT + where + COURSE_ORDER, params)
+    return [Course(*row) for row in c.fetchall()]
+
+def active_courses(c, until):
+    """Active courses that have started by `until`"""
+    return _fetch_courses(c, " WHERE tc.status = 'Active' AND tc.start_date <= %s", (until,))
+
+def get_courses(patient_id):
+    """A patient's treatment courses, oldest first"""
+    try:
+        with get_conn() as conn:
+            c = conn.cursor()
+            courses = _fetch_courses(c, " WHERE tc.patient_id = %s", (patient_id,))
+            c.close()
+        return courses
+    except Exception as e:
+        report_error(f"Error fetching courses: {e}")
+        return []
+
+def planned_sessions_for_date(day):
+    """(patient name, protocol name, course id) for unbooked course sessions that fall on `day`"""
+    try:
+        with get_conn() as conn:
+            c = conn.cursor()
+            courses = active_courses(c, day)
+            c.execute("SELECT id, name FROM patients WHERE id = ANY(%s)",
+                      ([course.patient_id for course in courses],))
+            names = dict(c.fetchall())
+            c.close()
+        planned, version = [], holidays_version()
+        for course in courses:
+            if course.remaining and course.next_day <= day:
+                calendar = get_clinic_calendar(course.next_day.year - 1, version)
+                if day in course.planned_dates(calendar):
+                    planned.append((names.get(course.patient_id), course.protocol_name, course.id))
+        return planned
+    except Exception as e:
+        report_error(f"Error expanding courses: {e}")
+        return []
+
+# ==================== BOOKING ====================
+
+def materialize_course(c, course_id, calendar, until, today=None):
+    """Book the course's unbooked sessions dated today to `until`; returns how many were booked.
+
+    Each new session gets a slot at the preferred time if a chair is free then, else at the
+    day's first free window; on a full day it stays unslotted for plan-next-day. An Active
+    course whose sessions are then all booked becomes 'Completed'.
+    """
+    c.execute("SELECT 1 FROM treatment_courses WHERE id = %s FOR UPDATE", (course_id,))
+    course = _fetch_courses(c, " WHERE tc.id = %s", (course_id,))[0]
+    dates = [day for day in course.planned_dates(calendar, today) if day <= until]
+    if course.status == "Active" and course.booked + len(dates) >= course.session_count:
+        c.execute("UPDATE treatment_courses SET status = 'Completed' WHERE id = %s", (course_id,))
+    if not dates:
+        return 0
+
+    c.execute("""SELECT GREATEST(
+                     (SELECT MAX(session_number) FROM tms_sessions WHERE patient_id = %(p)s),
+                     (SELECT MAX(session_number) FROM tms_sessions_archive WHERE patient_id = %(p)s))""",
+              {"p": course.patient_id})
+    next_number = (c.fetchone()[0] or 0) + 1
+    c.execute("""SELECT COALESCE((SELECT session_duration FROM protocol_library WHERE id = %s), %s),
+                        (SELECT allowed_time FROM patients WHERE id = %s)""",
+              (course.protocol_id, DEFAULT_SESSION_MINUTES, course.patient_id))
+    duration, allowed = c.fetchone()
+    sessions = execute_values(c, """
+        INSERT INTO tms_sessions (patient_id, session_number, session_date, protocol_id, status, course_id)
+        VALUES %s RETURNING id, session_date""",
+        [(course.patient_id, next_number + i, day, course.protocol_id, "Scheduled", course.id)
+         for i, day in enumerate(dates)], fetch=True)
+
+    preferred = clock_minutes(course.preferred_time)
+    not_before = allowed.hour * 60 + allowed.minute if allowed else OPEN_MINUTES
+    day_slots = load_day_slots(c, dates)
+    slots = []
+    for session_id, day in sessions:
+        schedule = day_slots[day]
+        start = preferred if preferred is not None and schedule.fits(preferred, duration) \
+            else schedule.first_free(duration, not_before)
+        if start is not None:
+            schedule.book(start, duration)
+            slots.append((day, session_id, clock(start), duration, "Scheduled"))
+    if slots:
+        execute_values(c, """INSERT INTO daily_slots (slot_date, session_id, scheduled_time, slot_duration, status)
+                             VALUES %s""", slots)
+    return len(dates)
+
+def _unbook(c, course_id, from_date):
+    """Delete the course's scheduled sessions from `from_date` on and close the numbering gap"""
+    c.execute("""DELETE FROM tms_sessions WHERE course_id = %s AND status = 'Scheduled' AND session_date >= %s
+                 RETURNING patient_id, session_number""", (course_id, from_date))
+    removed = c.fetchall()
+    if removed:
+        c.execute("""UPDATE tms_sessions ts
+                     SET session_number = ts.session_number
+                         - (SELECT COUNT(*) FROM unnest(%s::int[]) AS gone (n) WHERE gone.n < ts.session_number)
+                     WHERE ts.patient_id = %s AND ts.session_number > %s""",
+                  ([number for _, number in removed], removed[0][0], min(number for _, number in removed)))
+    return len(removed)
+
+def create_course(patient_id, protocol_id, start_date, session_count, weekdays=None, preferred_time=None):
+    """Add a course and book its sessions within the horizon; returns (course id, sessions booked)"""
+    try:
+        with get_conn() as conn:
+            c = conn.cursor()
+            c.execute("""INSERT INTO treatment_courses
+                         (patient_id, protocol_id, start_date, session_count, weekdays, preferred_time)
+                         VALUES (%s, %s, %s, %s, %s, %s) RETURNING id""",
+                      (patient_id, protocol_id, start_date, session_count,
+                       sorted(weekdays or COURSE_WEEKDAYS), preferred_time or None))
+            course_id = c.fetchone()[0]
+            booked = materialize_course(c, course_id, get_clinic_calendar(start_date.year - 1),
+                                        max(start_date, date.today()) + timedelta(days=COURSE_HORIZON_DAYS))
+            c.close()
+        return course_id, booked
+    except Exception as e:
+        report_error(f"Error creating course: {e}")
+        return None, 0
+
+def change_course_protocol(course_id, protocol_id):
+    """Switch the course, and its booked sessions still to come, to another protocol"""
+    try:
+        with get_conn() as conn:
+            c = conn.cursor()
+            c.execute("UPDATE treatment_courses SET protocol_id = %s WHERE id = %s", (protocol_id, course_id))
+            c.execute("""UPDATE tms_sessions SET protocol_id = %s
+                         WHERE course_id = %s AND status = 'Scheduled'""", (protocol_id, course_id))
+            c.execute("""UPDATE daily_slots ds SET slot_duration = COALESCE(pl.session_duration, ds.slot_duration)
+                         FROM tms_sessions ts, protocol_library pl
+                         WHERE ds.session_id = ts.id AND ts.course_id = %s AND ts.status = 'Scheduled'
+                           AND pl.id = %s""", (course_id, protocol_id))
+            c.close()
+        return True
+    except Exception as e:
+        report_error(f"Error changing course protocol: {e}")
+        return False
+
+def pause_course(course_id, from_date):
+    """Stop the course from `from_date`; its booked sessions from then on are released"""
+    try:
+        with get_conn() as conn:
+            c = conn.cursor()
+            released = _unbook(c, course_id, from_date)
+            c.execute("UPDATE treatment_courses SET status = 'Paused' WHERE id = %s", (course_id,))
+            c.close()
+        return released
+    except Exception as e:
+        report_error(f"Error pausing course: {e}")
+        return None
+
+def resume_course(course_id, from_date):
+    """Restart a paused course on `from_date`; returns sessions booked"""
+    try:
+        with get_conn() as conn:
+            c = conn.cursor()
+            c.execute("UPDATE treatment_courses SET status = 'Active', start_date = %s WHERE id = %s",
+                      (from_date, course_id))
+            booked = materialize_course(c, course_id, get_clinic_calendar(from_date.year - 1),
+                                        max(from_date, date.today()) + timedelta(days=COURSE_HORIZON_DAYS))
+            c.close()
+        return booked
+    except Exception as e:
+        report_error(f"Error resuming course: {e}")
+        return None
+
+def cancel_course(course_id):
+    """End the course: earlier sessions stay, scheduled ones from today on are released"""
+    try:
+        with get_conn() as conn:
+            c = conn.cursor()
+            released = _unbook(c, course_id, date.today())
+            c.execute("UPDATE treatment_courses SET status = 'Cancelled' WHERE id = %s", (course_id,))
+            c.close()
+        return released
+    except Exception as e:
+        report_error(f"Error cancelling course: {e}")
+        return None
+
+def materialize_courses(conn, today, chunk_size):
+    """Nightly: book every active course's sessions up to today + COURSE_HORIZON_DAYS, chunk_size courses per commit.
+
+    Active courses already fully booked are included, so they are marked 'Completed'.
+    """
+    calendar = build_calendar(conn, date(today.year - 1, 1, 1), date(today.year + CALENDAR_YEARS, 12, 31))
+    until = today + timedelta(days=COURSE_HORIZON_DAYS)
+    c = conn.cursor()
+    c.execute("""SELECT tc.id FROM treatment_courses tc
+                 WHERE tc.status = 'Active' AND tc.start_date <= %s
+                 ORDER BY tc.id""", (until,))
+    course_ids = [row[0] for row in c.fetchall()]
+    booked = chunks = 0
+    for start in range(0, len(course_ids), chunk_size):
+        for course_id in course_ids[start:start + chunk_size]:
+            booked += materialize_course(c, course_id, calendar, until, today)
+        conn.commit()
+        chunks += 1
+    c.close()
+    return booked, len(course_ids), chunks
@@ -0,0 +1,594 @@
+# -*- coding: utf-8 -*-
+"""
+Data helpers shared by the dashboard pages.
+"""
+from collections import namedtuple
+from datetime import timedelta
+
+import streamlit as st
+from psycopg2.extras import execute_values
+
+from tms_app.change_feed import CHANGE_OVERLAP_SECONDS
+from tms_app.clinic_calendar import CLOSE_MINUTES, DEFAULT_SESSION_MINUTES, get_clinic_calendar
+from tms_app.db import (
+    execute_named,
+    execute_query,
+    execute_update,
+    get_conn,
+    report_error,
+)
+from tms_app.parameters import save_parameter_version
+from tms_app.waitlist import backfill_slots
+
+# ==================== ROW TYPES ====================
+
+# Small lookups used to build selectbox options; DataFrames are kept for tables.
+
+class Protocol(namedtuple("Protocol", "id protocol_name waveform_type session_duration")):
+    __slots__ = ()
+
+class Patient(namedtuple("Patient", "id name mrn age gender primary_diagnosis status allowed_time")):
+    __slots__ = ()
+
+    @property
+    def label(self):
+        return f"{self.name} (MRN: {self.mrn})"
+
+class SessionRow(namedtuple("SessionRow", "id session_number session_date status")):
+    __slots__ = ()
+
+class BulkResult(namedtuple("BulkResult", "id label result")):
+    """One row of a bulk action's summary"""
+    __slots__ = ()
+
+class RosterDay(namedtuple("RosterDay", "roster_date sr_name jr1_name jr2_name")):
+    __slots__ = ()
+
+# ==================== HELPER FUNCTIONS ====================
+
+def get_protocols():
+    """Fetch all protocols from database as Protocol rows"""
+    try:
+        results = execute_query("SELECT id, protocol_name, waveform_type, session_duration FROM protocol_library ORDER BY protocol_name")
+        return [Protocol._make(row) for row in results or []]
+    except Exception as e:
+        report_error(f"Error fetching protocols: {e}")
+        return []
+
+def get_patients():
+    """Fetch all patients from database as Patient rows"""
+    try:
+        results = execute_query("SELECT id, name, mrn, age, gender, primary_diagnosis, status, allowed_time FROM patients ORDER BY referred_date DESC")
+        return [Patient._make(row) for row in results or []]
+    except Exception as e:
+        report_error(f"Error fetching patients: {e}")
+        return []
+
+def get_sessions_for_patient(patient_id):
+    """Fetch all sessions for a patient as SessionRow rows"""
+    try:
+        results = execute_named("sessions_for_patient", (patient_id,))
+        return [SessionRow._make(row) for row in results or []]
+    except Exception as e:
+        report_error(f"Error fetching sessions: {e}")
+        return []
+
+def calculate_intensity(percent_rmt, rmt_value):
+    """Calculate intensity output from RMT percentage"""
+    if rmt_value and percent_rmt:
+        return int((percent_rmt / 100) * rmt_value)
+    return None
+
+def get_next_session_number(patient_id):
+    """Get next session number for a patient"""
+    try:
+        result = execute_named("next_session_number", (patient_id,), fetch_one=True)
+        if result and result[0]:
+            return int(result[0]) + 1
+        return 1
+    except Exception as e:
+        report_error(f"Error getting session number: {e}")
+        return 1
+
+def get_previous_session_parameters(patient_id):
+    """Get previous session parameters for auto-population"""
+    try:
+        result = execute_named("current_parameters", (patient_id,), fetch_one=True)
+        return result
+    except Exception as e:
+        return None
+
+# Backstop for writes the change feed doesn't see (protocols, parameters from other processes)
+WORKLIST_CACHE_TTL = timedelta(minutes=10)
+
+@st.cache_data(ttl=WORKLIST_CACHE_TTL, max_entries=8, show_spinner=False)
+def load_session_worklist(day, version=None):
+    """Load the day's scheduled sessions with each patient's latest parameters, in one query.
+
+    Returns (worklist, protocol_options): worklist maps patient_id -> dict with the
+    scheduled session and `prev_params` (same layout as get_previous_session_parameters),
+    protocol_options maps protocol_name -> id. Pass get_change_version() as `version` so
+    session writes from the batch jobs and the API start a fresh load; writes made here
+    that change today's worklist also call load_session_worklist.clear().
+    """
+    # Uses get_conn directly so a DB error raises instead of caching an empty worklist
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute("""
+            SELECT p.id, p.name, p.mrn,
+                   ts.id, ts.session_number, ts.protocol_id, pl.protocol_name,
+                   pv.id,
+                   pv.target_laterality, pv.target_region, pv.coord_left_x, pv.coord_left_y,
+                   pv.coord_right_x, pv.coord_right_y, pv.rmt_left, pv.rmt_right,
+                   pv.intensity_percent_left, pv.intensity_percent_right,
+                   pv.intensity_output_left, pv.intensity_output_right, pv.coil_type, pv.protocol_id
+            FROM tms_sessions ts
+            JOIN patients p ON p.id = ts.patient_id
+            LEFT JOIN protocol_library pl ON pl.id = ts.protocol_id
+            LEFT JOIN current_parameters cp ON cp.patient_id = ts.patient_id
+            LEFT JOIN parameter_versions pv ON pv.id = cp.version_id
+            WHERE ts.session_date = %s AND ts.status = 'Scheduled'
+            ORDER BY p.name, ts.session_number
+        """, (day,))
+        rows = c.fetchall()
+        c.execute("SELECT protocol_name, id FROM protocol_library ORDER BY protocol_name")
+        protocol_options = {name: int(pid) for name, pid in c.fetchall()}
+        c.close()
+
+    worklist = {}
+    for row in rows:
+        patient_id = int(row[0])
+        if patient_id in worklist:
+            continue  # keep the earliest scheduled session for the day
+        worklist[patient_id] = {
+            "name": row[1],
+            "mrn": row[2],
+            "session_id": int(row[3]),
+            "session_number": int(row[4]),
+            "protocol_id": int(row[5]) if row[5] else None,
+            "protocol_name": row[6],
+            "prev_params": tuple(row[8:]) if row[7] is not None else None,
+        }
+    return worklist, protocol_options
+
+def save_session_parameters(patient_id, session_id, params):
+    """Record the session's parameters (a new version only if they changed)"""
+    try:
+        with get_conn() as conn:
+            c = conn.cursor()
+            save_parameter_version(c, patient_id, session_id or None, params)
+            c.close()
+        return True
+    except Exception as e:
+        report_error(f"Error saving parameters: {e}")
+        return False
+
+def get_previous_session_data(patient_id):
+    """Get previous session data for auto-population"""
+    try:
+        query = """SELECT ts.*, pl.protocol_name FROM tms_sessions ts
+                   LEFT JOIN protocol_library pl ON ts.protocol_id = pl.id
+                   WHERE ts.patient_id = %s ORDER BY ts.session_number DESC LIMIT 1"""
+        result = execute_query(query, (patient_id,), fetch_one=True)
+        if result:
+            return result
+        return None
+    except Exception as e:
+        return None
+
+def calculate_next_slot_time(current_date, session_duration_minutes):
+    """Calculate the next available slot time based on existing slots for the date"""
+    try:
+        results = execute_named("slots_for_date", (current_date,))
+        if not results:
+            return "09:00"
+
+        occupied_times = []
+        for slot_time_str, duration in results:
+            parts = slot_time_str.split(':')
+            slot_hour = int(parts[0])
+            slot_minute = int(parts[1])
+            start_minutes = slot_hour * 60 + slot_minute
+            end_minutes = start_minutes + int(duration)
+            occupied_times.append((start_minutes, end_minutes))
+
+        occupied_times.sort()
+        current_time_minutes = 9 * 60
+
+        for start, end in occupied_times:
+            if current_time_minutes + session_duration_minutes <= start:
+                hour = current_time_minutes // 60
+                minute = current_time_minutes % 60
+                return f"{hour:02d}:{minute:02d}"
+            current_time_minutes = end
+
+        hour = current_time_minutes // 60
+        minute = current_time_minutes % 60
+
+        if hour >= 17:
+            return "09:00"
+
+        return f"{hour:02d}:{minute:02d}"
+    except Exception as e:
+        report_error(f"Error calculating slot time: {e}")
+        return "09:00"
+
+def get_staff_for_date(date):
+    """Get staff assignment for a specific date"""
+    try:
+        result = execute_named("staff_for_date", (date,), fetch_one=True)
+        if result:
+            return result
+        return (None, None, None)
+    except Exception as e:
+        return (None, None, None)
+
+def save_staff_for_date(date, sr_name, jr1_name, jr2_name):
+    """Set the staff for one date (works whether or not slots exist yet)"""
+    return save_roster([RosterDay(date, sr_name, jr1_name, jr2_name)])
+
+def get_roster(start, end):
+    """Roster rows for start..end inclusive, as RosterDay rows (dates without staff are absent)"""
+    try:
+        results = execute_query(
+            """SELECT roster_date, sr_name, jr1_name, jr2_name FROM staff_roster
+            WHERE roster_date BETWEEN %s AND %s ORDER BY roster_date""",
+            (start, end)
+        )
+        return [RosterDay._make(row) for row in results or []]
+    except Exception as e:
+        report_error(f"Error fetching roster: {e}")
+        return []
+
+def save_roster(days):
+    """Upsert RosterDay rows in one statement; rows with no names are removed from the roster"""
+    try:
+        filled = [(day.roster_date, day.sr_name or None, day.jr1_name or None, day.jr2_name or None)
+                  for day in days if day.sr_name or day.jr1_name or day.jr2_name]
+        cleared = [day.roster_date for day in days if not (day.sr_name or day.jr1_name or day.jr2_name)]
+        with get_conn() as conn:
+            c = conn.cursor()
+            if filled:
+                execute_values(c, """
+                    INSERT INTO staff_roster (roster_date, sr_name, jr1_name, jr2_name)
+                    VALUES %s
+                    ON CONFLICT (roster_date) DO UPDATE
+                    SET sr_name = EXCLUDED.sr_name, jr1_name = EXCLUDED.jr1_name,
+                        jr2_name = EXCLUDED.jr2_name, updated_at = NOW()""", filled)
+            if cleared:
+                c.execute("DELETE FROM staff_roster WHERE roster_date = ANY(%s)", (cleared,))
+            c.close()
+        return True
+    except Exception as e:
+        report_error(f"Error saving roster: {e}")
+        return False
+
+SCHEDULE_COLUMNS = [
+    "Patient",
+    "Session#",
+    "Protocol",
+    "Target",
+    "Time",
+    "Allowed Time",
+    "Status",
+    "Intensity (L/R)",
+    "slot_id",
+    "session_id",
+]
+
+def get_daily_schedule(date):
+    """Fetch the schedule for a date (rows in SCHEDULE_COLUMNS order)"""
+    try:
+        results = execute_named("daily_schedule", (date,))
+        return results or []
+    except Exception as e:
+        report_error(f"Error fetching schedule: {e}")
+        return []
+
+def get_change_version():
+    """Latest change_log version (0 if nothing has changed yet)"""
+    try:
+        return execute_named("change_version", fetch_one=True)[0]
+    except Exception as e:
+        report_error(f"Error reading change feed: {e}")
+        return None
+
+def get_schedule_changes(date, since):
+    """[(version, session_id)] logged for `date` after version `since`, plus the recent overlap window"""
+    try:
+        return execute_named("schedule_changes", (date, since, CHANGE_OVERLAP_SECONDS)) or []
+    except Exception as e:
+        report_error(f"Error reading change feed: {e}")
+        return None
+
+def get_schedule_rows(date, session_ids):
+    """Current schedule rows for just these sessions on `date` (SCHEDULE_COLUMNS order)"""
+    try:
+        return execute_named("schedule_rows", (date, list(session_ids))) or []
+    except Exception as e:
+        report_error(f"Error fetching schedule: {e}")
+        return None
+
+# ==================== DELETE FUNCTIONS ====================
+
+def delete_session(session_id):
+    """Delete a session, renumber subsequent sessions for the same patient and back-fill its slot from the waitlist"""
+    try:
+        with get_conn() as conn:
+            c = conn.cursor()
+            # Get the patient_id and session_number of the session being deleted
+            c.execute("SELECT patient_id, session_number FROM tms_sessions WHERE id = %s", (session_id,))
+            result = c.fetchone()
+            if not result:
+                st.error("Session not found")
+                return False
+
+            patient_id, deleted_session_num = int(result[0]), int(result[1])
+
+            # Delete the session and its slot
+            c.execute("""DELETE FROM daily_slots WHERE session_id = %s
+                         RETURNING slot_date, scheduled_time, slot_duration, status""", (session_id,))
+            freed = [row[:3] for row in c.fetchall() if row[3] == 'Scheduled']
+            c.execute("DELETE FROM tms_sessions WHERE id = %s", (session_id,))
+
+            # Renumber all subsequent sessions for this patient
+            c.execute("""
+                UPDATE tms_sessions
+                SET session_number = session_number - 1
+                WHERE patient_id = %s AND session_number > %s
+            """, (patient_id, deleted_session_num))
+
+            backfilled = backfill_slots(c, freed)
+            c.close()
+
+        load_session_worklist.clear()
+        st.success(f"✅ Session #{deleted_session_num} deleted and subsequent sessions renumbered")
+        show_backfill(backfilled)
+        return True
+
+    except Exception as e:
+        report_error(f"Error deleting session: {e}")
+        return False
+
+def delete_patient(patient_id):
+    """Delete a patient and all dependent records (sessions, slots, parameters)."""
+    try:
+
+        # Optional: double-check patient exists
+        result = execute_query(
+            "SELECT id FROM patients WHERE id = %s",
+            (patient_id,),
+            fetch_one=True
+        )
+        if not result:
+            st.error("Patient not found")
+            return False
+
+        # Because of ON DELETE CASCADE on patients → tms_sessions → daily_slots/session_parameters,
+        # a single DELETE is enough if FKs are set correctly. Archived history has no FKs.
+        if execute_update("""
+            WITH archived_slots AS (
+                DELETE FROM daily_slots_archive
+                WHERE session_id IN (SELECT id FROM tms_sessions_archive WHERE patient_id = %s)
+            ), archived_sessions AS (
+                DELETE FROM tms_sessions_archive WHERE patient_id = %s
+            ), archived_params AS (
+                DELETE FROM session_parameters_archive WHERE patient_id = %s
+            )
+            DELETE FROM patients WHERE id = %s""", (patient_id,) * 4):
+            load_session_worklist.clear()
+            st.success("✅ Patient and all associated records deleted from database.")
+            return True
+        else:
+            return False
+
+    except Exception as e:
+        report_error(f"Error deleting patient: {e}")
+        return False
+
+# ==================== BULK ACTIONS ====================
+
+# Each action is one set-based statement over `id = ANY(...)` (plus, for
+# deletions, one renumbering statement and the waitlist back-fill) in a single
+# transaction, and returns a BulkResult per requested id.
+
+def bulk_set_patient_status(patient_ids, status):
+    """Set the status of many patients; result is 'updated', 'unchanged' or 'not found'"""
+    try:
+        with get_conn() as conn:
+            c = conn.cursor()
+            c.execute("""
+                WITH target AS (
+                    SELECT DISTINCT unnest(%(ids)s::int[]) AS id
+                ), updated AS (
+                    UPDATE patients p SET status = %(status)s
+                    FROM target WHERE p.id = target.id AND p.status IS DISTINCT FROM %(status)s
+                    RETURNING p.id
+                )
+                SELECT t.id, COALESCE(p.name || ' (MRN: ' || p.mrn || ')', '#' || t.id),
+                       CASE WHEN u.id IS NOT NULL THEN 'updated'
+                            WHEN p.id IS NULL THEN 'not found'
+                            ELSE 'unchanged' END
+                FROM target t
+                LEFT JOIN patients p ON p.id = t.id
+                LEFT JOIN updated u ON u.id = t.id
+                ORDER BY t.id""", {"ids": list(patient_ids), "status": status})
+            results = [BulkResult(*row) for row in c.fetchall()]
+            c.close()
+        return results
+    except Exception as e:
+        report_error(f"Error updating patients: {e}")
+        return []
+
+def bulk_set_session_status(session_ids, status):
+    """Set the status of many sessions and their slots; only 'Scheduled' ones change"""
+    try:
+        with get_conn() as conn:
+            c = conn.cursor()
+            c.execute("""
+                WITH target AS (
+                    SELECT DISTINCT unnest(%(ids)s::int[]) AS id
+                ), updated AS (
+                    UPDATE tms_sessions ts SET status = %(status)s
+                    FROM target WHERE ts.id = target.id AND ts.status = 'Scheduled'
+                    RETURNING ts.id
+                ), slots AS (
+                    UPDATE daily_slots ds SET status = %(status)s
+                    FROM updated WHERE ds.session_id = updated.id
+                )
+                SELECT t.id, COALESCE(p.name || ' #' || ts.session_number, '#' || t.id),
+                       CASE WHEN u.id IS NOT NULL THEN 'updated'
+                            WHEN ts.id IS NULL THEN 'not found'
+                            ELSE 'skipped (' || ts.status || ')' END
+                FROM target t
+                LEFT JOIN tms_sessions ts ON ts.id = t.id
+                LEFT JOIN patients p ON p.id = ts.patient_id
+                LEFT JOIN updated u ON u.id = t.id
+                ORDER BY t.id""", {"ids": list(session_ids), "status": status})
+            results = [BulkResult(*row) for row in c.fetchall()]
+            c.close()
+        load_session_worklist.clear()
+        return results
+    except Exception as e:
+        report_error(f"Error updating sessions: {e}")
+        return []
+
+def bulk_delete_sessions(session_ids):
+    """Delete many sessions (their slots cascade) and renumber each patient's later sessions"""
+    try:
+        session_ids = list(dict.fromkeys(session_ids))
+        with get_conn() as conn:
+            c = conn.cursor()
+            # The slots would cascade; deleting them first says which chair time was freed
+            c.execute("""DELETE FROM daily_slots WHERE session_id = ANY(%s)
+                         RETURNING slot_date, scheduled_time, slot_duration, status""", (session_ids,))
+            freed = [row[:3] for row in c.fetchall() if row[3] == 'Scheduled']
+            c.execute("""
+                DELETE FROM tms_sessions ts USING patients p
+                WHERE ts.id = ANY(%s) AND p.id = ts.patient_id
+                RETURNING ts.id, p.name || ' #' || ts.session_number, ts.patient_id, ts.session_number""",
+                (session_ids,))
+            deleted = c.fetchall()
+            if deleted:
+                # Every remaining session moves down by the number of deleted sessions before it
+                c.execute("""
+                    UPDATE tms_sessions ts SET session_number = ts.session_number - shift.n
+                    FROM (SELECT ts2.id, COUNT(*) AS n
+                          FROM tms_sessions ts2
+                          JOIN unnest(%s::int[], %s::int[]) AS gone (patient_id, session_number)
+                            ON gone.patient_id = ts2.patient_id AND gone.session_number < ts2.session_number
+                          GROUP BY ts2.id) shift
+                    WHERE ts.id = shift.id""",
+                    ([row[2] for row in deleted], [row[3] for row in deleted]))
+            backfilled = backfill_slots(c, freed)
+            c.close()
+        load_session_worklist.clear()
+        show_backfill(backfilled)
+        labels = {row[0]: row[1] for row in deleted}
+        return [BulkResult(session_id, labels.get(session_id, f"#{session_id}"),
+                           "deleted" if session_id in labels else "not found")
+                for session_id in session_ids]
+    except Exception as e:
+        report_error(f"Error deleting sessions: {e}")
+        return []
+
+def bulk_reschedule_sessions(session_ids, new_date):
+    """Move many scheduled sessions to `new_date`, packed in their current order after that day's slots.
+
+    Nothing moves to a day the clinic is closed; a session starts no earlier than the
+    patient's allowed time, and one that would run past closing time is skipped.
+    """
+    ids = sorted(set(session_ids))
+    try:
+        if not get_clinic_calendar(new_date.year - 1).is_open(new_date):
+            return [BulkResult(session_id, f"#{session_id}", "skipped (clinic closed)") for session_id in ids]
+        with get_conn() as conn:
+            c = conn.cursor()
+            c.execute("""
+                SELECT ds.id, ds.session_id, COALESCE(ds.slot_duration, %s),
+                       EXTRACT(HOUR FROM p.allowed_time)::int * 60 + EXTRACT(MINUTE FROM p.allowed_time)::int
+                FROM daily_slots ds
+                JOIN tms_sessions ts ON ts.id = ds.session_id
+                JOIN patients p ON p.id = ts.patient_id
+                WHERE ds.session_id = ANY(%s) AND ts.status = 'Scheduled'
+                ORDER BY ds.slot_date, ds.scheduled_time, ds.id
+                FOR UPDATE OF ds, ts""", (DEFAULT_SESSION_MINUTES, ids))
+            moving = c.fetchall()
+            c.execute("""
+                SELECT COALESCE(MAX(split_part(scheduled_time, ':', 1)::int * 60
+                                    + split_part(scheduled_time, ':', 2)::int + slot_duration), 9 * 60)
+                FROM daily_slots WHERE slot_date = %s AND NOT session_id = ANY(%s)""",
+                (new_date, [session_id for _, session_id, _, _ in moving]))
+            next_start = c.fetchone()[0]
+            placed, late = [], []
+            for slot_id, session_id, duration, allowed in moving:
+                start = max(next_start, allowed or 0)
+                if start + duration > CLOSE_MINUTES:
+                    late.append(session_id)
+                    continue
+                placed.append((slot_id, session_id, start))
+                next_start = start + duration
+
+            c.execute("""
+                WITH target AS (
+                    SELECT unnest(%(ids)s::int[]) AS id
+                ), placed AS (
+                    SELECT * FROM unnest(%(slots)s::int[], %(sessions)s::int[], %(starts)s::int[])
+                        AS p (slot_id, session_id, start_minutes)
+                ), sessions AS (
+                    UPDATE tms_sessions ts SET session_date = %(day)s
+                    FROM placed WHERE ts.id = placed.session_id
+                ), moved AS (
+                    UPDATE daily_slots ds
+                    SET slot_date = %(day)s,
+                        scheduled_time = lpad((placed.start_minutes / 60)::text, 2, '0') || ':'
+                                         || lpad(mod(placed.start_minutes, 60)::text, 2, '0')
+                    FROM placed WHERE ds.id = placed.slot_id
+                    RETURNING ds.session_id, ds.scheduled_time
+                )
+                SELECT t.id, COALESCE(p.name || ' #' || ts.session_number, '#' || t.id),
+                       CASE WHEN m.session_id IS NOT NULL THEN 'moved to ' || m.scheduled_time
+                            WHEN ts.id IS NULL THEN 'not found'
+                            WHEN ts.status <> 'Scheduled' THEN 'skipped (' || ts.status || ')'
+                            WHEN t.id = ANY(%(late)s) THEN 'skipped (past closing time)'
+                            ELSE 'skipped (no slot)' END
+                FROM target t
+                LEFT JOIN tms_sessions ts ON ts.id = t.id
+                LEFT JOIN patients p ON p.id = ts.patient_id
+                LEFT JOIN moved m ON m.session_id = t.id
+                ORDER BY t.id""",
+                {"ids": ids, "day": new_date, "late": late,
+                 "slots": [row[0] for row in placed], "sessions": [row[1] for row in placed],
+                 "starts": [row[2] for row in placed]})
+            results = [BulkResult(*row) for row in c.fetchall()]
+            c.close()
+        load_session_worklist.clear()
+        return results
+    except Exception as e:
+        report_error(f"Error rescheduling sessions: {e}")
+        return []
+
+def show_backfill(backfilled):
+    """One line per freed slot that went to a waiting patient"""
+    for row in backfilled:
+        st.toast(f"♻️ {row.slot_date:%d %b} {row.scheduled_time} given to {row.patient_name} from the waitlist "
+                 f"({row.booked} course sessions booked)")
+
+def show_bulk_results(results, action):
+    """Summary line per outcome plus a per-row table"""
+    if not results:
+        return
+    counts = {}
+    for row in results:
+        outcome = row.result.split(" (")[0] if row.result.startswith("skipped") else row.result
+        outcome = "moved" if outcome.startswith("moved to") else outcome
+        counts[outcome] = counts.get(outcome, 0) + 1
+    done = sum(n for outcome, n in counts.items() if outcome in ("updated", "deleted", "moved"))
+    summary = ", ".join(f"{n} {outcome}" for outcome, n in counts.items())
+    if done == len(results):
+        st.success(f"✅ {action}: {summary}")
+    else:
+        st.warning(f"⚠️ {action}: {summary}")
+    with st.expander("Details", expanded=done != len(results)):
+        st.dataframe([{"Item": row.label, "Result": row.result} for row in results],
+                     use_container_width=True, hide_index=True)
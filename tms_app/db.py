@@ -0,0 +1,461 @@
+# -*- coding: utf-8 -*-
+"""
+Database access: connections, query helpers and schema creation.
+"""
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import psycopg2
+import psycopg2.extensions
+from psycopg2.pool import PoolError, ThreadedConnectionPool
+import streamlit as st
+
+from tms_app.change_feed import create_change_feed
+from tms_app.parameters import PARAMETER_COLUMNS, backfill_parameter_versions
+from tms_app.partitions import create_archive_tables
+from tms_app.queries import HOT_QUERIES
+
+# ==================== NUMPY ADAPTERS ====================
+
+# Values read back from DataFrames / widgets can be numpy scalars; teach psycopg2
+# to pass them as the matching Python types (registered once, at import).
+psycopg2.extensions.register_adapter(np.integer, lambda value: psycopg2.extensions.adapt(int(value)))
+psycopg2.extensions.register_adapter(np.floating, lambda value: psycopg2.extensions.adapt(float(value)))
+psycopg2.extensions.register_adapter(np.bool_, lambda value: psycopg2.extensions.adapt(bool(value)))
+psycopg2.extensions.register_adapter(np.ndarray, lambda value: psycopg2.extensions.adapt(value.tolist()))
+
+# ==================== DATABASE FUNCTIONS ====================
+
+_local = threading.local()
+
+@contextmanager
+def raise_errors():
+    """Make query helpers re-raise DB errors instead of showing st.error.
+
+    For callers without a UI (the JSON API, batch jobs) that must not mistake
+    a failed query for an empty result.
+    """
+    previous = getattr(_local, "raise_errors", False)
+    _local.raise_errors = True
+    try:
+        yield
+    finally:
+        _local.raise_errors = previous
+
+def report_error(message):
+    """Show an error in the UI, or re-raise the active exception inside raise_errors()"""
+    if getattr(_local, "raise_errors", False):
+        raise
+    st.error(message)
+
+def _get_db_kwargs():
+    # Postgres' default random_page_cost (4) assumes spinning disks and has the planner hash-join
+    # a whole table rather than look up a day's few dozen rows by index; DB_RANDOM_PAGE_COST = 4 restores it
+    options = f"-c random_page_cost={float(get_setting('DB_RANDOM_PAGE_COST', 1.1))}"
+    # Processes outside Streamlit (API, batch jobs) can point at a database by URL
+    if os.environ.get("TMS_DATABASE_URL"):
+        return dict(dsn=os.environ["TMS_DATABASE_URL"], options=options)
+    return dict(
+        host=st.secrets["DB_HOST"],
+        port=st.secrets["DB_PORT"],
+        database=st.secrets["DB_NAME"],
+        user=st.secrets["DB_USER"],
+        password=st.secrets["DB_PASSWORD"],
+        options=options,
+    )
+
+def get_setting(name, default):
+    """TMS_<NAME> from the environment, else <NAME> from st.secrets, else default"""
+    if os.environ.get(f"TMS_{name}"):
+        return os.environ[f"TMS_{name}"]
+    try:
+        return st.secrets.get(name, default)
+    except Exception:
+        return default
+
+class TrackedConnection(psycopg2.extensions.connection):
+    """Connection that remembers which hot queries are PREPAREd on it"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool():
+    """Process-wide connection pool, created on first use"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadedConnectionPool(
+                    1, int(get_setting("DB_POOL_MAX", 10)),
+                    connection_factory=TrackedConnection, **_get_db_kwargs())
+    return _pool
+
+def take_db_time():
+    """Seconds this thread spent holding database connections since the last call (and reset)"""
+    seconds = getattr(_local, "db_seconds", 0.0)
+    _local.db_seconds = 0.0
+    return seconds
+
+@contextmanager
+def get_conn():
+    started = time.perf_counter()
+    pool = _get_pool()
+    try:
+        conn = pool.getconn()
+    except PoolError:
+        # Pool exhausted: fall back to a one-off connection rather than failing the rerun
+        pool = None
+        conn = psycopg2.connect(connection_factory=TrackedConnection, **_get_db_kwargs())
+    conn.autocommit = False
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        if pool is None:
+            conn.close()
+        else:
+            pool.putconn(conn, close=bool(conn.closed))
+        _local.db_seconds = getattr(_local, "db_seconds", 0.0) + time.perf_counter() - started
+
+# ==================== PREPARED HOT QUERIES ====================
+
+# Named PREPAREd statements need session pooling; set DB_PREPARE = false (or
+# TMS_DB_PREPARE=0) behind a transaction-pooling pgbouncer.
+PREPARE_ENABLED = str(get_setting("DB_PREPARE", "true")).lower() not in ("0", "false", "no")
+
+_stats_lock = threading.Lock()
+_query_stats = {name: {"prepares": 0, "executions": 0, "total_ms": 0.0} for name in HOT_QUERIES}
+
+def query_stats():
+    """Per-query counters for this process: prepares (one per connection), executions and total time"""
+    with _stats_lock:
+        return {name: dict(counts) for name, counts in _query_stats.items()}
+
+def _count(name, key, amount=1):
+    with _stats_lock:
+        _query_stats[name][key] += amount
+
+def _run_named(c, name, params):
+    sql = HOT_QUERIES[name]
+    if not PREPARE_ENABLED:
+        c.execute(re.sub(r"\$(\d+)", r"%(p\1)s", sql),
+                  {f"p{i}": value for i, value in enumerate(params, start=1)})
+        return
+    conn = c.connection
+    if name not in conn.prepared:
+        c.execute(f"PREPARE tms_{name} AS {sql}")
+        conn.prepared.add(name)
+        _count(name, "prepares")
+    if params:
+        c.execute(f"EXECUTE tms_{name} ({', '.join(['%s'] * len(params))})", params)
+    else:
+        c.execute(f"EXECUTE tms_{name}")
+
+def execute_named(name, params=(), fetch_one=False):
+    """Run a query from HOT_QUERIES by name, preparing it on first use per connection"""
+    try:
+        with get_conn() as conn:
+            c = conn.cursor()
+            started = time.perf_counter()
+            _run_named(c, name, params)
+            result = c.fetchone() if fetch_one else c.fetchall()
+            _count(name, "executions")
+            _count(name, "total_ms", (time.perf_counter() - started) * 1000)
+            c.close()
+            return result
+    except Exception as e:
+        report_error(f"Query error ({name}): {e}")
+        return None
+
+
+def execute_query(query, params=None, fetch_one=False, fetch_all=True):
+    try:
+        with get_conn() as conn:
+            c = conn.cursor()
+            c.execute(query, params)
+            if fetch_one:
+                result = c.fetchone()
+            elif fetch_all:
+                result = c.fetchall()
+            else:
+                result = None
+            c.close()
+            return result
+    except Exception as e:
+        report_error(f"Query error: {e}")
+        return None
+
+def execute_update(query, params=None):
+    try:
+        with get_conn() as conn:
+            c = conn.cursor()
+            c.execute(query, params)
+            c.close()
+        return True
+    except Exception as e:
+        report_error(f"Update error: {e}")
+        return False
+
+def execute_insert_with_return(query, params=None):
+    try:
+        with get_conn() as conn:
+            c = conn.cursor()
+            c.execute(query, params)
+            result = c.fetchone()[0] if c.description else None
+            c.close()
+        return int(result) if result else None
+    except Exception as e:
+        report_error(f"Insert error: {e}")
+        return None
+
+def create_tables():
+    """Create all required tables"""
+    try:
+        with get_conn() as conn:
+            c = conn.cursor()
+
+            # Patients table
+            c.execute("""
+            CREATE TABLE IF NOT EXISTS patients
+            (id SERIAL PRIMARY KEY,
+             name TEXT NOT NULL,
+             mrn TEXT UNIQUE NOT NULL,
+             age INTEGER,
+             gender TEXT,
+             primary_diagnosis TEXT,
+             tass_completed INTEGER DEFAULT 0,
+             consent_obtained INTEGER DEFAULT 0,
+             referred_date DATE,
+             status TEXT DEFAULT 'Pending Review')
+            """)
+            c.execute("ALTER TABLE patients ADD COLUMN IF NOT EXISTS allowed_time TIME")
+
+            # Protocol Library table
+            c.execute("""
+            CREATE TABLE IF NOT EXISTS protocol_library
+            (id SERIAL PRIMARY KEY,
+             protocol_name TEXT UNIQUE NOT NULL,
+             waveform_type TEXT,
+             burst_pulses INTEGER,
+             inter_pulse_interval REAL,
+             pulse_rate REAL,
+             pulses_per_train INTEGER,
+             num_trains INTEGER,
+             inter_train_interval REAL,
+             session_duration INTEGER)
+            """)
+
+            # TMS Sessions table
+            c.execute("""
+            CREATE TABLE IF NOT EXISTS tms_sessions
+            (id SERIAL PRIMARY KEY,
+             patient_id INTEGER,
+             session_number INTEGER,
+             session_date DATE,
+             protocol_id INTEGER,
+             target_laterality TEXT,
+             target_region TEXT,
+             coord_left_x REAL,
+             coord_left_y REAL,
+             coord_right_x REAL,
+             coord_right_y REAL,
+             rmt_left REAL,
+             rmt_right REAL,
+             intensity_percent_left REAL,
+             intensity_percent_right REAL,
+             intensity_output_left INTEGER,
+             intensity_output_right INTEGER,
+             coil_type TEXT,
+             side_effects TEXT,
+             remarks TEXT,
+             status TEXT DEFAULT 'Pending',
+             FOREIGN KEY (patient_id) REFERENCES patients(id) ON DELETE CASCADE,
+             FOREIGN KEY (protocol_id) REFERENCES protocol_library(id) ON DELETE SET NULL)
+            """)
+
+            # Treatment courses (tms_app/courses.py); only sessions within the booking horizon exist
+            # as tms_sessions rows, linked back through course_id
+            c.execute("""
+            CREATE TABLE IF NOT EXISTS treatment_courses
+            (id SERIAL PRIMARY KEY,
+             patient_id INTEGER NOT NULL REFERENCES patients(id) ON DELETE CASCADE,
+             protocol_id INTEGER REFERENCES protocol_library(id) ON DELETE SET NULL,
+             start_date DATE NOT NULL,
+             session_count INTEGER NOT NULL CHECK (session_count > 0),
+             weekdays INTEGER[] NOT NULL DEFAULT '{0,1,2,3,4,5}',
+             preferred_time TEXT,
+             status TEXT NOT NULL DEFAULT 'Active',
+             created_at TIMESTAMP DEFAULT NOW())
+            """)
+            c.execute("""ALTER TABLE tms_sessions ADD COLUMN IF NOT EXISTS course_id INTEGER
+                         REFERENCES treatment_courses(id) ON DELETE SET NULL""")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_tms_sessions_course ON tms_sessions (course_id)")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_treatment_courses_patient ON treatment_courses (patient_id)")
+
+            # Waitlist settings for 'Review Done' patients (tms_app/waitlist.py)
+            c.execute("""
+            CREATE TABLE IF NOT EXISTS waitlist
+            (patient_id INTEGER PRIMARY KEY REFERENCES patients(id) ON DELETE CASCADE,
+             priority INTEGER NOT NULL DEFAULT 0,
+             protocol_id INTEGER REFERENCES protocol_library(id) ON DELETE SET NULL,
+             session_count INTEGER CHECK (session_count > 0),
+             updated_at TIMESTAMP DEFAULT NOW())
+            """)
+
+            # Daily Slots table
+            c.execute("""
+            CREATE TABLE IF NOT EXISTS daily_slots
+            (id SERIAL PRIMARY KEY,
+             slot_date DATE,
+             session_id INTEGER,
+             scheduled_time TEXT,
+             slot_duration INTEGER,
+             status TEXT DEFAULT 'Scheduled',
+             sr_name TEXT,
+             jr1_name TEXT,
+             jr2_name TEXT,
+             FOREIGN KEY (session_id) REFERENCES tms_sessions(id) ON DELETE CASCADE)
+            """)
+
+            # Staff roster: one row per date (replaces the names copied onto every daily_slots row)
+            c.execute("SELECT to_regclass('staff_roster') IS NULL")
+            roster_is_new = c.fetchone()[0]
+            c.execute("""
+            CREATE TABLE IF NOT EXISTS staff_roster
+            (roster_date DATE PRIMARY KEY,
+             sr_name TEXT,
+             jr1_name TEXT,
+             jr2_name TEXT,
+             updated_at TIMESTAMP DEFAULT NOW())
+            """)
+            if roster_is_new:
+                c.execute("""
+                INSERT INTO staff_roster (roster_date, sr_name, jr1_name, jr2_name)
+                SELECT DISTINCT ON (slot_date) slot_date,
+                       NULLIF(sr_name, ''), NULLIF(jr1_name, ''), NULLIF(jr2_name, '')
+                FROM daily_slots
+                WHERE COALESCE(NULLIF(sr_name, ''), NULLIF(jr1_name, ''), NULLIF(jr2_name, '')) IS NOT NULL
+                ORDER BY slot_date
+                """)
+
+            # Holiday Calendar table
+            c.execute("""
+            CREATE TABLE IF NOT EXISTS holidays
+            (id SERIAL PRIMARY KEY,
+             holiday_date DATE UNIQUE,
+             holiday_name TEXT,
+             skip_enabled INTEGER DEFAULT 1)
+            """)
+
+            # Recurring holidays (tms_app/clinic_calendar.py): kind 'yearly' = month/day every year,
+            # 'nth_weekday' = nth (1-5, -1 last) weekday (0 = Monday) of month, or of every month if NULL
+            c.execute("""
+            CREATE TABLE IF NOT EXISTS holiday_rules
+            (id SERIAL PRIMARY KEY,
+             rule_name TEXT NOT NULL,
+             kind TEXT NOT NULL CHECK (kind IN ('yearly', 'nth_weekday')),
+             month INTEGER CHECK (month BETWEEN 1 AND 12),
+             day INTEGER CHECK (day BETWEEN 1 AND 31),
+             weekday INTEGER CHECK (weekday BETWEEN 0 AND 6),
+             nth INTEGER CHECK (nth BETWEEN 1 AND 5 OR nth = -1),
+             skip_enabled INTEGER DEFAULT 1,
+             CHECK (kind <> 'yearly' OR (month IS NOT NULL AND day IS NOT NULL)),
+             CHECK (kind <> 'nth_weekday' OR (weekday IS NOT NULL AND nth IS NOT NULL)))
+            """)
+
+            # Session Parameters History table
+            c.execute("""
+            CREATE TABLE IF NOT EXISTS session_parameters
+            (id SERIAL PRIMARY KEY,
+             patient_id INTEGER NOT NULL,
+             session_id INTEGER,
+             target_laterality TEXT,
+             target_region TEXT,
+             coord_left_x REAL,
+             coord_left_y REAL,
+             coord_right_x REAL,
+             coord_right_y REAL,
+             rmt_left REAL,
+             rmt_right REAL,
+             intensity_percent_left REAL,
+             intensity_percent_right REAL,
+             intensity_output_left INTEGER,
+             intensity_output_right INTEGER,
+             coil_type TEXT,
+             protocol_id INTEGER,
+             created_at TIMESTAMP DEFAULT NOW(),
+             updated_at TIMESTAMP DEFAULT NOW(),
+             FOREIGN KEY (patient_id) REFERENCES patients(id) ON DELETE CASCADE,
+             FOREIGN KEY (session_id) REFERENCES tms_sessions(id) ON DELETE SET NULL,
+             FOREIGN KEY (protocol_id) REFERENCES protocol_library(id) ON DELETE SET NULL)
+            """)
+
+            # Parameter versions: a row per change, not per session (tms_app/parameters.py)
+            c.execute(f"""
+            CREATE TABLE IF NOT EXISTS parameter_versions
+            (id SERIAL PRIMARY KEY,
+             patient_id INTEGER NOT NULL,
+             {", ".join(f"{name} {kind.upper()}" for name, kind in PARAMETER_COLUMNS)},
+             created_at TIMESTAMP DEFAULT NOW(),
+             FOREIGN KEY (patient_id) REFERENCES patients(id) ON DELETE CASCADE,
+             FOREIGN KEY (protocol_id) REFERENCES protocol_library(id) ON DELETE SET NULL)
+            """)
+            c.execute("CREATE INDEX IF NOT EXISTS idx_parameter_versions_patient ON parameter_versions (patient_id, id)")
+            c.execute("""
+            CREATE TABLE IF NOT EXISTS current_parameters
+            (patient_id INTEGER PRIMARY KEY REFERENCES patients(id) ON DELETE CASCADE,
+             version_id INTEGER NOT NULL REFERENCES parameter_versions(id) ON DELETE CASCADE,
+             updated_at TIMESTAMP DEFAULT NOW())
+            """)
+            c.execute("""ALTER TABLE tms_sessions ADD COLUMN IF NOT EXISTS parameter_version_id INTEGER
+                         REFERENCES parameter_versions(id) ON DELETE SET NULL""")
+            backfill_parameter_versions(c)
+
+            # Indexes backing the keyset-paginated list views
+            c.execute("CREATE INDEX IF NOT EXISTS idx_patients_status_referred ON patients (status, referred_date, id)")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_tms_sessions_patient_number ON tms_sessions (patient_id, session_number, id)")
+
+            # Indexes backing the Session Parameters worklist
+            c.execute("CREATE INDEX IF NOT EXISTS idx_tms_sessions_date_status ON tms_sessions (session_date, status)")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_session_parameters_patient_created ON session_parameters (patient_id, created_at DESC)")
+
+            # Index backing the schedule join and slot-time lookup for a date
+            c.execute("CREATE INDEX IF NOT EXISTS idx_daily_slots_date_time ON daily_slots (slot_date, scheduled_time)")
+
+            # Indexes backing the nightly batch jobs (tms_app/batch.py)
+            c.execute("CREATE INDEX IF NOT EXISTS idx_daily_slots_session ON daily_slots (session_id)")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_daily_slots_scheduled_date ON daily_slots (slot_date) WHERE status = 'Scheduled'")
+
+            # Ids of journal writes already applied (tms_app/journal.py)
+            c.execute("""
+            CREATE TABLE IF NOT EXISTS applied_writes
+            (write_id UUID PRIMARY KEY,
+             kind TEXT NOT NULL,
+             applied_at TIMESTAMP DEFAULT NOW())
+            """)
+
+            # updated_at + change_log triggers on the schedule tables (tms_app/change_feed.py)
+            create_change_feed(c)
+
+            # Monthly-partitioned archive of old history (tms_app/partitions.py)
+            create_archive_tables(c)
+            c.execute("""ALTER TABLE tms_sessions_archive ADD COLUMN IF NOT EXISTS course_id INTEGER,
+                                                          ADD COLUMN IF NOT EXISTS parameter_version_id INTEGER""")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_tms_sessions_archive_course ON tms_sessions_archive (course_id)")
+
+            c.close()
+        return True
+    except Exception as e:
+        report_error(f"Table creation error: {e}")
+        return False
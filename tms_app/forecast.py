@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+Chair-utilization forecast for the coming weeks.
+
+Every clinic day in the forecast is a row of BUCKET_MINUTES buckets counting
+the chairs in use, built with NumPy from:
+
+- booked daily_slots rows, at their time and for their duration;
+- scheduled sessions with no slot yet and the unbooked sessions of active
+  treatment courses (tms_app/courses.py): at the course's preferred time if
+  it has one, else in the day's first window with a chair free throughout;
+- pending referrals ('Pending Review' / 'Review Done' patients with no
+  sessions yet), waitlisted patients first in waitlist order, then oldest
+  first, each as a course of their waitlist length and protocol (default
+  DEFAULT_COURSE_SESSIONS sessions) starting on the first day after the
+  forecast's first day that it fits.
+
+A bucket is busy if any part of it is, and chairs are filled in order, so
+chair 1 is the busiest. Each day reports utilization within opening hours,
+peak concurrency and whether another session fits; the forecast also gives
+the first day a new course could start with a free window on each of its
+session days (days past the forecast count as free). Sessions with no free
+window within opening hours are counted as overflow, not placed.
+"""
+from collections import namedtuple
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from tms_app.clinic_calendar import (
+    CLINIC_CHAIRS,
+    CLOSE_MINUTES,
+    DEFAULT_SESSION_MINUTES,
+    OPEN_MINUTES,
+    get_clinic_calendar,
+    holidays_version,
+)
+from tms_app.courses import COURSE_WEEKDAYS, DEFAULT_COURSE_SESSIONS, active_courses
+from tms_app.db import execute_named, get_conn, report_error
+
+BUCKET_MINUTES = 5
+DAY_BUCKETS = 24 * 60 // BUCKET_MINUTES
+OPEN_BUCKETS = slice(OPEN_MINUTES // BUCKET_MINUTES, CLOSE_MINUTES // BUCKET_MINUTES)
+FORECAST_WEEKS = 6
+REFERRAL_STATUSES = ["Pending Review", "Review Done"]
+
+
+class Forecast(namedtuple("Forecast", "days occupancy table referrals new_course_start")):
+    """days: clinic days (datetime64); occupancy: chairs in use per day and bucket; table: one row per day;
+    referrals: [(patient name, projected start or None)]; new_course_start: date or None"""
+    __slots__ = ()
+
+
+def to_minutes(times):
+    """'HH:MM' strings -> array of minutes after midnight"""
+    times = np.asarray(times, dtype=str)
+    if not len(times):
+        return np.zeros(0, dtype=int)
+    hours, _, rest = np.moveaxis(np.char.partition(times, ":"), -1, 0)
+    return hours.astype(int) * 60 + np.char.partition(rest, ":")[:, 0].astype(int)
+
+# ==================== BUCKETS ====================
+
+def add_intervals(occupancy, rows, starts, durations):
+    """Add sessions (day row, start minute, duration) to the chairs-in-use grid"""
+    first = np.clip(starts // BUCKET_MINUTES, 0, DAY_BUCKETS)
+    last = np.clip(-(-(starts + durations) // BUCKET_MINUTES), 0, DAY_BUCKETS)
+    edges = np.zeros((len(occupancy), DAY_BUCKETS + 1), dtype=occupancy.dtype)
+    np.add.at(edges, (rows, first), 1)
+    np.add.at(edges, (rows, last), -1)
+    occupancy += np.cumsum(edges[:, :-1], axis=1)
+
+def free_windows(occupancy, buckets, chairs):
+    """Per row: first bucket of a `buckets` window within opening hours with a chair free throughout, else -1"""
+    free = occupancy[:, OPEN_BUCKETS] < chairs
+    if buckets > free.shape[1]:
+        return np.full(len(occupancy), -1)
+    fits = np.lib.stride_tricks.sliding_window_view(free, buckets, axis=1).all(axis=2)
+    return np.where(fits.any(axis=1), fits.argmax(axis=1) + OPEN_BUCKETS.start, -1)
+
+def place_sessions(occupancy, rows, durations, chairs):
+    """Put untimed sessions into their day's first free window; returns how many did not fit, per day row.
+
+    Sessions are placed by their rank within the day, so each step handles at
+    most one session per day and is a single array operation across days.
+    """
+    overflow = np.zeros(len(occupancy), dtype=int)
+    order = np.argsort(rows, kind="stable")
+    rows, buckets = rows[order], -(-durations[order] // BUCKET_MINUTES)
+    rank = np.arange(len(rows)) - np.searchsorted(rows, rows)
+    for r in range(rank.max() + 1 if len(rank) else 0):
+        for size in np.unique(buckets[rank == r]):
+            day_rows = rows[(rank == r) & (buckets == size)]
+            starts = free_windows(occupancy[day_rows], size, chairs)
+            fit = starts >= 0
+            overflow[day_rows[~fit]] += 1
+            occupancy[day_rows[fit, None], starts[fit, None] + np.arange(size)] += 1
+    return overflow
+
+def course_days(occupancy, eligible, sessions, minutes, chairs):
+    """Day rows of the first course of `sessions` eligible days in a row that each have a free window
+    (the rows inside the forecast; days after it count as free), or None"""
+    rows = np.flatnonzero(eligible)
+    if not len(rows):
+        return None
+    fits = free_windows(occupancy[rows], -(-minutes // BUCKET_MINUTES), chairs) >= 0
+    padded = np.concatenate([fits, np.ones(sessions - 1, dtype=bool)])
+    ok = np.lib.stride_tricks.sliding_window_view(padded, sessions).all(axis=1)
+    if not ok.any():
+        return None
+    start = int(ok.argmax())
+    return rows[start:start + sessions]
+
+# ==================== FORECAST ====================
+
+@st.cache_data(ttl=60, show_spinner=False)
+def load_forecast_inputs(start, end):
+    """(booked slots, untimed/projected sessions, pending referrals as (name, sessions, minutes)) for start..end.
+
+    Uses get_conn directly so a DB error raises instead of caching empty inputs.
+    """
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute("""SELECT slot_date, split_part(scheduled_time, ':', 1)::int * 60
+                                       + split_part(scheduled_time, ':', 2)::int, slot_duration
+                     FROM daily_slots
+                     WHERE slot_date BETWEEN %s AND %s AND status = 'Scheduled' AND scheduled_time <> ''""",
+                  (start, end))
+        booked = c.fetchall()
+        # Scheduled sessions whose slot plan-next-day has not created yet
+        c.execute("""SELECT ts.session_date, NULL, COALESCE(pl.session_duration, %s)
+                     FROM tms_sessions ts
+                     LEFT JOIN protocol_library pl ON pl.id = ts.protocol_id
+                     WHERE ts.session_date BETWEEN %s AND %s AND ts.status = 'Scheduled'
+                       AND NOT EXISTS (SELECT 1 FROM daily_slots ds WHERE ds.session_id = ts.id)""",
+                  (DEFAULT_SESSION_MINUTES, start, end))
+        projected = c.fetchall()
+        courses = active_courses(c, end)
+        c.execute("SELECT id, session_duration FROM protocol_library")
+        durations = dict(c.fetchall())
+        # Waitlisted patients first, in waitlist order (tms_app/waitlist.py)
+        c.execute("""SELECT p.name, COALESCE(w.session_count, %s), COALESCE(pl.session_duration, %s)
+                     FROM patients p
+                     LEFT JOIN waitlist w ON w.patient_id = p.id
+                     LEFT JOIN protocol_library pl ON pl.id = w.protocol_id
+                     WHERE p.status = ANY(%s)
+                       AND NOT EXISTS (SELECT 1 FROM tms_sessions ts WHERE ts.patient_id = p.id)
+                       AND NOT EXISTS (SELECT 1 FROM treatment_courses tc WHERE tc.patient_id = p.id)
+                     ORDER BY p.status <> 'Review Done', COALESCE(w.priority, 0) DESC,
+                              p.referred_date NULLS LAST, p.id""",
+                  (DEFAULT_COURSE_SESSIONS, DEFAULT_SESSION_MINUTES, REFERRAL_STATUSES))
+        referrals = c.fetchall()
+        c.close()
+
+    version = holidays_version()
+    for course in courses:
+        if not course.remaining or course.next_day > end:
+            continue
+        duration = durations.get(course.protocol_id) or DEFAULT_SESSION_MINUTES
+        planned = course.planned_dates(get_clinic_calendar(course.next_day.year - 1, version))
+        projected += [(day, course.preferred_time or None, duration) for day in planned if start <= day <= end]
+    return booked, projected, referrals
+
+def _day_rows(days, dates):
+    """Row of each date in `days`, and whether it is one of them (sessions on closed days are dropped)"""
+    dates = np.array(dates, dtype="datetime64[D]")
+    rows = np.searchsorted(days, dates)
+    found = rows < len(days)
+    found[found] = days[rows[found]] == dates[found]
+    return rows, found
+
+def chair_forecast(start, weeks=FORECAST_WEEKS, chairs=CLINIC_CHAIRS, include_referrals=True,
+                   course_sessions=DEFAULT_COURSE_SESSIONS, session_minutes=DEFAULT_SESSION_MINUTES):
+    """Forecast the clinic days from `start` for `weeks` weeks; raises on DB errors"""
+    end = start + timedelta(weeks=weeks, days=-1)
+    booked, projected, referrals = load_forecast_inputs(start, end)
+    calendar = get_clinic_calendar(start.year - 1)
+    days = calendar.open_days[(calendar.open_days >= np.datetime64(start, "D"))
+                              & (calendar.open_days <= np.datetime64(end, "D"))]
+    occupancy = np.zeros((len(days), DAY_BUCKETS), dtype=np.int32)
+
+    # Booked slots and projected sessions at a preferred time go where they are
+    booked_dates, booked_starts, booked_minutes = zip(*booked) if booked else ((), (), ())
+    rows, found = _day_rows(days, booked_dates)
+    booked_count = np.bincount(rows[found], minlength=len(days))
+    add_intervals(occupancy, rows[found], np.array(booked_starts, dtype=int)[found],
+                  np.array(booked_minutes, dtype=int)[found])
+
+    projected_dates, times, minutes = zip(*projected) if projected else ((), (), ())
+    rows, found = _day_rows(days, projected_dates)
+    projected_count = np.bincount(rows[found], minlength=len(days))
+    timed = found & np.array([time is not None for time in times], dtype=bool)
+    untimed = found & ~timed
+    minutes = np.array(minutes, dtype=int)
+    add_intervals(occupancy, rows[timed], to_minutes(np.array(times, dtype=object)[timed]), minutes[timed])
+    overflow = place_sessions(occupancy, rows[untimed], minutes[untimed], chairs)
+
+    # Referrals queue for the first start they fit, then the next new course; new courses start after `start`
+    eligible = np.isin((days.astype("int64") + 3) % 7, COURSE_WEEKDAYS) & (days > np.datetime64(start, "D"))
+    referral_starts = []
+    for name, sessions, length in referrals if include_referrals else []:
+        rows = course_days(occupancy, eligible, sessions, length, chairs)
+        if rows is None:
+            referral_starts.append((name, None))
+            continue
+        referral_starts.append((name, days[rows[0]].astype(object)))
+        overflow += place_sessions(occupancy, rows, np.full(len(rows), length), chairs)
+        projected_count[rows] += 1
+    rows = course_days(occupancy, eligible, course_sessions, session_minutes, chairs)
+    new_course_start = days[rows[0]].astype(object) if rows is not None and len(rows) else None
+
+    in_hours = np.minimum(occupancy[:, OPEN_BUCKETS], chairs)
+    open_buckets = in_hours.shape[1]
+    table = pd.DataFrame({
+        "Date": days.astype(object),
+        "Booked": booked_count,
+        "Projected": projected_count,
+        "Utilization %": in_hours.sum(axis=1) / (chairs * open_buckets) * 100,
+        **{f"Chair {chair + 1} %": (in_hours > chair).mean(axis=1) * 100 for chair in range(chairs)},
+        "Peak Chairs": occupancy.max(axis=1),
+        "Free Chair-Hours": (chairs * open_buckets - in_hours.sum(axis=1)) * BUCKET_MINUTES / 60,
+        "Overflow": overflow,
+        "Room for a Session": free_windows(occupancy, -(-session_minutes // BUCKET_MINUTES), chairs) >= 0,
+    }).round(1)
+    return Forecast(days, occupancy, table, referral_starts, new_course_start)
+
+def day_capacity(day, chairs=CLINIC_CHAIRS):
+    """(utilization % within opening hours, peak chairs in use) of a day's slots, or None on error"""
+    try:
+        slots = execute_named("slots_for_date", (day,)) or []
+    except Exception as e:
+        report_error(f"Error fetching slots: {e}")
+        return None
+    occupancy = np.zeros((1, DAY_BUCKETS), dtype=np.int32)
+    times = [time for time, _ in slots if time]
+    add_intervals(occupancy, np.zeros(len(times), dtype=int), to_minutes(times),
+                  np.array([duration or 0 for time, duration in slots if time], dtype=int))
+    in_hours = np.minimum(occupancy[0, OPEN_BUCKETS], chairs)
+    return in_hours.sum() / (chairs * len(in_hours)) * 100, int(occupancy.max())
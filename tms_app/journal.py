@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+Local write-ahead journal.
+
+Clinician writes (e.g. "Complete Session") are recorded in an SQLite file on
+local disk and acknowledged straight away. A background worker replays them to
+Postgres in order, in batches. Each write carries a client-generated id; the
+worker inserts it into `applied_writes` in the same transaction as the write,
+so a write replayed twice (crash, second server process) is applied once.
+
+Writes that Postgres rejects (bad data, missing rows) are kept as 'failed'
+rather than blocking the queue; connection errors leave them pending and the
+worker retries with backoff.
+"""
+import json
+import os
+import sqlite3
+import threading
+import uuid
+
+import psycopg2
+import streamlit as st
+
+from tms_app.db import get_conn, get_setting
+from tms_app.parameters import save_parameter_version
+
+JOURNAL_PATH = get_setting("JOURNAL_PATH", os.path.join(os.path.expanduser("~"), ".tms_dashboard", "journal.sqlite3"))
+BATCH_SIZE = 50
+POLL_SECONDS = 2
+MAX_BACKOFF_SECONDS = 60
+
+_wake = threading.Event()
+
+# ==================== WRITE HANDLERS ====================
+
+def _complete_session(c, payload):
+    """Session results, its parameter version and the slot status, together"""
+    params = payload["params"]
+    version_id = save_parameter_version(c, payload['patient_id'], None, params)
+    c.execute(
+        """UPDATE tms_sessions
+        SET target_laterality = %s, target_region = %s,
+        coord_left_x = %s, coord_left_y = %s,
+        coord_right_x = %s, coord_right_y = %s,
+        rmt_left = %s, rmt_right = %s,
+        intensity_percent_left = %s, intensity_percent_right = %s,
+        intensity_output_left = %s, intensity_output_right = %s,
+        coil_type = %s, side_effects = %s, remarks = %s,
+        parameter_version_id = %s, status = 'Completed'
+        WHERE id = %s""",
+        (params['target_laterality'], params['target_region'],
+         params['coord_left_x'], params['coord_left_y'],
+         params['coord_right_x'], params['coord_right_y'],
+         params['rmt_left'], params['rmt_right'],
+         params['intensity_percent_left'], params['intensity_percent_right'],
+         params['intensity_output_left'], params['intensity_output_right'],
+         params['coil_type'], payload['side_effects'], payload['remarks'], version_id, payload['session_id'])
+    )
+    if c.rowcount == 0:
+        raise LookupError(f"Session {payload['session_id']} no longer exists")
+    c.execute("UPDATE daily_slots SET status = 'Completed' WHERE session_id = %s",
+              (payload['session_id'],))
+
+HANDLERS = {
+    "complete_session": _complete_session,
+}
+
+# ==================== LOCAL JOURNAL ====================
+
+def _open():
+    os.makedirs(os.path.dirname(os.path.abspath(JOURNAL_PATH)), exist_ok=True)
+    local = sqlite3.connect(JOURNAL_PATH, timeout=10)
+    local.execute("PRAGMA journal_mode=WAL")
+    local.execute("PRAGMA synchronous=FULL")
+    local.execute("""CREATE TABLE IF NOT EXISTS journal
+                     (seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                      write_id TEXT UNIQUE NOT NULL,
+                      kind TEXT NOT NULL,
+                      payload TEXT NOT NULL,
+                      status TEXT NOT NULL DEFAULT 'pending',
+                      attempts INTEGER NOT NULL DEFAULT 0,
+                      last_error TEXT,
+                      created_at TEXT DEFAULT CURRENT_TIMESTAMP)""")
+    return local
+
+def record(kind, payload):
+    """Durably journal a write and wake the worker; returns its write id"""
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown journal write kind: {kind}")
+    write_id = str(uuid.uuid4())
+    local = _open()
+    try:
+        with local:
+            local.execute("INSERT INTO journal (write_id, kind, payload) VALUES (?, ?, ?)",
+                          (write_id, kind, json.dumps(payload)))
+    finally:
+        local.close()
+    _wake.set()
+    return write_id
+
+def journal_counts():
+    """(pending, failed) entries in the local journal"""
+    local = _open()
+    try:
+        counts = dict(local.execute("SELECT status, COUNT(*) FROM journal GROUP BY status").fetchall())
+    finally:
+        local.close()
+    return counts.get("pending", 0), counts.get("failed", 0)
+
+def failed_writes():
+    """Rejected writes, oldest first: (write_id, kind, payload dict, attempts, last_error)"""
+    local = _open()
+    try:
+        rows = local.execute("""SELECT write_id, kind, payload, attempts, last_error FROM journal
+                                WHERE status = 'failed' ORDER BY seq""").fetchall()
+    finally:
+        local.close()
+    return [(write_id, kind, json.loads(payload), attempts, error)
+            for write_id, kind, payload, attempts, error in rows]
+
+def retry_failed():
+    """Put rejected writes back in the queue"""
+    local = _open()
+    try:
+        with local:
+            local.execute("UPDATE journal SET status = 'pending' WHERE status = 'failed'")
+    finally:
+        local.close()
+    _wake.set()
+
+# ==================== REPLAY ====================
+
+def replay_batch(batch_size=BATCH_SIZE):
+    """Apply the oldest pending writes to Postgres in one transaction; returns how many were handled.
+
+    Connection errors propagate (the batch stays pending); a write Postgres
+    rejects is rolled back to its savepoint and marked 'failed'.
+    """
+    local = _open()
+    try:
+        entries = local.execute("""SELECT seq, write_id, kind, payload FROM journal
+                                   WHERE status = 'pending' ORDER BY seq LIMIT ?""",
+                                (batch_size,)).fetchall()
+        if not entries:
+            return 0
+
+        failed = {}
+        with get_conn() as conn:
+            c = conn.cursor()
+            for seq, write_id, kind, payload in entries:
+                c.execute("SAVEPOINT journal_write")
+                try:
+                    c.execute("""INSERT INTO applied_writes (write_id, kind) VALUES (%s, %s)
+                                 ON CONFLICT (write_id) DO NOTHING""", (write_id, kind))
+                    if c.rowcount:
+                        HANDLERS[kind](c, json.loads(payload))
+                    c.execute("RELEASE SAVEPOINT journal_write")
+                except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                    raise
+                except Exception as e:
+                    c.execute("ROLLBACK TO SAVEPOINT journal_write")
+                    failed[seq] = str(e)
+            c.close()
+
+        # Postgres has committed; now drop the applied entries locally
+        with local:
+            for seq, _, _, _ in entries:
+                if seq in failed:
+                    local.execute("""UPDATE journal SET status = 'failed', attempts = attempts + 1,
+                                     last_error = ? WHERE seq = ?""", (failed[seq], seq))
+                else:
+                    local.execute("DELETE FROM journal WHERE seq = ?", (seq,))
+        return len(entries)
+    finally:
+        local.close()
+
+def _run_worker():
+    from tms_app.data import load_session_worklist
+
+    backoff = POLL_SECONDS
+    while True:
+        _wake.wait(backoff)
+        _wake.clear()
+        try:
+            applied = 0
+            while True:
+                handled = replay_batch()
+                if not handled:
+                    break
+                applied += handled
+            if applied:
+                load_session_worklist.clear()
+            backoff = POLL_SECONDS
+        except Exception:
+            # Database unreachable: keep the writes and back off
+            backoff = min(backoff * 2, MAX_BACKOFF_SECONDS)
+
+@st.cache_resource(show_spinner=False)
+def start_journal_worker():
+    """Start the replay thread, once per process"""
+    worker = threading.Thread(target=_run_worker, name="tms-journal-replay", daemon=True)
+    worker.start()
+    _wake.set()
+    return worker
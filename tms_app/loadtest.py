@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+Concurrent-user load test.
+
+N simulated users drive the real app headlessly (Streamlit's AppTest), all at
+once. Each user runs in its own process: AppTest swaps process-wide runtime
+state on every run, so two runs cannot overlap inside one process. Every user
+repeatedly picks a flow:
+
+    dashboard         open the Daily Dashboard and refresh it
+    bulk_slots        Slot Management: pick a patient, create 14 sessions
+    complete_session  Session Parameters: pick a patient, complete the session
+
+Each script run is timed; its DB time is the time spent holding database
+connections (st.session_state["last_run_db_seconds"]), render time is the rest.
+The report gives throughput (over the window in which the flows ran) and
+p50/p95/p99 per page step.
+
+Runs against a local database only: set TMS_DATABASE_URL, or pass --embedded DIR
+to start a throwaway Postgres with the `pgserver` package (pip install pgserver):
+
+    python -m tms_app.loadtest --embedded /tmp/tms-load --seed --users 8 --iterations 10
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+import traceback
+from collections import defaultdict
+
+import numpy as np
+
+ENTRY_POINT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           "tms_dashboard_supabase.py")
+FLOWS = {"dashboard": 5, "bulk_slots": 1, "complete_session": 3}
+LOAD_USER = ("loadtest", "Load Test")
+LOAD_SECRETS = {
+    "cookie": {"name": "tms_loadtest", "key": "loadtest-signing-key", "expiry_days": 1},
+    "credentials": {"usernames": {LOAD_USER[0]: {"name": LOAD_USER[1], "email": "load@test",
+                                                 "password": "not-used"}}},
+}
+
+
+class SimulatedUser:
+    def __init__(self, number, timeout):
+        from streamlit.testing.v1 import AppTest
+
+        from tms_app.auth import issue_token, TOKEN_KEY
+
+        self.rng = random.Random(number)
+        self.samples = []  # (step, wall-clock start, total seconds, db seconds, failed)
+        self.at = AppTest.from_file(ENTRY_POINT, default_timeout=timeout)
+        self.at.secrets.update(LOAD_SECRETS)
+        self.at.session_state[TOKEN_KEY] = issue_token(*LOAD_USER, LOAD_SECRETS)
+
+    def step(self, name, action=None):
+        """Run the app (after applying `action` to the widgets) and record the timing"""
+        self.at.session_state["last_run_db_seconds"] = 0.0
+        started_at, started = time.time(), time.perf_counter()
+        (action or (lambda at: at))(self.at).run()
+        total = time.perf_counter() - started
+        db = self.at.session_state["last_run_db_seconds"]
+        self.samples.append((name, started_at, total, db, bool(self.at.exception) or bool(self.at.error)))
+
+    def open(self, page):
+        self.step(page, lambda at: at.switch_page(f"tms_app/pages/{page}.py"))
+
+    def pick(self, label=None, key=None):
+        boxes = [box for box in self.at.selectbox
+                 if (key and box.key == key) or (label and box.label == label)]
+        if boxes and boxes[0].options:
+            boxes[0].select_index(self.rng.randrange(len(boxes[0].options)))
+            return True
+        return False
+
+    def button(self, label):
+        return next(b for b in self.at.button if b.label == label)
+
+    # ---------- flows ----------
+
+    def dashboard(self):
+        self.open("daily_dashboard")
+        self.step("daily_dashboard: refresh")
+
+    def bulk_slots(self):
+        self.open("slot_management")
+        if self.pick(label="Select Patient"):
+            self.step("slot_management: select patient")
+            self.step("slot_management: create slots", lambda at: self.button("Create Slots").click())
+
+    def complete_session(self):
+        self.open("session_parameters")
+        if self.pick(key="param_patient"):
+            self.step("session_parameters: select patient")
+            self.step("session_parameters: complete",
+                      lambda at: self.button("Complete Session").click())
+
+    def run(self, iterations, start_barrier):
+        flows, weights = zip(*FLOWS.items())
+        try:
+            self.step("login")
+            start_barrier.wait()
+            for _ in range(iterations):
+                getattr(self, self.rng.choices(flows, weights)[0])()
+        except Exception:
+            self.samples.append(("user aborted", time.time(), 0.0, 0.0, True))
+            traceback.print_exc()
+        return self.samples
+
+
+def run_user(number, iterations, timeout, start_barrier):
+    """Process entry point: one simulated user; returns its samples"""
+    return SimulatedUser(number, timeout).run(iterations, start_barrier)
+
+
+def percentiles(values):
+    return np.percentile(np.asarray(values) * 1000, [50, 95, 99])
+
+
+def report(samples):
+    recorder = defaultdict(list)
+    errors = defaultdict(int)
+    for step, _, total, db, failed in samples:
+        recorder[step].append((total, db))
+        errors[step] += failed
+    flow_samples = [sample for sample in samples if sample[0] != "login"]
+    wall = max(started + total for _, started, total, _, _ in flow_samples) - \
+        min(started for _, started, _, _, _ in flow_samples)
+    print(f"\n{len(flow_samples)} script runs in {wall:.1f}s = {len(flow_samples) / wall:.1f} runs/s\n")
+    header = f"{'step':38} {'n':>5} {'err':>4} {'runs/s':>7}   {'total p50/p95/p99 ms':>22}   {'db p50/p95/p99 ms':>22}   {'render p50/p95/p99 ms':>22}"
+    print(header)
+    print("-" * len(header))
+    for step in sorted(recorder):
+        samples = recorder[step]
+        totals = [total for total, _ in samples]
+        dbs = [db for _, db in samples]
+        renders = [total - db for total, db in samples]
+        cols = ["/".join(f"{v:.0f}" for v in percentiles(values)) for values in (totals, dbs, renders)]
+        print(f"{step:38} {len(samples):5d} {errors[step]:4d} {len(samples) / wall:7.2f}   "
+              f"{cols[0]:>22}   {cols[1]:>22}   {cols[2]:>22}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent-user load test for the TMS dashboard")
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument("--iterations", type=int, default=5, help="flows per user")
+    parser.add_argument("--seed", action="store_true", help="(re)create the seeded patients first")
+    parser.add_argument("--patients", type=int, default=60, help="patients to seed")
+    parser.add_argument("--chairs", type=int, help="chairs per seeded day (default CLINIC_CHAIRS)")
+    parser.add_argument("--embedded", metavar="DIR", help="start a local Postgres in DIR with pgserver")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds per script run")
+    args = parser.parse_args(argv)
+
+    if args.embedded:
+        try:
+            import pgserver
+        except ImportError:
+            parser.error("--embedded needs the pgserver package (pip install pgserver)")
+        os.environ["TMS_DATABASE_URL"] = pgserver.get_server(args.embedded).get_uri()
+    if not os.environ.get("TMS_DATABASE_URL"):
+        parser.error("set TMS_DATABASE_URL to a local database (or use --embedded); "
+                     "the load test writes to it")
+    # Keep the simulated users' journal away from the real one
+    os.environ.setdefault("TMS_JOURNAL_PATH", os.path.join(tempfile.mkdtemp(), "journal.sqlite3"))
+
+    from tms_app.db import create_tables, get_conn, raise_errors
+    from tms_app.clinic_calendar import CLINIC_CHAIRS
+    from tms_app.seed import seed
+
+    with raise_errors():
+        create_tables()
+        if args.seed:
+            with get_conn() as conn:
+                print("Seeded %d patients, %d sessions, %d slots"
+                      % seed(conn, args.patients, chairs=args.chairs or CLINIC_CHAIRS))
+
+    # spawn, not fork: this process already holds pooled database connections
+    context = multiprocessing.get_context("spawn")
+    with context.Manager() as manager:
+        start_barrier = manager.Barrier(args.users)
+        with context.Pool(args.users) as pool:
+            results = pool.starmap(run_user, [(n + 1, args.iterations, args.timeout, start_barrier)
+                                              for n in range(args.users)])
+    samples = [sample for user_samples in results for sample in user_samples]
+    report(samples)
+
+    # Completions still in the journal when the users stopped; replay them here
+    from tms_app.journal import journal_counts, replay_batch
+    pending, failed = journal_counts()
+    print(f"\nJournal backlog at the end of the run: {pending} pending, {failed} rejected")
+    with raise_errors():
+        while replay_batch():
+            pass
+    return 1 if any(failed for *_, failed in samples) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Chair Forecast page: chair utilization for the coming weeks, from booked slots,
+course continuations and pending referrals (tms_app/forecast.py).
+"""
+from datetime import date
+
+import numpy as np
+import plotly.express as px
+import plotly.graph_objects as go
+import streamlit as st
+
+from tms_app.clinic_calendar import CLINIC_CHAIRS, CLOSE_MINUTES, DEFAULT_SESSION_MINUTES
+from tms_app.courses import DEFAULT_COURSE_SESSIONS
+from tms_app.db import report_error
+from tms_app.forecast import (
+    BUCKET_MINUTES,
+    FORECAST_WEEKS,
+    OPEN_BUCKETS,
+    chair_forecast,
+    load_forecast_inputs,
+)
+
+st.markdown("## 🪑 Chair Forecast")
+
+col1, col2, col3 = st.columns(3)
+with col1:
+    weeks = st.slider("Weeks ahead", 1, 12, FORECAST_WEEKS, key="forecast_weeks")
+    chairs = st.number_input("Chairs", min_value=1, max_value=6, value=CLINIC_CHAIRS, key="forecast_chairs")
+with col2:
+    course_sessions = st.number_input("New course: sessions", min_value=1, max_value=50, value=DEFAULT_COURSE_SESSIONS,
+                                      key="forecast_course_sessions")
+    session_minutes = st.number_input("New course: minutes per session", min_value=5, max_value=120,
+                                      value=DEFAULT_SESSION_MINUTES, step=5, key="forecast_session_minutes")
+with col3:
+    include_referrals = st.toggle("Include pending referrals", value=True, key="forecast_referrals",
+                                  help="Each pending referral is projected as a course starting on the first day it "
+                                       "fits: the waitlist first, in waitlist order, then the oldest referrals")
+    if st.button("🔄 Refresh", use_container_width=True):
+        load_forecast_inputs.clear()
+
+try:
+    forecast = chair_forecast(date.today(), weeks, int(chairs), include_referrals,
+                              int(course_sessions), int(session_minutes))
+except Exception as e:
+    report_error(f"Error building the forecast: {e}")
+    forecast = None
+
+if forecast is not None and forecast.table.empty:
+    st.info("ℹ️ No clinic days in the forecast period")
+elif forecast is not None:
+    table = forecast.table
+    cols = st.columns(4)
+    cols[0].metric("Average Utilization", f"{table['Utilization %'].mean():.0f}%")
+    cols[1].metric("Peak Chairs in Use", int(table["Peak Chairs"].max()),
+                   delta=f"{int((table['Peak Chairs'] > chairs).sum())} overbooked day(s)" if
+                   (table["Peak Chairs"] > chairs).any() else None, delta_color="inverse")
+    cols[2].metric("Days with No Room", int((~table["Room for a Session"]).sum()))
+    start = forecast.new_course_start
+    cols[3].metric("New Course Can Start", f"{start:%d %b %Y}" if start else "Beyond forecast")
+    if table["Overflow"].sum():
+        st.warning(f"⚠️ {int(table['Overflow'].sum())} projected session(s) found no free chair within opening hours")
+
+    # ==================== UTILIZATION ====================
+
+    st.markdown("### 📊 Daily Utilization")
+    fig = go.Figure()
+    for column in [name for name in table.columns if name.startswith("Chair ")]:
+        fig.add_trace(go.Bar(x=table["Date"], y=table[column], name=column))
+    fig.add_trace(go.Scatter(x=table["Date"], y=table["Utilization %"], name="All chairs", mode="lines+markers"))
+    fig.update_layout(barmode="group", height=360, yaxis_title="Utilization (%)", yaxis_range=[0, 105],
+                      margin=dict(l=10, r=10, t=10, b=10))
+    st.plotly_chart(fig, use_container_width=True)
+
+    st.markdown("### 🕒 Chairs in Use")
+    # Opening hours, stretched to the latest booked bucket when slots run late
+    busy = np.flatnonzero(forecast.occupancy.any(axis=0))
+    last = max(CLOSE_MINUTES // BUCKET_MINUTES, busy[-1] + 1 if len(busy) else 0)
+    grid = forecast.occupancy[:, OPEN_BUCKETS.start:last]
+    minutes = (OPEN_BUCKETS.start + np.arange(grid.shape[1])) * BUCKET_MINUTES
+    fig = px.imshow(grid, aspect="auto", color_continuous_scale="Blues", zmin=0, zmax=max(int(chairs), int(grid.max())),
+                    x=[f"{m // 60:02d}:{m % 60:02d}" for m in minutes],
+                    y=[f"{day:%a %d %b}" for day in table["Date"]],
+                    labels=dict(x="Time", y="Day", color="Chairs"))
+    fig.update_layout(height=max(300, 18 * len(table)), margin=dict(l=10, r=10, t=10, b=10))
+    st.plotly_chart(fig, use_container_width=True)
+
+    st.dataframe(table, use_container_width=True, hide_index=True)
+
+    if include_referrals and forecast.referrals:
+        st.markdown(f"### 👤 Pending Referrals ({len(forecast.referrals)})")
+        st.dataframe([{"Patient": name, "Projected Start": f"{start:%d %b %Y}" if start else "Beyond forecast"}
+                      for name, start in forecast.referrals], use_container_width=True, hide_index=True)
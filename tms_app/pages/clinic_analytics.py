@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Clinic Analytics page: cohort and adherence metrics from the Parquet snapshot.
+"""
+from datetime import datetime
+
+import plotly.express as px
+import streamlit as st
+
+from tms_app.analytics import BREAKDOWNS, METRIC_COLUMNS, cohort_metrics
+from tms_app.db import get_conn, report_error
+from tms_app.snapshot import export_snapshot, snapshot_state
+
+st.markdown("## 📑 Clinic Analytics")
+
+state = snapshot_state()
+col1, col2 = st.columns([3, 1])
+with col1:
+    if state:
+        exported = datetime.fromisoformat(state["exported_at"])
+        st.caption(f"From the analytics snapshot of {exported:%d %b %Y %H:%M} "
+                   "(updated nightly by `python -m tms_app.batch snapshot`).")
+with col2:
+    if st.button("🔄 Update Snapshot", use_container_width=True):
+        try:
+            with st.spinner("Exporting changes..."), get_conn() as conn:
+                export_snapshot(conn)
+            st.toast("✅ Snapshot updated")
+            st.rerun()
+        except Exception as e:
+            report_error(f"Error updating snapshot: {e}")
+
+tables = cohort_metrics()
+
+if tables is None:
+    st.warning("⚠️ No analytics snapshot yet. Click Update Snapshot to create one.")
+elif not tables:
+    st.info("ℹ️ No sessions in the snapshot yet")
+else:
+    overall = tables["All"].iloc[0]
+    cols = st.columns(4)
+    cols[0].metric("Patients Treated", int(overall["Patients"]))
+    cols[1].metric("Course Completion", f"{overall['Course Completion %']:.0f}%")
+    cols[2].metric("Missed Sessions", f"{overall['Missed %']:.1f}%")
+    cols[3].metric("Median Days to Start", f"{overall['Days to Start']:.0f}")
+
+    st.markdown("### 📋 Breakdown")
+    breakdown = st.radio("Break down by", list(BREAKDOWNS), horizontal=True, key="analytics_breakdown")
+    table = tables[breakdown]
+    metric = st.selectbox("Chart", METRIC_COLUMNS, index=METRIC_COLUMNS.index("Course Completion %"),
+                          key="analytics_metric")
+
+    chart = table[metric].dropna().reset_index()
+    fig = px.line(chart, x=breakdown, y=metric, markers=True) if breakdown == "Month" \
+        else px.bar(chart.sort_values(metric, ascending=False), x=breakdown, y=metric)
+    fig.update_layout(height=360, margin=dict(l=10, r=10, t=10, b=10))
+    st.plotly_chart(fig, use_container_width=True)
+
+    st.dataframe(table.reset_index(), use_container_width=True, hide_index=True)
+    st.download_button("⬇️ Download CSV", table.to_csv().encode("utf-8"),
+                       file_name=f"tms_{breakdown.lower()}_metrics.csv", mime="text/csv")
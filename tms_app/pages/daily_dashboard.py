@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""
+Daily Dashboard page.
+
+The staff panel and the schedule panel are fragments: their buttons rerun
+only the panel they belong to, and each panel queries only its own data.
+Buttons queue their action in session state; the panel applies it before
+querying, so no extra rerun is needed to show the result.
+
+The schedule is loaded in full on a full page run and kept in session state.
+With auto-refresh on, the schedule panel reruns every DASHBOARD_REFRESH_SECONDS,
+asks the change feed (tms_app/change_feed.py) what changed on the date and
+re-fetches only those sessions; if nothing changed it issues no other query.
+Renamed patients or protocols show up on the next full page run, as do the
+planned (not yet booked) course sessions listed below the panel for future
+dates.
+
+Compact Schedule previews the moves that close the gaps in one or more days
+(tms_app/compaction.py) and applies them as one update.
+"""
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+import streamlit as st
+
+from tms_app.clinic_calendar import CLINIC_CHAIRS
+from tms_app.compaction import compact_schedule, preview_compaction
+from tms_app.courses import COURSE_HORIZON_DAYS, planned_sessions_for_date
+from tms_app.data import (
+    SCHEDULE_COLUMNS,
+    bulk_delete_sessions,
+    bulk_reschedule_sessions,
+    bulk_set_session_status,
+    get_change_version,
+    get_daily_schedule,
+    get_schedule_changes,
+    get_schedule_rows,
+    get_staff_for_date,
+    save_staff_for_date,
+    show_bulk_results,
+)
+from tms_app.db import get_setting
+from tms_app.forecast import day_capacity
+
+DASHBOARD_REFRESH_SECONDS = int(get_setting("DASHBOARD_REFRESH_SECONDS", 15))
+SLOT_ID, SESSION_ID = SCHEDULE_COLUMNS.index("slot_id"), SCHEDULE_COLUMNS.index("session_id")
+TIME = SCHEDULE_COLUMNS.index("Time")
+
+
+def queue_action(key, value=True):
+    """Button callback: remember an action for the panel to apply on its rerun"""
+    st.session_state[key] = value
+
+
+@st.fragment
+def staff_panel(selected_date):
+    """Staff assignment for the selected date"""
+    st.markdown("### 👨⚕️ Staff Assignment")
+
+    if st.session_state.pop("staff_save_requested", False):
+        if save_staff_for_date(selected_date, st.session_state["sr_daily"],
+                               st.session_state["jr1_daily"], st.session_state["jr2_daily"]):
+            st.success("✅ Staff assignment saved!")
+
+    # Load staff for selected date
+    sr_existing, jr1_existing, jr2_existing = get_staff_for_date(selected_date)
+
+    # Show if staff already assigned for this date
+    if sr_existing or jr1_existing or jr2_existing:
+        st.success("✅ Staff assignment exists for this date")
+        st.write(f"**SR:** {sr_existing if sr_existing else 'Not assigned'} · "
+                 f"**JR1:** {jr1_existing if jr1_existing else 'Not assigned'} · "
+                 f"**JR2:** {jr2_existing if jr2_existing else 'Not assigned'}")
+
+    st.markdown("**Update Staff Assignment:**")
+
+    # Pre-fill with existing values or show empty
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.text_input(
+            "Senior Resident",
+            value=sr_existing if sr_existing else "",
+            key="sr_daily"
+        )
+    with col2:
+        st.text_input(
+            "Junior Resident 1",
+            value=jr1_existing if jr1_existing else "",
+            key="jr1_daily"
+        )
+    with col3:
+        st.text_input(
+            "Junior Resident 2",
+            value=jr2_existing if jr2_existing else "",
+            key="jr2_daily"
+        )
+
+    st.button("Save Staff Assignment", type="primary",
+              on_click=queue_action, args=("staff_save_requested",))
+
+
+def load_schedule(selected_date):
+    """Full schedule for the date, with the change-feed position it is current as of"""
+    version = get_change_version() or 0
+    changes = get_schedule_changes(selected_date, version) or []
+    return {
+        "date": selected_date,
+        "version": max([version] + [v for v, _ in changes]),
+        "seen": {v for v, _ in changes},
+        "rows": get_daily_schedule(selected_date),
+    }
+
+
+def refresh_schedule(cache):
+    """Apply changes logged since the cache's version; returns how many sessions were re-fetched"""
+    changes = get_schedule_changes(cache["date"], cache["version"])
+    if changes is None:
+        return 0
+    changed = {session_id for version, session_id in changes if version not in cache["seen"]}
+    if changed:
+        rows = get_schedule_rows(cache["date"], changed)
+        if rows is None:
+            return 0
+        cache["rows"] = sorted([row for row in cache["rows"] if row[SESSION_ID] not in changed] + rows,
+                               key=lambda row: (row[TIME], row[SLOT_ID]))
+    # Versions still inside the overlap window come back on the next poll; skip them then
+    cache["version"] = max([cache["version"]] + [v for v, _ in changes])
+    cache["seen"] = {v for v, _ in changes}
+    return len(changed)
+
+
+def schedule_panel(selected_date):
+    """Capacity, statistics and schedule for the selected date, from one schedule query"""
+    bulk_action = st.session_state.pop("schedule_bulk_action", None)
+    if bulk_action:
+        action, session_ids = bulk_action
+        if action == "remove":
+            show_bulk_results(bulk_delete_sessions(session_ids), "Removed from schedule")
+        elif action == "missed":
+            show_bulk_results(bulk_set_session_status(session_ids, "Missed"), "Marked as missed")
+        else:
+            new_date = st.session_state["schedule_reschedule_date"]
+            show_bulk_results(bulk_reschedule_sessions(session_ids, new_date),
+                              f"Rescheduled to {new_date:%d %b %Y}")
+
+    compaction = st.session_state.pop("schedule_compaction", None)
+    if compaction == "preview":
+        days = st.session_state["compaction_days"]
+        st.session_state["compaction_plan"] = preview_compaction(days[0], days[-1])
+    elif compaction == "apply":
+        # None when a second click finds the plan already applied
+        plan = st.session_state.pop("compaction_plan", None)
+        moves = plan[0] if plan else []
+        moved = compact_schedule(moves) if moves else None
+        if moved is not None and len(moved) == len(moves):
+            st.success(f"✅ Schedule compacted: {len(moved)} slots moved")
+        elif moved is not None:
+            st.warning(f"⚠️ {len(moved)} of {len(moves)} slots moved; the others changed since the preview")
+
+    cache = st.session_state.get("schedule_cache")
+    if cache is None or cache["date"] != selected_date:
+        cache = st.session_state["schedule_cache"] = load_schedule(selected_date)
+        cache["capacity"] = day_capacity(selected_date)
+    elif refresh_schedule(cache):
+        cache["capacity"] = day_capacity(selected_date)
+    df = pd.DataFrame(cache["rows"], columns=SCHEDULE_COLUMNS)
+
+    col1, col2 = st.columns(2)
+
+    with col1:
+        st.markdown("### 📊 Capacity Info")
+        st.metric("Chairs", CLINIC_CHAIRS)
+        if cache.get("capacity"):
+            utilization, peak = cache["capacity"]
+            st.metric("Chair Utilization", f"{utilization:.0f}%",
+                      help="Share of chair time booked within opening hours; see Chair Forecast for the coming weeks")
+            st.metric("Peak Chairs in Use", peak)
+        st.metric("Slots Scheduled Today", len(df))
+
+    with col2:
+        st.markdown("### 📈 Session Statistics")
+        for status, count in df["Status"].value_counts().items():
+            st.metric(status, int(count))
+
+    st.markdown("### 📅 Today's Schedule")
+
+    if not df.empty:
+        # Add serial number column starting from 1
+        df.insert(0, 'S.No', range(1, len(df) + 1))
+
+        display_df = df[['S.No', 'Patient', 'Session#', 'Protocol', 'Target', 'Time', 'Allowed Time', 'Status', 'Intensity (L/R)']]
+        st.dataframe(display_df, use_container_width=True, hide_index=True)
+
+        st.markdown("### 🗂️ Bulk Actions")
+        labels = {int(session_id): f"Session {number} - {patient} @ {time} ({status})"
+                  for session_id, number, patient, time, status
+                  in zip(df['session_id'], df['Session#'], df['Patient'], df['Time'], df['Status'])}
+        st.session_state["schedule_selected"] = [
+            session_id for session_id in st.session_state.get("schedule_selected", []) if session_id in labels
+        ]
+        session_ids = st.multiselect("Select sessions", list(labels), format_func=labels.get,
+                                     key="schedule_selected")
+        st.button("Select all", key="schedule_select_all",
+                  on_click=queue_action, args=("schedule_selected", list(labels)))
+
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.button("🗑️ Remove Selected Sessions", type="secondary", disabled=not session_ids,
+                      on_click=queue_action, args=("schedule_bulk_action", ("remove", session_ids)))
+        with col2:
+            st.button("❌ Mark Selected as Missed", disabled=not session_ids,
+                      on_click=queue_action, args=("schedule_bulk_action", ("missed", session_ids)))
+        with col3:
+            st.date_input("Reschedule to", selected_date + timedelta(days=1), key="schedule_reschedule_date")
+            st.button("📆 Reschedule Selected", disabled=not session_ids,
+                      on_click=queue_action, args=("schedule_bulk_action", ("reschedule", session_ids)))
+    else:
+        st.info("ℹ️ No sessions scheduled for this date")
+
+    with st.expander("🧲 Compact Schedule", expanded="compaction_plan" in st.session_state):
+        st.caption("Moves scheduled slots earlier into the gaps, keeping their order, each patient's allowed "
+                   "time and the chair count. Nothing moves later.")
+        st.date_input("Days", (selected_date, selected_date), key="compaction_days")
+        st.button("🔍 Preview Compaction", on_click=queue_action, args=("schedule_compaction", "preview"))
+        plan = st.session_state.get("compaction_plan")
+        if plan:
+            moves, days = plan
+            if not moves:
+                st.info("ℹ️ Nothing to move: no slot can start earlier")
+            else:
+                st.dataframe(pd.DataFrame(days, columns=["Date", "Slots", "Moved", "Ends Now", "Ends After",
+                                                         "Idle Chair-Min Now", "Idle Chair-Min After"]),
+                             use_container_width=True, hide_index=True)
+                st.dataframe(pd.DataFrame(moves, columns=["slot_id", "Date", "Patient", "Session#", "From", "To",
+                                                          "Minutes"]).drop(columns="slot_id"),
+                             use_container_width=True, hide_index=True)
+                st.button(f"✅ Apply {len(moves)} Moves", type="primary",
+                          on_click=queue_action, args=("schedule_compaction", "apply"))
+
+
+def planned_panel(selected_date):
+    """Course sessions on the date that are not booked yet (beyond the booking horizon)"""
+    planned = planned_sessions_for_date(selected_date)
+    if planned:
+        st.markdown(f"### 🗓️ Planned Course Sessions ({len(planned)})")
+        st.caption(f"Booked automatically {COURSE_HORIZON_DAYS} days ahead; times are assigned then.")
+        st.dataframe(pd.DataFrame([(patient, protocol) for patient, protocol, _ in planned],
+                                  columns=["Patient", "Protocol"]),
+                     use_container_width=True, hide_index=True)
+
+
+st.markdown("## 📊 TMS Daily Dashboard")
+
+col1, col2 = st.columns([3, 1])
+with col1:
+    selected_date = st.date_input("Select Date", datetime.now())
+with col2:
+    auto_refresh = st.toggle("🔄 Auto-refresh", value=True, key="schedule_auto_refresh",
+                             help=f"Check for schedule changes every {DASHBOARD_REFRESH_SECONDS} seconds")
+
+# A full page run reloads the schedule; timed panel reruns only apply changes
+st.session_state.pop("schedule_cache", None)
+
+staff_panel(selected_date)
+st.markdown("---")
+st.fragment(schedule_panel, run_every=DASHBOARD_REFRESH_SECONDS if auto_refresh else None)(selected_date)
+if selected_date > date.today():
+    planned_panel(selected_date)
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Holiday Calendar page.
+"""
+import calendar
+from datetime import date, timedelta
+
+import pandas as pd
+import streamlit as st
+
+from tms_app.clinic_calendar import (
+    NTH_LABELS,
+    RULE_KINDS,
+    add_holiday_rule,
+    delete_holiday_rule,
+    expand_rule,
+    get_holiday_rules,
+    parse_holiday_file,
+    save_holidays,
+)
+from tms_app.db import execute_update
+from tms_app.pagination import paginated_table
+
+st.markdown("## 🎯 Holiday Calendar")
+
+tab1, tab2, tab3, tab4 = st.tabs(["View Holidays", "Add Holiday", "Import", "Recurring Rules"])
+
+with tab1:
+    st.markdown("### Configured Holidays")
+    df = paginated_table(
+        "holidays",
+        """SELECT id, holiday_date, COALESCE(holiday_name, '') AS holiday_name, skip_enabled
+        FROM holidays WHERE holiday_date IS NOT NULL""",
+        ['ID', 'Date', 'Holiday Name', 'Skip Enabled'],
+        sortable={'Date': 'holiday_date', 'Holiday Name': 'holiday_name'},
+    )
+
+    if df.empty:
+        st.info("ℹ️ No holidays configured")
+
+with tab2:
+    st.markdown("### Add New Holiday")
+    holiday_date = st.date_input("Holiday Date")
+    holiday_name = st.text_input("Holiday Name")
+    skip_enabled = st.checkbox("Enable Auto-skip", value=True)
+
+    if st.button("Add Holiday", type="primary"):
+        if not holiday_name:
+            st.error("❌ Holiday name is required")
+        else:
+            if execute_update(
+                """INSERT INTO holidays (holiday_date, holiday_name, skip_enabled)
+                VALUES (%s, %s, %s)""",
+                (holiday_date, holiday_name, 1 if skip_enabled else 0)
+            ):
+                st.success("✅ Holiday added successfully!")
+
+with tab3:
+    st.markdown("### Import Holidays")
+    st.caption("CSV with a `date` column (and optional `name`, `skip_enabled`), or an iCalendar (.ics) "
+               "file; multi-day and recurring events are expanded to single dates. Existing dates are updated.")
+    uploads = st.file_uploader("Holiday files", type=["csv", "ics"], accept_multiple_files=True)
+
+    rows, problems = [], []
+    for upload in uploads or []:
+        try:
+            rows += parse_holiday_file(upload.name, upload.getvalue())
+        except ValueError as e:
+            problems.append(f"{upload.name}: {e}")
+    for problem in problems:
+        st.error(f"❌ {problem}")
+
+    if rows:
+        preview = pd.DataFrame(rows, columns=["Date", "Holiday Name", "Skip Enabled"]) \
+            .drop_duplicates("Date", keep="last").sort_values("Date")
+        st.dataframe(preview, hide_index=True, use_container_width=True)
+        if st.button(f"Import {len(preview)} Holidays", type="primary", disabled=bool(problems)):
+            saved = save_holidays(rows)
+            if saved:
+                st.success(f"✅ Imported {saved} holiday dates")
+
+with tab4:
+    st.markdown("### Recurring Rules")
+    rules = get_holiday_rules()
+    if rules:
+        today = date.today()
+        for rule in rules:
+            col1, col2 = st.columns([5, 1])
+            with col1:
+                upcoming = list(expand_rule(rule, today, today + timedelta(days=366)))[:4]
+                upcoming = ", ".join(f"{day:%d %b %Y}" for day in upcoming)
+                skip = "" if rule.skip_enabled else " (auto-skip off)"
+                st.markdown(f"**{rule.label}**{skip}  \n<small>Next: {upcoming or '-'}</small>",
+                            unsafe_allow_html=True)
+            with col2:
+                if st.button("Delete", key=f"delete_rule_{rule.id}"):
+                    if delete_holiday_rule(rule.id):
+                        st.rerun()
+    else:
+        st.info("ℹ️ No recurring rules configured")
+
+    st.markdown("#### Add Rule")
+    rule_name = st.text_input("Rule Name", key="rule_name")
+    kind = st.radio("Repeats", list(RULE_KINDS), format_func=RULE_KINDS.get, horizontal=True, key="rule_kind")
+    months = [None] + list(range(1, 13))
+    col1, col2 = st.columns(2)
+    if kind == "yearly":
+        with col1:
+            rule_month = st.selectbox("Month", months[1:], format_func=lambda m: calendar.month_name[m],
+                                      key="rule_month")
+        with col2:
+            rule_day = st.number_input("Day", min_value=1, max_value=31, value=1, key="rule_day")
+        rule_weekday = rule_nth = None
+    else:
+        with col1:
+            rule_nth = st.selectbox("Which", list(NTH_LABELS), format_func=NTH_LABELS.get, key="rule_nth")
+            rule_weekday = st.selectbox("Weekday", range(7), index=5, format_func=lambda d: calendar.day_name[d],
+                                        key="rule_weekday")
+        with col2:
+            rule_month = st.selectbox("Month", months, format_func=lambda m: calendar.month_name[m] if m else "Every month",
+                                      key="rule_month_any")
+        rule_day = None
+    rule_skip = st.checkbox("Enable Auto-skip", value=True, key="rule_skip")
+
+    if st.button("Add Rule", type="primary"):
+        if not rule_name:
+            st.error("❌ Rule name is required")
+        elif add_holiday_rule(rule_name, kind, rule_month, rule_day, rule_weekday, rule_nth, rule_skip):
+            st.toast("✅ Rule added successfully!")
+            st.rerun()
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+Patient Referral page.
+
+The review, waitlist, allowed-time and removal panels are fragments, so their
+buttons rerun and re-query only their own panel. Status buttons queue the update for
+every selected referral in session state and the panel applies it, as one
+statement, before re-reading its table.
+"""
+from datetime import datetime, time as dtime
+
+import streamlit as st
+
+from tms_app.data import (
+    bulk_set_patient_status,
+    delete_patient,
+    get_patients,
+    get_protocols,
+    get_sessions_for_patient,
+    show_bulk_results,
+)
+from tms_app.db import execute_update
+from tms_app.pagination import paginated_table
+from tms_app.waitlist import PRIORITIES, get_waitlist, save_waitlist_entry
+
+def queue_action(key, value=True):
+    """Button callback: remember an action (or a selection) in session state"""
+    st.session_state[key] = value
+
+
+def queue_status_update(patient_ids, status):
+    """Button callback: remember a status change for the review panel to apply"""
+    st.session_state["referral_status_update"] = (patient_ids, status)
+
+
+@st.fragment
+def pending_referrals_panel():
+    """Pending referrals table with bulk status actions"""
+    st.markdown("### 📋 Pending Referrals")
+
+    status_update = st.session_state.pop("referral_status_update", None)
+    if status_update:
+        patient_ids, status = status_update
+        show_bulk_results(bulk_set_patient_status(patient_ids, status), f"Status set to '{status}'")
+
+    df = paginated_table(
+        "pending_referrals",
+        """SELECT id, name, mrn, age, gender, primary_diagnosis, referred_date, status
+        FROM patients WHERE status = 'Pending Review'""",
+        ['ID', 'Name', 'MRN', 'Age', 'Gender', 'Diagnosis', 'Referred', 'Status'],
+        sortable={'Referred': 'referred_date', 'Name': 'name', 'ID': 'id'},
+        default_desc=True,
+    )
+
+    if df.empty:
+        st.info("ℹ️ No pending referrals")
+        return
+
+    st.markdown("### ✅ Review Pending Referrals")
+    labels = {int(patient_id): f"{name} (MRN: {mrn})"
+              for patient_id, name, mrn in zip(df['ID'], df['Name'], df['MRN'])}
+
+    # Keep only selections still on this page (updated referrals leave the list)
+    st.session_state["pending_patient_select"] = [
+        patient_id for patient_id in st.session_state.get("pending_patient_select", []) if patient_id in labels
+    ]
+    patient_ids = st.multiselect(
+        "Select patients to update status",
+        list(labels),
+        format_func=labels.get,
+        key="pending_patient_select",
+    )
+    st.button("Select all on this page", key="pending_select_all",
+              on_click=queue_action, args=("pending_patient_select", list(labels)))
+
+    if patient_ids:
+        st.info(f"ℹ️ Selected: {len(patient_ids)} patient(s)")
+
+    col1, col2, col3 = st.columns(3)
+
+    with col1:
+        st.button("✅ Mark as Review Done", key="btn_review_done", disabled=not patient_ids,
+                  on_click=queue_status_update, args=(patient_ids, 'Review Done'))
+
+    with col2:
+        st.button("▶️ Mark as Started", key="btn_started", disabled=not patient_ids,
+                  on_click=queue_status_update, args=(patient_ids, 'Started'))
+
+    with col3:
+        st.button("⏸️ Mark as Paused", key="btn_paused", disabled=not patient_ids,
+                  on_click=queue_status_update, args=(patient_ids, 'Paused'))
+
+
+@st.fragment
+def waitlist_panel():
+    """'Review Done' patients in back-fill order, with their priority, protocol and course length"""
+    st.markdown("### ⏳ Waitlist")
+
+    patient_id = st.session_state.pop("waitlist_save", None)
+    if patient_id is not None:
+        if save_waitlist_entry(patient_id, st.session_state[f"waitlist_priority_{patient_id}"],
+                               st.session_state[f"waitlist_protocol_{patient_id}"],
+                               int(st.session_state[f"waitlist_sessions_{patient_id}"])):
+            st.success("✅ Waitlist updated")
+
+    st.caption("Patients marked Review Done wait here. When a scheduled slot is deleted, the highest-priority "
+               "patient whose protocol fits it and whose allowed time has come is booked into it straight away.")
+
+    waitlist = get_waitlist()
+    if not waitlist:
+        st.info("ℹ️ No patients waiting")
+        return
+
+    st.dataframe([{
+        "Priority": PRIORITIES.get(entry.priority, entry.priority),
+        "Patient": entry.label,
+        "Referred": entry.referred_date,
+        "Allowed Time": f"{entry.allowed_time:%H:%M}" if entry.allowed_time else "Any",
+        "Protocol": entry.protocol_name or "Not set",
+        "Sessions": entry.session_count,
+        "Minutes": entry.duration,
+    } for entry in waitlist], use_container_width=True, hide_index=True)
+
+    entries = {entry.patient_id: entry for entry in waitlist}
+    entry = entries[st.selectbox("Update waitlist entry", list(entries), format_func=lambda pid: entries[pid].label,
+                                 key="waitlist_patient")]
+    protocols = {protocol.id: protocol.protocol_name for protocol in get_protocols()}
+    protocol_ids = [None] + list(protocols)
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.selectbox("Priority", list(PRIORITIES), format_func=PRIORITIES.get,
+                     index=list(PRIORITIES).index(entry.priority) if entry.priority in PRIORITIES else 2,
+                     key=f"waitlist_priority_{entry.patient_id}")
+    with col2:
+        st.selectbox("Protocol", protocol_ids, format_func=lambda pid: protocols.get(pid, "Not set"),
+                     index=protocol_ids.index(entry.protocol_id) if entry.protocol_id in protocol_ids else 0,
+                     key=f"waitlist_protocol_{entry.patient_id}")
+    with col3:
+        st.number_input("Sessions", min_value=1, max_value=50, value=entry.session_count,
+                        key=f"waitlist_sessions_{entry.patient_id}")
+
+    st.button("Save Waitlist Entry", on_click=queue_action, args=("waitlist_save", entry.patient_id))
+
+
+@st.fragment
+def allowed_time_panel():
+    """Allowed time editor for any patient"""
+    st.markdown("### 🕒 Update Allowed Time for Any Patient")
+
+    all_patients = get_patients()
+    if not all_patients:
+        st.info("ℹ️ No patients in system.")
+        return
+
+    # Label with status so you know who is who
+    selected_patient = st.selectbox(
+        "Select patient",
+        all_patients,
+        format_func=lambda patient: f"{patient.label} – {patient.status}",
+        key="allowed_any_patient",
+    )
+    patient_id_any = selected_patient.id
+    current_allowed_any = selected_patient.allowed_time
+
+    allowed_time_any = st.time_input(
+        "Allowed time",
+        value=current_allowed_any or dtime(9, 0),
+        key=f"allowed_time_any_{patient_id_any}",
+    )
+
+    if st.button("Save Allowed Time for Selected Patient"):
+        if execute_update(
+            "UPDATE patients SET allowed_time = %s WHERE id = %s",
+            (allowed_time_any, patient_id_any),
+        ):
+            st.success("✅ Allowed time updated.")
+
+
+@st.fragment
+def remove_patient_panel():
+    """Permanent patient removal"""
+    st.markdown("### 🗑️ Remove Patient from System")
+    patients = get_patients()
+
+    if not patients:
+        st.info("ℹ️ No patients in system to delete")
+        return
+
+    st.warning("⚠️ WARNING: This will permanently delete the patient and all associated sessions and data.")
+    selected_patient = st.selectbox("Select patient to remove", patients,
+                                    format_func=lambda patient: patient.label)
+    patient_id = selected_patient.id
+
+    sessions = get_sessions_for_patient(patient_id)
+    st.info(f"ℹ️ This patient has {len(sessions)} scheduled/completed sessions that will also be deleted.")
+
+    confirm_delete = st.checkbox("I confirm I want to delete this patient and all associated data")
+
+    if st.button("Delete Patient Permanently", type="secondary", disabled=not confirm_delete):
+        if delete_patient(patient_id):
+            st.success("✅ Patient and all associated records deleted!")
+            # The patient disappears from every panel on the page
+            st.rerun()
+
+
+st.markdown("## 👤 Patient Referral")
+st.markdown("### 📋 Patient Information")
+
+col1, col2 = st.columns(2)
+
+with col1:
+    patient_name = st.text_input("Patient Name *")
+    mrn = st.text_input("MRN (Medical Record Number) *")
+    age = st.number_input("Age", min_value=18, max_value=100, value=40)
+    gender = st.selectbox("Gender", ["Male", "Female", "Other"])
+
+with col2:
+    primary_diagnosis = st.text_area("Primary Diagnosis *", height=80)
+    tass_completed = st.checkbox("TASS Checklist Completed *")
+    consent_obtained = st.checkbox("TMS Consent Form Obtained *")
+    allowed_time = st.time_input("Allowed time", value=dtime(9, 0))
+
+
+if st.button("Submit Referral", type="primary"):
+    if not (patient_name and mrn and primary_diagnosis):
+        st.error("❌ Please fill all required fields marked with *")
+    elif not (tass_completed and consent_obtained):
+        st.error("❌ TASS checklist and consent form must be completed")
+    else:
+        if execute_update(
+            """INSERT INTO patients (name, mrn, age, gender, primary_diagnosis,
+            tass_completed, consent_obtained, referred_date, status, allowed_time)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)""",
+            (patient_name, mrn, int(age), gender, primary_diagnosis, 1, 1,
+             datetime.now().date(), 'Pending Review', allowed_time,)
+        ):
+            st.success("✅ Patient referral submitted successfully!")
+            st.info("ℹ️ Case forwarded to NIBS team for review")
+
+pending_referrals_panel()
+waitlist_panel()
+allowed_time_panel()
+remove_patient_panel()
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Patient Trends page: RMT, intensity output and side effects across a patient's sessions.
+"""
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import streamlit as st
+
+from tms_app.data import get_patients
+from tms_app.trends import (
+    DRIFT_THRESHOLD,
+    MAX_CHART_POINTS,
+    ROLLING_WINDOW,
+    downsample,
+    get_patient_series,
+    rmt_drift,
+    rolling_stats,
+)
+
+SIDES = (("left", "Left"), ("right", "Right"))
+
+st.markdown("## 📈 Patient Trends")
+
+
+def line_chart(numbers, lines, title, y_title, markers=None):
+    """Plotly line chart of (name, values) over session numbers, each line downsampled"""
+    fig = go.Figure()
+    for name, values, style in lines:
+        measured = ~np.isnan(values)
+        x, y = numbers[measured], values[measured]
+        keep = downsample(y)
+        fig.add_trace(go.Scatter(x=x[keep], y=y[keep], name=name, mode="lines+markers" if len(keep) < 60 else "lines",
+                                 line=style))
+    if markers is not None:
+        x, y, text = markers
+        fig.add_trace(go.Scatter(x=x, y=y, name="Side effects", mode="markers", text=text,
+                                 hovertemplate="Session %{x}<br>%{text}<extra></extra>",
+                                 marker=dict(symbol="x", size=10, color="crimson")))
+    fig.update_layout(title=title, xaxis_title="Session #", yaxis_title=y_title,
+                      height=380, margin=dict(l=10, r=10, t=40, b=10), hovermode="x unified")
+    return fig
+
+
+patients = get_patients()
+
+if not patients:
+    st.warning("⚠️ No patients in the system. Please add a patient referral first.")
+else:
+    patient_options = {patient.label: patient.id for patient in patients}
+    selected_patient = st.selectbox("Select Patient", list(patient_options.keys()), key="trend_patient")
+    series = get_patient_series(patient_options[selected_patient])
+    numbers = series["session_number"]
+
+    if not len(numbers):
+        st.info("ℹ️ No completed sessions for this patient yet")
+    else:
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Completed Sessions", len(numbers))
+        col2.metric("First Session", f"{series['session_date'][0]:%d %b %Y}")
+        col3.metric("Latest Session", f"{series['session_date'][-1]:%d %b %Y}")
+        if len(numbers) > MAX_CHART_POINTS:
+            st.caption(f"Charts show up to {MAX_CHART_POINTS} points per line (each stretch's lowest and highest values).")
+
+        # ==================== RMT ====================
+
+        st.markdown("### 🧠 Resting Motor Threshold")
+        lines = []
+        for side, label in SIDES:
+            rmt = series[f"rmt_{side}"]
+            if np.isnan(rmt).all():
+                continue
+            mean, _ = rolling_stats(rmt)
+            lines.append((f"RMT {label}", rmt, None))
+            lines.append((f"RMT {label} ({ROLLING_WINDOW}-session mean)", np.where(np.isnan(rmt), np.nan, mean),
+                          dict(dash="dot")))
+
+            drift = rmt_drift(numbers, rmt, label)
+            if drift is None:
+                continue
+            message = (f"**{label}:** baseline {drift.baseline:.1f}, current {ROLLING_WINDOW}-session mean "
+                       f"{drift.current:.1f} ({drift.change:+.0%})")
+            if drift.drifting:
+                st.warning(f"⚠️ {message}: drifted more than {DRIFT_THRESHOLD:.0%} from session "
+                           f"#{drift.first_session}")
+            else:
+                st.success(f"✅ {message}")
+
+        if lines:
+            st.plotly_chart(line_chart(numbers, lines, "RMT by session", "RMT (%)"), use_container_width=True)
+        else:
+            st.info("ℹ️ No RMT recorded")
+
+        # ==================== INTENSITY & SIDE EFFECTS ====================
+
+        st.markdown("### ⚡ Intensity Output")
+        lines = [(f"Output {label}", series[f"intensity_output_{side}"], None)
+                 for side, label in SIDES if not np.isnan(series[f"intensity_output_{side}"]).all()]
+        side_effects = np.array([bool(text and text.strip()) for text in series["side_effects"]], dtype=bool)
+        markers = None
+        if side_effects.any():
+            outputs = np.fmax(series["intensity_output_left"], series["intensity_output_right"])
+            markers = (numbers[side_effects], np.nan_to_num(outputs[side_effects]), series["side_effects"][side_effects])
+        if lines or markers:
+            st.plotly_chart(line_chart(numbers, lines, "Intensity output by session", "Output (%)", markers),
+                            use_container_width=True)
+        else:
+            st.info("ℹ️ No intensity recorded")
+
+        st.markdown(f"### 🩺 Side Effects ({int(side_effects.sum())})")
+        if side_effects.any():
+            st.dataframe(pd.DataFrame({
+                "Session#": numbers[side_effects].astype(int),
+                "Date": series["session_date"][side_effects],
+                "Protocol": series["protocol_name"][side_effects],
+                "Side Effects": series["side_effects"][side_effects],
+            }), use_container_width=True, hide_index=True)
+        else:
+            st.info("ℹ️ No side effects recorded")
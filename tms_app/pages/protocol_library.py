@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Protocol Library page.
+"""
+import streamlit as st
+
+from tms_app.data import load_session_worklist
+from tms_app.db import execute_update
+from tms_app.pagination import paginated_table
+
+st.markdown("## 📚 Protocol Library")
+
+tab1, tab2 = st.tabs(["View Protocols", "Add New Protocol"])
+
+with tab1:
+    st.markdown("### Existing Protocols")
+    protocols_df = paginated_table(
+        "protocols",
+        """SELECT id, protocol_name, COALESCE(waveform_type, '') AS waveform_type,
+        COALESCE(session_duration, 0) AS session_duration FROM protocol_library""",
+        ['id', 'protocol_name', 'waveform_type', 'session_duration'],
+        sortable={'protocol_name': 'protocol_name', 'session_duration': 'session_duration'},
+    )
+
+    if not protocols_df.empty:
+        st.markdown("### 🗑️ Delete Protocol")
+        delete_protocol = st.selectbox("Select protocol to delete",
+                                      protocols_df['protocol_name'].tolist())
+
+        if st.button("Delete Selected Protocol", type="secondary"):
+            if execute_update(
+                "DELETE FROM protocol_library WHERE protocol_name = %s",
+                (delete_protocol,)
+            ):
+                load_session_worklist.clear()
+                st.success(f"✅ Protocol '{delete_protocol}' deleted!")
+                st.rerun()
+    else:
+        st.info("ℹ️ No protocols configured yet")
+
+with tab2:
+    st.markdown("### Add New Protocol")
+
+    col1, col2 = st.columns(2)
+
+    with col1:
+        protocol_name = st.text_input("Protocol Name *")
+        waveform_type = st.selectbox("Waveform Type", ["Biphasic", "Biphasic Bursts"])
+
+        if waveform_type == "Biphasic Bursts":
+            burst_pulses = st.number_input("Burst Pulses", min_value=1, value=3)
+            inter_pulse_interval = st.number_input("Inter-pulse Interval (ms)", value=20.0)
+        else:
+            burst_pulses = None
+            inter_pulse_interval = None
+
+        pulse_rate = st.number_input("Pulse/Burst Rate (Hz)", value=1.0, step=0.1)
+
+    with col2:
+        pulses_per_train = st.number_input("Pulses/Bursts per Train", min_value=1, value=10)
+        num_trains = st.number_input("Number of Trains", min_value=1, value=20)
+        inter_train_interval = st.number_input("Inter-train Interval (seconds)", value=8.0, step=0.5)
+        session_duration = st.number_input("Session Duration (minutes)", min_value=1, value=5)
+
+    if st.button("Add Protocol", type="primary"):
+        if not protocol_name:
+            st.error("❌ Protocol name is required")
+        else:
+            if execute_update(
+                """INSERT INTO protocol_library
+                (protocol_name, waveform_type, burst_pulses, inter_pulse_interval,
+                pulse_rate, pulses_per_train, num_trains, inter_train_interval, session_duration)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)""",
+                (protocol_name, waveform_type, int(burst_pulses) if burst_pulses else None,
+                 float(inter_pulse_interval) if inter_pulse_interval else None,
+                 float(pulse_rate), int(pulses_per_train), int(num_trains),
+                 float(inter_train_interval), int(session_duration))
+            ):
+                load_session_worklist.clear()
+                st.success("✅ Protocol added successfully!")
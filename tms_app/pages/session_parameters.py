@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Session Parameters page.
+"""
+from datetime import datetime
+
+import streamlit as st
+
+from tms_app.data import calculate_intensity, get_change_version, load_session_worklist
+from tms_app.journal import record
+
+LATERALITIES = ["Left", "Right", "Bilateral"]
+COIL_TYPES = ["rTMS (figure-8 coil)", "rTMS (double cone)",
+              "H1 (deep TMS)", "H4 (deep TMS)", "H7 (deep TMS)"]
+
+st.markdown("## 📝 Session Parameters")
+
+# Whole day's worklist (sessions + latest parameters + protocols) in one cached load
+today = datetime.now().date()
+try:
+    worklist, protocol_options = load_session_worklist(today, get_change_version())
+except Exception as e:
+    st.error(f"Error loading today's worklist: {e}")
+    worklist, protocol_options = {}, {}
+
+if not worklist:
+    st.warning("⚠️ No patients with scheduled sessions for today")
+else:
+    patient_options = {f"{row['name']} (MRN: {row['mrn']})": patient_id
+                      for patient_id, row in worklist.items()}
+    selected_patient = st.selectbox("Select Patient", list(patient_options.keys()), key="param_patient")
+    patient_id = patient_options[selected_patient]
+    entry = worklist[patient_id]
+    
+    # Get previous parameters
+    prev_params = entry["prev_params"]
+    if prev_params:
+        st.info("📌 Loading parameters from previous session...")
+    
+    session_id = entry["session_id"]
+    session_num = entry["session_number"]
+    protocol_id = entry["protocol_id"]
+    
+    st.markdown(f"### Session #{session_num}")
+    
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        st.subheader("Protocol & Target")
+        
+        default_protocol = None
+        if prev_params and len(prev_params) > 13:
+            prev_protocol_id = prev_params[13]
+            for prot_name, prot_id in protocol_options.items():
+                if prot_id == prev_protocol_id:
+                    default_protocol = prot_name
+                    break
+        
+        if default_protocol:
+            selected_protocol = st.selectbox("Protocol Name", list(protocol_options.keys()),
+                                            index=list(protocol_options.keys()).index(default_protocol))
+        else:
+            selected_protocol = st.selectbox("Protocol Name", list(protocol_options.keys()))
+        
+        laterality_default = prev_params[0] if prev_params and prev_params[0] in LATERALITIES else "Left"
+        laterality = st.selectbox("Target Laterality", LATERALITIES,
+                                index=LATERALITIES.index(laterality_default))
+        
+        target_region_default = (prev_params[1] or "") if prev_params else ""
+        target_region = st.text_input("Brain Region (e.g., DLPFC, IFG, PMC)",
+                                    value=target_region_default)
+        
+        coil_type_default = prev_params[12] if prev_params and prev_params[12] in COIL_TYPES else "rTMS (figure-8 coil)"
+        coil_type = st.selectbox("Coil Type", COIL_TYPES,
+                               index=COIL_TYPES.index(coil_type_default))
+    
+    with col2:
+        st.subheader("Coordinates (2D)")
+        coord_left_x_default = float(prev_params[2]) if prev_params and prev_params[2] else 0.0
+        coord_left_x = st.number_input("Left X (from outer canthus, cm)",
+                                      value=coord_left_x_default, step=0.1)
+        
+        coord_left_y_default = float(prev_params[3]) if prev_params and prev_params[3] else 0.0
+        coord_left_y = st.number_input("Left Y (from tragus, cm)",
+                                      value=coord_left_y_default, step=0.1)
+        
+        coord_right_x_default = float(prev_params[4]) if prev_params and prev_params[4] else 0.0
+        coord_right_x = st.number_input("Right X (from outer canthus, cm)",
+                                       value=coord_right_x_default, step=0.1)
+        
+        coord_right_y_default = float(prev_params[5]) if prev_params and prev_params[5] else 0.0
+        coord_right_y = st.number_input("Right Y (from tragus, cm)",
+                                       value=coord_right_y_default, step=0.1)
+    
+    st.markdown("---")
+    
+    col3, col4 = st.columns(2)
+    
+    with col3:
+        st.subheader("Resting Motor Threshold (RMT)")
+        rmt_left_default = float(prev_params[6]) if prev_params and prev_params[6] else 0.0
+        rmt_left = st.number_input("Left RMT (%)", value=rmt_left_default, step=1.0)
+        
+        rmt_right_default = float(prev_params[7]) if prev_params and prev_params[7] else 0.0
+        rmt_right = st.number_input("Right RMT (%)", value=rmt_right_default, step=1.0)
+    
+    with col4:
+        st.subheader("Treatment Intensity")
+        intensity_pct_left_default = float(prev_params[8]) if prev_params and prev_params[8] else 0.0
+        intensity_pct_left = st.number_input("% of RMT (Left)",
+                                            value=intensity_pct_left_default, step=1.0)
+        
+        intensity_pct_right_default = float(prev_params[9]) if prev_params and prev_params[9] else 0.0
+        intensity_pct_right = st.number_input("% of RMT (Right)",
+                                             value=intensity_pct_right_default, step=1.0)
+        
+        intensity_out_left = calculate_intensity(intensity_pct_left, rmt_left)
+        intensity_out_right = calculate_intensity(intensity_pct_right, rmt_right)
+        
+        st.metric("Intensity Output (Left)", f"{intensity_out_left}" if intensity_out_left else "-")
+        st.metric("Intensity Output (Right)", f"{intensity_out_right}" if intensity_out_right else "-")
+    
+    st.markdown("---")
+    
+    st.subheader("Session Notes")
+    side_effects = st.text_area("Side Effects", height=100)
+    remarks = st.text_area("Remarks", height=100)
+    
+    if st.button("Complete Session", type="primary"):
+        params_dict = {
+            'target_laterality': laterality,
+            'target_region': target_region,
+            'coord_left_x': float(coord_left_x),
+            'coord_left_y': float(coord_left_y),
+            'coord_right_x': float(coord_right_x),
+            'coord_right_y': float(coord_right_y),
+            'rmt_left': float(rmt_left),
+            'rmt_right': float(rmt_right),
+            'intensity_percent_left': float(intensity_pct_left),
+            'intensity_percent_right': float(intensity_pct_right),
+            'intensity_output_left': int(intensity_out_left) if intensity_out_left else None,
+            'intensity_output_right': int(intensity_out_right) if intensity_out_right else None,
+            'coil_type': coil_type,
+            'protocol_id': protocol_options[selected_protocol]
+        }
+        
+        # Journaled locally and replayed to the database in the background
+        record("complete_session", {
+            'patient_id': int(patient_id),
+            'session_id': int(session_id),
+            'params': params_dict,
+            'side_effects': side_effects,
+            'remarks': remarks,
+        })
+        st.success("✅ Session completed successfully!")
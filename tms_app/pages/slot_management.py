@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+Slot Management page.
+"""
+import calendar
+import re
+from datetime import datetime
+
+import streamlit as st
+
+from tms_app.data import (
+    calculate_next_slot_time,
+    delete_session,
+    get_next_session_number,
+    get_patients,
+    get_protocols,
+    load_session_worklist,
+)
+from tms_app.clinic_calendar import get_clinic_calendar, holidays_version
+from tms_app.courses import (
+    COURSE_HORIZON_DAYS,
+    COURSE_WEEKDAYS,
+    DEFAULT_COURSE_SESSIONS,
+    cancel_course,
+    change_course_protocol,
+    create_course,
+    get_courses,
+    pause_course,
+    resume_course,
+)
+from tms_app.db import execute_insert_with_return, execute_query, execute_update, report_error
+from tms_app.pagination import paginated_table
+
+st.markdown("## 🗓️ Slot Management")
+
+patients = get_patients()
+
+if not patients:
+    st.warning("⚠️ No patients in the system. Please add a patient referral first.")
+else:
+    patient_options = {patient.label: patient.id for patient in patients}
+    selected_patient = st.selectbox("Select Patient", list(patient_options.keys()))
+    patient_id = patient_options[selected_patient]
+
+    st.markdown("### 📋 Existing Sessions")
+    sessions_df = paginated_table(
+        "patient_sessions",
+        """SELECT id, session_number, session_date, status FROM tms_sessions
+        WHERE patient_id = %s""",
+        ['id', 'session_number', 'session_date', 'status'],
+        params=(patient_id,),
+        sortable={'session_number': 'session_number', 'session_date': 'session_date'},
+        default_desc=True,
+    )
+
+    if not sessions_df.empty:
+        st.markdown("### 🗑️ Delete Session from List")
+        session_options = [f"Session #{number} ({day})"
+                          for number, day in zip(sessions_df['session_number'], sessions_df['session_date'])]
+        selected_session = st.selectbox("Select session to delete", session_options)
+
+        if st.button("Delete Selected Session", type="secondary"):
+            selected_idx = session_options.index(selected_session)
+            session_id = int(sessions_df.iloc[selected_idx]['id'])
+            if delete_session(session_id):
+                st.success("✅ Session deleted successfully!")
+                st.rerun()
+
+    courses = get_courses(patient_id)
+    if courses:
+        st.markdown("### 📚 Treatment Courses")
+        protocols_by_name = {protocol.protocol_name: protocol.id for protocol in get_protocols()}
+        version = holidays_version()
+        for course in courses:
+            try:
+                planned = course.planned_dates(get_clinic_calendar(course.next_day.year - 1, version))
+            except ValueError:
+                planned = []
+            weekdays = ", ".join(calendar.day_abbr[d] for d in course.weekdays)
+            with st.expander(f"{course.protocol_name or 'No protocol'} from {course.start_date:%d %b %Y} — "
+                             f"{course.booked}/{course.session_count} booked ({course.status})"):
+                st.caption(f"Weekdays: {weekdays} · Preferred time: {course.preferred_time or 'next free slot'}")
+                if planned:
+                    st.markdown(f"**{len(planned)} sessions still to book** (booked {COURSE_HORIZON_DAYS} days "
+                                f"ahead): {planned[0]:%d %b} to {planned[-1]:%d %b %Y}")
+                    st.caption(", ".join(f"{day:%d %b}" for day in planned))
+
+                # A fully booked course is 'Completed' but can still change until its last session
+                if course.status == "Cancelled" or (course.status == "Completed"
+                                                     and course.last_booked < datetime.now().date()):
+                    continue
+                ccol1, ccol2, ccol3 = st.columns(3)
+                with ccol1:
+                    names = list(protocols_by_name)
+                    new_protocol = st.selectbox(
+                        "Protocol", names, key=f"course_protocol_{course.id}",
+                        index=names.index(course.protocol_name) if course.protocol_name in names else 0)
+                    if st.button("Switch Protocol", key=f"course_switch_{course.id}"):
+                        if change_course_protocol(course.id, protocols_by_name[new_protocol]):
+                            load_session_worklist.clear()
+                            st.toast("✅ Protocol switched for the rest of the course")
+                            st.rerun()
+                with ccol2:
+                    change_date = st.date_input("From", datetime.now(), key=f"course_date_{course.id}")
+                    if course.status != "Paused":
+                        if st.button("Pause Course", key=f"course_pause_{course.id}"):
+                            released = pause_course(course.id, change_date)
+                            if released is not None:
+                                load_session_worklist.clear()
+                                st.toast(f"⏸️ Course paused; {released} booked sessions released")
+                                st.rerun()
+                    elif st.button("Resume Course", key=f"course_resume_{course.id}"):
+                        booked = resume_course(course.id, change_date)
+                        if booked is not None:
+                            load_session_worklist.clear()
+                            st.toast(f"▶️ Course resumed; {booked} sessions booked")
+                            st.rerun()
+                with ccol3:
+                    if st.button("Cancel Course", key=f"course_cancel_{course.id}", type="secondary"):
+                        released = cancel_course(course.id)
+                        if released is not None:
+                            load_session_worklist.clear()
+                            st.toast(f"🛑 Course cancelled; {released} booked sessions released")
+                            st.rerun()
+
+    st.markdown("### ➕ Add New Sessions")
+
+    col1, col2 = st.columns(2)
+
+    with col1:
+        slot_type = st.radio("Session Type", ["Bulk Sessions", "Single Session"])
+        start_date = st.date_input("Start Date", datetime.now())
+
+    with col2:
+        if slot_type == "Bulk Sessions":
+            num_sessions = st.number_input("Number of Sessions", min_value=1, max_value=50, value=DEFAULT_COURSE_SESSIONS)
+            course_weekdays = st.multiselect("Weekdays", range(7), default=COURSE_WEEKDAYS,
+                                             format_func=lambda d: calendar.day_name[d])
+            preferred_time = st.text_input("Preferred Time (HH:MM, blank = next free slot)")
+        else:
+            num_sessions = 1
+            course_weekdays, preferred_time = None, ""
+
+    protocols = get_protocols()
+
+    if protocols:
+        protocol_options = {protocol.protocol_name: protocol.id for protocol in protocols}
+        selected_protocol = st.selectbox("Protocol", list(protocol_options.keys()))
+        protocol_id = protocol_options[selected_protocol]
+    else:
+        st.warning("⚠️ No protocols configured. Please add protocols first.")
+        protocol_id = None
+
+    # Sundays and holidays are skipped by the precomputed clinic calendar
+    if course_weekdays == []:
+        st.warning("⚠️ Pick at least one weekday for the course.")
+        session_dates = []
+    else:
+        try:
+            session_dates = get_clinic_calendar(start_date.year - 1).clinic_days(start_date, num_sessions,
+                                                                                course_weekdays)
+        except Exception as e:
+            report_error(f"Error loading the clinic calendar: {e}")
+            session_dates = []
+    if session_dates and slot_type == "Bulk Sessions":
+        st.caption(f"📅 {len(session_dates)} sessions: {session_dates[0]:%d %b %Y} to {session_dates[-1]:%d %b %Y}. "
+                   f"Sessions are booked {COURSE_HORIZON_DAYS} days ahead; the rest stay in the course until then.")
+
+    if st.button("Create Slots", type="primary") and protocol_id and session_dates:
+        if slot_type == "Bulk Sessions":
+            if preferred_time and not re.fullmatch(r"([01]\d|2[0-3]):[0-5]\d", preferred_time.strip()):
+                st.error("❌ Preferred time must be HH:MM")
+            else:
+                course_id, booked = create_course(patient_id, protocol_id, start_date, num_sessions,
+                                                  course_weekdays, preferred_time.strip())
+                if course_id:
+                    load_session_worklist.clear()
+                    st.success(f"✅ Course of {num_sessions} sessions created; {booked} booked now, "
+                               f"the rest are booked nightly as they come within {COURSE_HORIZON_DAYS} days")
+                    st.info("ℹ️ Sundays and holidays were automatically skipped")
+        else:
+            session_num = get_next_session_number(patient_id)
+            created_count = 0
+
+            proto_result = execute_query(
+                "SELECT session_duration FROM protocol_library WHERE id = %s",
+                (protocol_id,),
+                fetch_one=True
+            )
+            session_duration_minutes = int(proto_result[0]) if proto_result else 20
+
+            for current_date in session_dates:
+                scheduled_time = calculate_next_slot_time(current_date, session_duration_minutes)
+
+                session_id = execute_insert_with_return(
+                    """INSERT INTO tms_sessions
+                    (patient_id, session_number, session_date, protocol_id, status)
+                    VALUES (%s, %s, %s, %s, 'Scheduled') RETURNING id""",
+                    (patient_id, int(session_num), current_date, protocol_id)
+                )
+
+                if session_id:
+                    execute_update(
+                        """INSERT INTO daily_slots
+                        (slot_date, session_id, scheduled_time, slot_duration, status)
+                        VALUES (%s, %s, %s, %s, 'Scheduled')""",
+                        (current_date, int(session_id), scheduled_time, session_duration_minutes)
+                    )
+                    created_count += 1
+                    session_num += 1
+
+            load_session_worklist.clear()
+            st.success(f"✅ Created {created_count} session slots successfully!")
+            st.info("ℹ️ Sundays and holidays were automatically skipped")
+            st.info(f"ℹ️ Each session duration: {session_duration_minutes} minutes (from protocol)")
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Staff Roster page: SR/JR assignments for a whole month, one row per day.
+"""
+import calendar
+from datetime import date, timedelta
+
+import pandas as pd
+import streamlit as st
+
+from tms_app.data import RosterDay, get_roster, save_roster
+
+st.markdown("## 👥 Staff Roster")
+
+
+def names(row):
+    """(SR, JR1, JR2) with blank cells as None"""
+    return tuple(name.strip() or None if isinstance(name, str) else None
+                 for name in (row.SR, row.JR1, row.JR2))
+
+
+today = date.today()
+col1, col2 = st.columns(2)
+with col1:
+    year = st.number_input("Year", min_value=2020, max_value=2100, value=today.year, step=1)
+with col2:
+    month = st.selectbox("Month", range(1, 13), index=today.month - 1,
+                         format_func=lambda m: calendar.month_name[m])
+
+first_day = date(int(year), month, 1)
+days = [first_day + timedelta(days=i) for i in range(calendar.monthrange(int(year), month)[1])]
+editor_key = f"roster_editor_{first_day:%Y_%m}"
+
+roster = {day.roster_date: day for day in get_roster(days[0], days[-1])}
+df = pd.DataFrame(
+    [(day, day.strftime("%a"),
+      *(roster[day][1:] if day in roster else (None, None, None))) for day in days],
+    columns=["Date", "Day", "SR", "JR1", "JR2"],
+)
+
+# ==================== FILL WHOLE MONTH ====================
+
+with st.expander("Fill whole month"):
+    fcol1, fcol2, fcol3 = st.columns(3)
+    with fcol1:
+        fill_sr = st.text_input("SR Name", key="roster_fill_sr")
+    with fcol2:
+        fill_jr1 = st.text_input("JR1 Name", key="roster_fill_jr1")
+    with fcol3:
+        fill_jr2 = st.text_input("JR2 Name", key="roster_fill_jr2")
+    skip_sundays = st.checkbox("Skip Sundays", value=True, key="roster_fill_skip_sundays")
+    overwrite = st.checkbox("Overwrite days that already have staff", value=False,
+                            key="roster_fill_overwrite")
+
+    if st.button("Fill Month", key="roster_fill"):
+        fill_days = [RosterDay(day, fill_sr, fill_jr1, fill_jr2) for day in days
+                     if not (skip_sundays and day.weekday() == 6) and (overwrite or day not in roster)]
+        if not (fill_sr or fill_jr1 or fill_jr2):
+            st.error("❌ Enter at least one name to fill")
+        elif not fill_days:
+            st.info("ℹ️ Every day in this month already has staff")
+        elif save_roster(fill_days):
+            st.session_state.pop(editor_key, None)
+            st.toast(f"✅ Filled {len(fill_days)} day(s)")
+            st.rerun()
+
+# ==================== MONTH EDITOR ====================
+
+edited = st.data_editor(
+    df,
+    key=editor_key,
+    hide_index=True,
+    use_container_width=True,
+    disabled=["Date", "Day"],
+    column_config={
+        "Date": st.column_config.DateColumn("Date", format="DD MMM YYYY"),
+        "SR": st.column_config.TextColumn("SR Name"),
+        "JR1": st.column_config.TextColumn("JR1 Name"),
+        "JR2": st.column_config.TextColumn("JR2 Name"),
+    },
+)
+
+if st.button("💾 Save Roster", type="primary"):
+    changed = [RosterDay(row.Date, *names(row))
+               for row, before in zip(edited.itertuples(index=False), df.itertuples(index=False))
+               if names(row) != names(before)]
+    if not changed:
+        st.info("ℹ️ No changes to save")
+    elif save_roster(changed):
+        st.session_state.pop(editor_key, None)
+        st.toast(f"✅ Saved {len(changed)} day(s)")
+        st.rerun()
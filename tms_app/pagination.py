@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Keyset (seek) pagination for list views.
+"""
+import json
+
+import pandas as pd
+import streamlit as st
+
+from tms_app.db import execute_query
+
+PAGE_SIZE = 25
+
+def estimate_row_count(query, params=None):
+    """Planner row estimate for a query, so list views don't need a full COUNT(*)"""
+    try:
+        result = execute_query("EXPLAIN (FORMAT JSON) " + query, params, fetch_one=True)
+        if not result:
+            return None
+        plan = result[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+    except Exception as e:
+        return None
+
+def fetch_keyset_page(base_query, params, sort_column, descending=False, after=None, page_size=PAGE_SIZE):
+    """Fetch one page of base_query ordered by (sort_column, id), seeking past the `after` key.
+
+    base_query must select an `id` column and must not have its own ORDER BY/LIMIT.
+    sort_column is interpolated into the SQL, so only pass whitelisted column names.
+    Returns (rows, has_next).
+    """
+    op, direction = ("<", "DESC") if descending else (">", "ASC")
+    page_params = list(params or ())
+    where = ""
+    if after is not None:
+        # A row comparison with NULL is NULL, so NULL sort keys get their own seek.
+        # Postgres puts NULLs last ascending and first descending.
+        sort_value, last_id = after
+        if sort_value is None:
+            where = f"WHERE (q.{sort_column} IS NULL AND q.id {op} %s)"
+            if descending:
+                where += f" OR q.{sort_column} IS NOT NULL"
+            page_params.append(last_id)
+        else:
+            where = f"WHERE ((q.{sort_column}, q.id) {op} (%s, %s)"
+            where += ")" if descending else f" OR q.{sort_column} IS NULL)"
+            page_params.extend(after)
+    page_params.append(page_size + 1)
+    rows = execute_query(
+        f"""SELECT * FROM ({base_query}) AS q {where}
+        ORDER BY q.{sort_column} {direction}, q.id {direction} LIMIT %s""",
+        tuple(page_params)
+    ) or []
+    return rows[:page_size], len(rows) > page_size
+
+def paginated_table(key, base_query, columns, params=None, sortable=None,
+                    default_sort=None, default_desc=False, page_size=PAGE_SIZE):
+    """Render base_query as a sortable, keyset-paginated table and return the current page.
+
+    columns are the display labels, in the same order as the base_query select list
+    (first column must be `id`). sortable maps display label -> SQL column name.
+    """
+    sortable = sortable or {columns[0]: "id"}
+    sort_labels = list(sortable.keys())
+    default_sort = default_sort or sort_labels[0]
+
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        sort_label = st.selectbox("Sort by", sort_labels, index=sort_labels.index(default_sort),
+                                  key=f"{key}_sort")
+    with col2:
+        descending = st.toggle("Descending", value=default_desc, key=f"{key}_desc")
+
+    # Cursor stack: keyset of the last row of every page before the current one
+    state_key = f"{key}_pager"
+    pager = st.session_state.get(state_key)
+    if not pager or pager["order"] != (sort_label, descending, params):
+        pager = {"order": (sort_label, descending, params), "cursors": [None]}
+        st.session_state[state_key] = pager
+
+    rows, has_next = fetch_keyset_page(base_query, params, sortable[sort_label],
+                                       descending, pager["cursors"][-1], page_size)
+    df = pd.DataFrame(rows, columns=columns)
+    st.dataframe(df, use_container_width=True, hide_index=True)
+
+    page_num = len(pager["cursors"])
+    first_row = (page_num - 1) * page_size + 1
+    last_row = first_row + len(rows) - 1
+    if has_next:
+        # Planner estimates can be stale; never show fewer rows than we've already seen
+        estimate = estimate_row_count(base_query, params)
+        total_text = f" of ~{max(estimate or 0, last_row + 1)}"
+    else:
+        total_text = f" of {last_row}"
+    if rows:
+        st.caption(f"Page {page_num} · rows {first_row}–{last_row}{total_text}")
+
+    def _next_page(cursor):
+        st.session_state[state_key]["cursors"].append(cursor)
+
+    def _prev_page():
+        st.session_state[state_key]["cursors"].pop()
+
+    next_cursor = None
+    if rows:
+        last = rows[-1]
+        next_cursor = (last[columns.index(sort_label)], last[0])
+
+    col1, col2, _ = st.columns([1, 1, 4])
+    with col1:
+        st.button("◀ Previous", key=f"{key}_prev", on_click=_prev_page, disabled=page_num == 1)
+    with col2:
+        st.button("Next ▶", key=f"{key}_next", on_click=_next_page, args=(next_cursor,),
+                  disabled=not has_next)
+
+    return df
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Stimulation parameters, stored once per change.
+
+Completing a session used to append a full copy of the parameters to
+session_parameters. Now `parameter_versions` gets a row only when a patient's
+values differ from their current version; the session points at the version
+it used (tms_sessions.parameter_version_id) and `current_parameters` holds
+each patient's latest version, so auto-population is a primary-key lookup.
+
+session_parameters is no longer written; create_tables folds its rows into
+versions once (tms_app/db.py).
+"""
+
+# (column, type) of a parameter version, in the order auto-population reads them
+PARAMETER_COLUMNS = [
+    ("target_laterality", "text"),
+    ("target_region", "text"),
+    ("coord_left_x", "real"),
+    ("coord_left_y", "real"),
+    ("coord_right_x", "real"),
+    ("coord_right_y", "real"),
+    ("rmt_left", "real"),
+    ("rmt_right", "real"),
+    ("intensity_percent_left", "real"),
+    ("intensity_percent_right", "real"),
+    ("intensity_output_left", "integer"),
+    ("intensity_output_right", "integer"),
+    ("coil_type", "text"),
+    ("protocol_id", "integer"),
+]
+PARAMETER_NAMES = ", ".join(name for name, _ in PARAMETER_COLUMNS)
+
+
+def save_parameter_version(c, patient_id, session_id, params):
+    """Link the session to the patient's parameters, adding a version only if they changed.
+
+    Runs inside the caller's transaction; returns the version id.
+    """
+    values = [params.get(name) for name, _ in PARAMETER_COLUMNS]
+    # Compare in SQL so REAL columns are matched at their stored precision
+    c.execute(f"""
+        SELECT pv.id, ({", ".join(f"pv.{name}" for name, _ in PARAMETER_COLUMNS)})
+               IS NOT DISTINCT FROM ({", ".join(f"%s::{kind}" for _, kind in PARAMETER_COLUMNS)})
+        FROM current_parameters cp
+        JOIN parameter_versions pv ON pv.id = cp.version_id
+        WHERE cp.patient_id = %s
+        FOR UPDATE OF cp""", (*values, patient_id))
+    current = c.fetchone()
+    if current and current[1]:
+        version_id = current[0]
+    else:
+        c.execute(f"""INSERT INTO parameter_versions (patient_id, {PARAMETER_NAMES})
+                      VALUES (%s, {", ".join(["%s"] * len(PARAMETER_COLUMNS))}) RETURNING id""",
+                  (patient_id, *values))
+        version_id = c.fetchone()[0]
+        c.execute("""INSERT INTO current_parameters (patient_id, version_id) VALUES (%s, %s)
+                     ON CONFLICT (patient_id) DO UPDATE
+                     SET version_id = EXCLUDED.version_id, updated_at = NOW()""", (patient_id, version_id))
+    if session_id:
+        c.execute("UPDATE tms_sessions SET parameter_version_id = %s WHERE id = %s", (version_id, session_id))
+    return version_id
+
+
+def backfill_parameter_versions(c):
+    """One-time: fold session_parameters history into versions, session links and current pointers"""
+    c.execute("SELECT EXISTS (SELECT 1 FROM parameter_versions)")
+    if c.fetchone()[0]:
+        return
+    # A row starts a new version when its values differ from the patient's previous row
+    c.execute(f"""
+        INSERT INTO parameter_versions (patient_id, {PARAMETER_NAMES}, created_at)
+        SELECT patient_id, {PARAMETER_NAMES}, created_at
+        FROM (SELECT sp.*,
+                     jsonb_build_array({PARAMETER_NAMES}) IS DISTINCT FROM
+                     LAG(jsonb_build_array({PARAMETER_NAMES}))
+                         OVER (PARTITION BY patient_id ORDER BY created_at, id) AS changed
+              FROM session_parameters sp) history
+        WHERE changed
+        ORDER BY created_at, id""")
+    if not c.rowcount:
+        return
+    c.execute("""
+        UPDATE tms_sessions ts SET parameter_version_id = (
+            SELECT pv.id FROM parameter_versions pv
+            WHERE pv.patient_id = sp.patient_id AND pv.created_at <= sp.created_at
+            ORDER BY pv.created_at DESC, pv.id DESC LIMIT 1)
+        FROM session_parameters sp
+        WHERE sp.session_id = ts.id""")
+    c.execute("""
+        INSERT INTO current_parameters (patient_id, version_id)
+        SELECT DISTINCT ON (patient_id) patient_id, id FROM parameter_versions
+        ORDER BY patient_id, created_at DESC, id DESC
+        ON CONFLICT (patient_id) DO NOTHING""")
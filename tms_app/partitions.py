@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+Monthly range partitioning and archival of schedule history.
+
+- daily_slots can be converted (once, via ``python -m tms_app.batch
+  partition-daily-slots``) into a table range-partitioned by month on slot_date,
+  so queries for a date only touch that month's partition and indexes.
+- Completed/missed history older than a configurable age is moved out of
+  tms_sessions, daily_slots and session_parameters into *_archive tables,
+  which are range-partitioned by month on session_date / slot_date / created_at.
+
+tms_sessions itself stays a plain table: its id is the foreign-key target of
+daily_slots and session_parameters, and a partitioned table's unique key must
+include the partition column. Archival keeps it proportional to the active window.
+"""
+from datetime import date, timedelta
+
+from tms_app.change_feed import create_change_feed
+
+# table -> partition key column
+ARCHIVE_TABLES = {
+    "tms_sessions_archive": ("tms_sessions", "session_date"),
+    "daily_slots_archive": ("daily_slots", "slot_date"),
+    "session_parameters_archive": ("session_parameters", "created_at"),
+}
+PARTITION_KEYS = {
+    "daily_slots": "slot_date",
+    **{archive: key for archive, (_, key) in ARCHIVE_TABLES.items()},
+}
+ARCHIVABLE_STATUSES = ("Completed", "Missed")
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def add_months(day, months):
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    return f"{table}_y{month.year}m{month.month:02d}"
+
+
+def is_partitioned(c, table):
+    c.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+    row = c.fetchone()
+    return bool(row) and row[0] == "p"
+
+
+def create_archive_tables(c):
+    """Create the partitioned *_archive tables (called from create_tables)"""
+    for archive, (source, key) in ARCHIVE_TABLES.items():
+        c.execute(f"""CREATE TABLE IF NOT EXISTS {archive} (LIKE {source})
+                      PARTITION BY RANGE ({key})""")
+        c.execute(f"CREATE TABLE IF NOT EXISTS {archive}_default PARTITION OF {archive} DEFAULT")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_tms_sessions_archive_patient ON tms_sessions_archive (patient_id, session_number)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_daily_slots_archive_session ON daily_slots_archive (session_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_session_parameters_archive_patient ON session_parameters_archive (patient_id, created_at)")
+
+
+def ensure_month_partition(c, table, month):
+    """Create the partition for `month`, moving any rows that landed in the default partition"""
+    name = partition_name(table, month)
+    c.execute("SELECT to_regclass(%s)", (name,))
+    if c.fetchone()[0] is not None:
+        return False
+    key = PARTITION_KEYS[table]
+    lower, upper = month, add_months(month, 1)
+    c.execute(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS)")
+    c.execute(f"""WITH moved AS (
+                      DELETE FROM {table}_default WHERE {key} >= %s AND {key} < %s RETURNING *
+                  )
+                  INSERT INTO {name} SELECT * FROM moved""", (lower, upper))
+    c.execute(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)",
+              (lower, upper))
+    return True
+
+
+def ensure_partitions(conn, first_month, last_month):
+    """Make sure every partitioned table has monthly partitions from first_month to last_month"""
+    c = conn.cursor()
+    created = 0
+    for table in PARTITION_KEYS:
+        if not is_partitioned(c, table):
+            continue
+        month = month_start(first_month)
+        while month <= last_month:
+            created += ensure_month_partition(c, table, month)
+            month = add_months(month, 1)
+    conn.commit()
+    c.close()
+    return created
+
+
+def partition_daily_slots(conn, months_ahead=3):
+    """One-time migration: rebuild daily_slots as a table range-partitioned by month on slot_date"""
+    c = conn.cursor()
+    if is_partitioned(c, "daily_slots"):
+        c.close()
+        return False
+
+    c.execute("SELECT MIN(slot_date) FROM daily_slots")
+    first = c.fetchone()[0] or date.today()
+
+    c.execute("LOCK TABLE daily_slots IN ACCESS EXCLUSIVE MODE")
+    c.execute("ALTER TABLE daily_slots RENAME TO daily_slots_unpartitioned")
+    c.execute("ALTER SEQUENCE daily_slots_id_seq OWNED BY NONE")
+    c.execute("""CREATE TABLE daily_slots (LIKE daily_slots_unpartitioned INCLUDING DEFAULTS)
+                 PARTITION BY RANGE (slot_date)""")
+    c.execute("ALTER TABLE daily_slots ALTER COLUMN slot_date SET NOT NULL")
+    c.execute("ALTER TABLE daily_slots ADD PRIMARY KEY (id, slot_date)")
+    c.execute("""ALTER TABLE daily_slots ADD FOREIGN KEY (session_id)
+                 REFERENCES tms_sessions(id) ON DELETE CASCADE""")
+    c.execute("CREATE TABLE daily_slots_default PARTITION OF daily_slots DEFAULT")
+
+    month = month_start(first)
+    last = add_months(month_start(date.today()), months_ahead)
+    while month <= last:
+        c.execute(f"""CREATE TABLE {partition_name('daily_slots', month)} PARTITION OF daily_slots
+                      FOR VALUES FROM (%s) TO (%s)""", (month, add_months(month, 1)))
+        month = add_months(month, 1)
+
+    c.execute("INSERT INTO daily_slots SELECT * FROM daily_slots_unpartitioned")
+    c.execute("DROP TABLE daily_slots_unpartitioned")
+    c.execute("ALTER SEQUENCE daily_slots_id_seq OWNED BY daily_slots.id")
+
+    # Indexes are recreated on the partitioned parent and cascade to every partition
+    c.execute("CREATE INDEX IF NOT EXISTS idx_daily_slots_session ON daily_slots (session_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_daily_slots_id ON daily_slots (id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_daily_slots_date_time ON daily_slots (slot_date, scheduled_time)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_daily_slots_scheduled_date ON daily_slots (slot_date) WHERE status = 'Scheduled'")
+    # Triggers went with the old table
+    create_change_feed(c)
+    conn.commit()
+    c.close()
+    return True
+
+
+def _shared_columns(c, source, archive):
+    c.execute("""SELECT a.column_name FROM information_schema.columns a
+                 JOIN information_schema.columns b
+                   ON b.column_name = a.column_name AND b.table_name = %s AND b.table_schema = a.table_schema
+                 WHERE a.table_name = %s AND a.table_schema = current_schema()
+                 ORDER BY a.ordinal_position""", (archive, source))
+    return ", ".join(row[0] for row in c.fetchall())
+
+
+def archive_history(conn, cutoff, chunk_size):
+    """Move completed/missed sessions dated before `cutoff`, with their slots and
+    parameters, into the archive tables. Commits per chunk; returns (sessions, slots, parameters, chunks).
+
+    parameter_versions stay in place: they are few, and archived sessions keep pointing at them.
+    """
+    c = conn.cursor()
+    c.execute("""SELECT LEAST(
+                     (SELECT MIN(session_date) FROM tms_sessions
+                      WHERE status = ANY(%s) AND session_date < %s),
+                     (SELECT MIN(sp.created_at)::date FROM session_parameters sp
+                      JOIN tms_sessions ts ON ts.id = sp.session_id
+                      WHERE ts.status = ANY(%s) AND ts.session_date < %s))""",
+              (list(ARCHIVABLE_STATUSES), cutoff, list(ARCHIVABLE_STATUSES), cutoff))
+    first = c.fetchone()[0]
+    if first is None:
+        c.close()
+        return 0, 0, 0, 0
+    ensure_partitions(conn, first, month_start(date.today()))
+
+    session_cols = _shared_columns(c, "tms_sessions", "tms_sessions_archive")
+    slot_cols = _shared_columns(c, "daily_slots", "daily_slots_archive")
+    param_cols = _shared_columns(c, "session_parameters", "session_parameters_archive")
+
+    totals, chunks = (0, 0, 0), 0
+    while True:
+        c.execute(f"""
+            WITH batch AS (
+                SELECT id FROM tms_sessions
+                WHERE status = ANY(%s) AND session_date < %s
+                ORDER BY id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            ), params AS (
+                DELETE FROM session_parameters sp USING batch
+                WHERE sp.session_id = batch.id
+                RETURNING sp.*
+            ), archived_params AS (
+                INSERT INTO session_parameters_archive ({param_cols}) SELECT {param_cols} FROM params
+            ), slots AS (
+                DELETE FROM daily_slots ds USING batch WHERE ds.session_id = batch.id
+                RETURNING ds.*
+            ), archived_slots AS (
+                INSERT INTO daily_slots_archive ({slot_cols}) SELECT {slot_cols} FROM slots
+            ), sessions AS (
+                DELETE FROM tms_sessions ts USING batch WHERE ts.id = batch.id
+                RETURNING ts.*
+            ), archived_sessions AS (
+                INSERT INTO tms_sessions_archive ({session_cols}) SELECT {session_cols} FROM sessions
+            )
+            SELECT (SELECT COUNT(*) FROM sessions), (SELECT COUNT(*) FROM slots),
+                   (SELECT COUNT(*) FROM params)
+        """, (list(ARCHIVABLE_STATUSES), cutoff, chunk_size))
+        counts = c.fetchone()
+        conn.commit()
+        chunks += 1
+        totals = tuple(a + b for a, b in zip(totals, counts))
+        if counts[0] < chunk_size:
+            break
+    c.close()
+    return (*totals, chunks)
+
+
+def default_cutoff(today, archive_after_days):
+    return today - timedelta(days=archive_after_days)
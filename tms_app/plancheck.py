@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Query plan regression checks for the hot queries (tms_app/queries.py).
+
+Each registered query is PREPAREd the way the app runs it and executed under
+EXPLAIN (ANALYZE, BUFFERS) with representative parameters from the database.
+The plan shape (node, relation, index), total cost and shared buffers are
+compared with a stored baseline:
+
+    python -m tms_app.plancheck --embedded /tmp/tms-plan --seed --update   # record
+    python -m tms_app.plancheck --embedded /tmp/tms-plan --seed            # check (exit 1 on regression)
+
+--seed empties every table first (TRUNCATE ... RESTART IDENTITY) and seeds a
+clinic's worth of history, so each run plans against the same data; the
+tables are VACUUM ANALYZEd before anything is explained.
+
+A query fails when it reads tms_sessions or daily_slots (or a daily_slots
+partition) with a Seq Scan, when a relation it read through an index is now
+read with a Seq Scan, or when its buffers exceed both --buffer-factor x
+baseline and the baseline + --buffer-slack. Other plan changes and cost growth
+are reported as warnings. Run it against a local database only
+(TMS_DATABASE_URL or --embedded): --seed deletes all its data.
+"""
+import argparse
+import json
+import os
+import re
+import sys
+from datetime import date
+
+from tms_app.queries import HOT_QUERIES
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "plan_baseline.json")
+INDEX_NODES = ("Index Scan", "Index Only Scan", "Bitmap Index Scan", "Bitmap Heap Scan")
+# Too big to ever be read in full by a hot query
+NEVER_SEQ = re.compile(r"^(tms_sessions|daily_slots(_y\d{4}m\d{2}|_default)?)$")
+
+
+def sample_params(c):
+    """Representative parameters for every hot query, taken from the data"""
+    c.execute("""SELECT patient_id FROM tms_sessions GROUP BY patient_id
+                 ORDER BY COUNT(*) DESC LIMIT 1""")
+    row = c.fetchone()
+    patient_id = row[0] if row else 0
+    c.execute("SELECT COALESCE(MAX(version), 0) FROM change_log")
+    version = c.fetchone()[0]
+    today = date.today()
+    return {
+        "daily_schedule": (today,),
+        "sessions_for_patient": (patient_id,),
+        "next_session_number": (patient_id,),
+        "current_parameters": (patient_id,),
+        "patient_series": (patient_id,),
+        "staff_for_date": (today,),
+        "slots_for_date": (today,),
+        "schedule_rows": (today, [0]),
+        "change_version": (),
+        # No overlap window: right after --seed every seeded change_log row would still be inside it
+        "schedule_changes": (today, version, 0),
+    }
+
+
+def plan_nodes(node, depth=0):
+    """Pre-order (depth, node type, relation, index) for a JSON plan tree"""
+    yield depth, node["Node Type"], node.get("Relation Name"), node.get("Index Name")
+    for child in node.get("Plans", []):
+        yield from plan_nodes(child, depth + 1)
+
+
+def relation_access(nodes):
+    """relation -> 'index' / 'seq' (index wins if a relation is read both ways)"""
+    access = {}
+    for _, node_type, relation, _ in nodes:
+        if not relation:
+            continue
+        kind = "index" if node_type in INDEX_NODES else "seq" if node_type == "Seq Scan" else None
+        if kind and access.get(relation) != "index":
+            access[relation] = kind
+    return access
+
+
+def explain(c, name, params):
+    """Plan summary for one hot query, executed as the app executes it"""
+    c.execute(f"PREPARE plancheck_{name} AS {HOT_QUERIES[name]}")
+    placeholders = f" ({', '.join(['%s'] * len(params))})" if params else ""
+    c.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) EXECUTE plancheck_{name}{placeholders}", params)
+    result = c.fetchone()[0][0]
+    c.execute(f"DEALLOCATE plancheck_{name}")
+    plan = result["Plan"]
+    nodes = list(plan_nodes(plan))
+    return {
+        "shape": ["  " * depth + " ".join(part for part in (node_type,
+                                                              relation and f"on {relation}",
+                                                              index and f"using {index}") if part)
+                  for depth, node_type, relation, index in nodes],
+        "access": relation_access(nodes),
+        "total_cost": plan["Total Cost"],
+        "buffers": plan.get("Shared Hit Blocks", 0) + plan.get("Shared Read Blocks", 0),
+        "execution_ms": result.get("Execution Time"),
+    }
+
+
+def compare(name, baseline, current, buffer_factor, buffer_slack, cost_factor):
+    """(failures, warnings) for one query"""
+    failures, warnings = [], []
+    for relation, kind in current["access"].items():
+        if kind == "seq" and NEVER_SEQ.match(relation):
+            failures.append(f"{name}: Seq Scan on {relation}")
+        elif kind == "seq" and baseline["access"].get(relation) == "index":
+            failures.append(f"{name}: {relation} switched from an index scan to a Seq Scan")
+    limit = max(baseline["buffers"] * buffer_factor, baseline["buffers"] + buffer_slack)
+    if current["buffers"] > limit:
+        failures.append(f"{name}: {current['buffers']} buffers (baseline {baseline['buffers']}, limit {limit:.0f})")
+    if current["total_cost"] > baseline["total_cost"] * cost_factor:
+        warnings.append(f"{name}: cost {current['total_cost']:.1f} (baseline {baseline['total_cost']:.1f})")
+    if current["shape"] != baseline["shape"] and not failures:
+        warnings.append(f"{name}: plan shape changed:\n    " + "\n    ".join(current["shape"]))
+    return failures, warnings
+
+
+def reset(conn):
+    """Empty every table in the schema, restarting the id sequences"""
+    c = conn.cursor()
+    c.execute("SELECT string_agg(quote_ident(tablename), ', ') FROM pg_tables WHERE schemaname = current_schema()")
+    c.execute(f"TRUNCATE {c.fetchone()[0]} RESTART IDENTITY CASCADE")
+    conn.commit()
+    c.close()
+
+
+def collect(conn):
+    # VACUUM can't run inside a transaction; it also sets the visibility map index-only scans rely on
+    conn.commit()
+    conn.autocommit = True
+    try:
+        conn.cursor().execute("VACUUM ANALYZE")
+    finally:
+        conn.autocommit = False
+    c = conn.cursor()
+    params = sample_params(c)
+    plans = {name: explain(c, name, params[name]) for name in HOT_QUERIES}
+    conn.rollback()
+    c.close()
+    return plans
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check hot query plans against a stored baseline")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update", action="store_true", help="record the current plans as the baseline")
+    parser.add_argument("--seed", action="store_true", help="empty the database and seed it first")
+    parser.add_argument("--patients", type=int, default=2000, help="patients to seed")
+    parser.add_argument("--past-days", type=int, default=120, help="clinic days of seeded history")
+    parser.add_argument("--embedded", metavar="DIR", help="start a local Postgres in DIR with pgserver")
+    parser.add_argument("--buffer-factor", type=float, default=2.0)
+    parser.add_argument("--buffer-slack", type=int, default=50)
+    parser.add_argument("--cost-factor", type=float, default=3.0)
+    args = parser.parse_args(argv)
+
+    if args.embedded:
+        try:
+            import pgserver
+        except ImportError:
+            parser.error("--embedded needs the pgserver package (pip install pgserver)")
+        os.environ["TMS_DATABASE_URL"] = pgserver.get_server(args.embedded).get_uri()
+    if not os.environ.get("TMS_DATABASE_URL"):
+        parser.error("set TMS_DATABASE_URL to a local database (or use --embedded)")
+
+    from tms_app.db import create_tables, get_conn, raise_errors
+    from tms_app.seed import seed
+
+    with raise_errors():
+        create_tables()
+        with get_conn() as conn:
+            if args.seed:
+                reset(conn)
+                seed(conn, args.patients, past_days=args.past_days)
+            plans = collect(conn)
+
+    if args.update or not os.path.exists(args.baseline):
+        with open(args.baseline, "w") as f:
+            json.dump(plans, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline} ({len(plans)} queries)")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    failures, warnings = [], []
+    for name, current in plans.items():
+        if name not in baseline:
+            warnings.append(f"{name}: not in the baseline (run with --update)")
+            continue
+        failed, warned = compare(name, baseline[name], current,
+                                 args.buffer_factor, args.buffer_slack, args.cost_factor)
+        failures += failed
+        warnings += warned
+        status = "FAIL" if failed else "ok"
+        print(f"{status:4} {name:28} cost {current['total_cost']:9.1f}  buffers {current['buffers']:6d}  "
+              f"{current['execution_ms']:.2f} ms")
+
+    for warning in warnings:
+        print(f"warning: {warning}")
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
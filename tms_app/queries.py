@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Named hot queries: statements that run on (almost) every rerun.
+
+Each one is PREPAREd once per pooled connection and then run with EXECUTE, so
+Postgres parses it once per connection instead of once per call (see
+db.execute_named). Placeholders are Postgres-style $1, $2, ...; keep the
+select lists explicit, because a prepared `SELECT *` breaks when a table changes.
+"""
+
+# Daily Dashboard schedule join (data.get_daily_schedule, SCHEDULE_COLUMNS order)
+SCHEDULE_SELECT = """
+        SELECT
+          p.name AS patient_name,          -- Patient
+          ts.session_number,               -- Session#
+          pl.protocol_name,                -- Protocol
+          COALESCE(ts.target_laterality || ' ' || ts.target_region, 'N/A') AS target,
+          ds.scheduled_time,               -- Time
+          p.allowed_time,                  -- Allowed Time
+          ds.status,                       -- Status
+          CASE
+            WHEN ts.intensity_output_left IS NOT NULL AND ts.intensity_output_right IS NOT NULL
+              THEN CAST(ts.intensity_output_left AS TEXT) || ' / ' || CAST(ts.intensity_output_right AS TEXT)
+            WHEN ts.intensity_output_left IS NOT NULL
+              THEN CAST(ts.intensity_output_left AS TEXT)
+            WHEN ts.intensity_output_right IS NOT NULL
+              THEN CAST(ts.intensity_output_right AS TEXT)
+            ELSE '-'
+          END AS intensity,                -- Intensity (L/R)
+          ds.id AS slot_id,
+          ts.id AS session_id
+        FROM daily_slots ds
+        JOIN tms_sessions ts ON ds.session_id = ts.id
+        JOIN patients p ON ts.patient_id = p.id
+        LEFT JOIN protocol_library pl ON ts.protocol_id = pl.id
+"""
+
+HOT_QUERIES = {
+    "daily_schedule": SCHEDULE_SELECT + """
+        WHERE ds.slot_date = $1::date
+        ORDER BY ds.scheduled_time, ds.id
+    """,
+    # Just the rows the change feed reported (data.get_schedule_rows)
+    "schedule_rows": SCHEDULE_SELECT + """
+        WHERE ds.slot_date = $1::date AND ds.session_id = ANY($2::int[])
+    """,
+    "sessions_for_patient": """
+        SELECT id, session_number, session_date, status FROM tms_sessions
+        WHERE patient_id = $1::int ORDER BY session_number DESC
+    """,
+    # Archived sessions still count towards the course numbering
+    "next_session_number": """
+        SELECT GREATEST(
+            (SELECT MAX(session_number) FROM tms_sessions WHERE patient_id = $1::int),
+            (SELECT MAX(session_number) FROM tms_sessions_archive WHERE patient_id = $1::int))
+    """,
+    # Current parameters for auto-population (data.get_previous_session_parameters)
+    "current_parameters": """
+        SELECT pv.target_laterality, pv.target_region, pv.coord_left_x, pv.coord_left_y,
+               pv.coord_right_x, pv.coord_right_y, pv.rmt_left, pv.rmt_right,
+               pv.intensity_percent_left, pv.intensity_percent_right,
+               pv.intensity_output_left, pv.intensity_output_right, pv.coil_type, pv.protocol_id
+        FROM current_parameters cp
+        JOIN parameter_versions pv ON pv.id = cp.version_id
+        WHERE cp.patient_id = $1::int
+    """,
+    # Completed sessions for the Patient Trends page (tms_app/trends.py, SERIES_COLUMNS order)
+    "patient_series": """
+        SELECT s.session_number, s.session_date, pl.protocol_name,
+               COALESCE(s.rmt_left, pv.rmt_left), COALESCE(s.rmt_right, pv.rmt_right),
+               COALESCE(s.intensity_output_left, pv.intensity_output_left),
+               COALESCE(s.intensity_output_right, pv.intensity_output_right),
+               s.side_effects
+        FROM (
+            SELECT session_number, session_date, protocol_id, parameter_version_id,
+                   rmt_left, rmt_right, intensity_output_left, intensity_output_right, side_effects
+            FROM tms_sessions WHERE patient_id = $1::int AND status = 'Completed'
+            UNION ALL
+            SELECT session_number, session_date, protocol_id, parameter_version_id,
+                   rmt_left, rmt_right, intensity_output_left, intensity_output_right, side_effects
+            FROM tms_sessions_archive WHERE patient_id = $1::int AND status = 'Completed'
+        ) s
+        LEFT JOIN parameter_versions pv ON pv.id = s.parameter_version_id
+        LEFT JOIN protocol_library pl ON pl.id = s.protocol_id
+        ORDER BY s.session_number
+    """,
+    "staff_for_date": """
+        SELECT sr_name, jr1_name, jr2_name FROM staff_roster WHERE roster_date = $1::date
+    """,
+    "slots_for_date": """
+        SELECT scheduled_time, slot_duration FROM daily_slots
+        WHERE slot_date = $1::date ORDER BY scheduled_time
+    """,
+    # Change feed polled by the dashboard (tms_app/change_feed.py)
+    "change_version": """
+        SELECT COALESCE(MAX(version), 0) FROM change_log
+    """,
+    "schedule_changes": """
+        SELECT version, session_id FROM change_log
+        WHERE change_date = $1::date
+          AND (version > $2::bigint OR changed_at > NOW() - $3::int * INTERVAL '1 second')
+        ORDER BY version
+    """,
+}
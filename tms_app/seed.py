@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic data for local load tests and demos.
+
+    TMS_DATABASE_URL=postgresql://localhost/tms_load python -m tms_app.seed --patients 60
+
+Seeded patients have MRNs starting with SEED_MRN_PREFIX; re-seeding removes
+them (and, through the foreign keys, their sessions, slots and parameters) first.
+Sessions fall on the clinic days around the given day: past ones completed
+with parameters, today's and later ones scheduled with slots. Each day fills
+its chairs from 09:00 to 17:00 with patients taking turns, so with more
+patients than a day holds each one attends only some of the days.
+"""
+import argparse
+import random
+from datetime import date, timedelta
+
+from psycopg2.extras import execute_values
+
+from tms_app.clinic_calendar import CLINIC_CHAIRS, CLOSE_MINUTES, OPEN_MINUTES
+from tms_app.db import create_tables, get_conn, raise_errors
+
+SEED_MRN_PREFIX = "LOAD-"
+SEED_PROTOCOLS = [
+    ("iTBS (seed)", "iTBS", 3),
+    ("10 Hz rTMS (seed)", "Biphasic", 20),
+    ("1 Hz rTMS (seed)", "Biphasic", 30),
+]
+DIAGNOSES = ["Major Depressive Disorder", "OCD", "Auditory hallucinations", "Chronic pain"]
+
+
+def clinic_days(start, count, step):
+    """`count` days from `start` (exclusive) in direction `step`, skipping Sundays"""
+    days, day = [], start
+    while len(days) < count:
+        day += timedelta(days=step)
+        if day.weekday() != 6:
+            days.append(day)
+    return days
+
+
+def book_days(patient_durations, days, chairs):
+    """[(day, patient_id, start minute)]: each day patients take the chair free soonest, in turn,
+    until the next one would run past closing; the next day carries on from there"""
+    order = list(patient_durations)
+    booked, turn = [], 0
+    for day in days:
+        free = [OPEN_MINUTES] * chairs
+        for _ in order:
+            patient_id = order[turn % len(order)]
+            chair = free.index(min(free))
+            if free[chair] + patient_durations[patient_id] > CLOSE_MINUTES:
+                break
+            booked.append((day, patient_id, free[chair]))
+            free[chair] += patient_durations[patient_id]
+            turn += 1
+    return booked
+
+
+def seed(conn, patients=60, past_days=10, future_days=10, today=None, rng_seed=7, chairs=CLINIC_CHAIRS):
+    """Replace the seeded patients with a fresh set; returns (patients, sessions, slots)"""
+    rng = random.Random(rng_seed)
+    today = today or date.today()
+    c = conn.cursor()
+    c.execute("DELETE FROM patients WHERE mrn LIKE %s", (SEED_MRN_PREFIX + "%",))
+
+    execute_values(c, """INSERT INTO protocol_library (protocol_name, waveform_type, session_duration)
+                         VALUES %s ON CONFLICT (protocol_name) DO NOTHING""", SEED_PROTOCOLS)
+    c.execute("SELECT id, session_duration FROM protocol_library WHERE protocol_name = ANY(%s)",
+              ([name for name, _, _ in SEED_PROTOCOLS],))
+    protocols = c.fetchall()
+
+    patient_ids = [row[0] for row in execute_values(c, """
+        INSERT INTO patients (name, mrn, age, gender, primary_diagnosis, tass_completed,
+                              consent_obtained, referred_date, status)
+        VALUES %s RETURNING id""", [
+            (f"Seed Patient {i:04d}", f"{SEED_MRN_PREFIX}{i:04d}", rng.randint(18, 80),
+             rng.choice(["Male", "Female"]), rng.choice(DIAGNOSES), 1, 1,
+             today - timedelta(days=past_days + rng.randint(1, 30)), "Started")
+            for i in range(patients)
+        ], fetch=True)]
+
+    past = clinic_days(today, past_days, -1)[::-1]
+    days = past + ([today] if today.weekday() != 6 else []) + clinic_days(today, future_days, 1)
+    patient_protocols = {patient_id: rng.choice(protocols)[0] for patient_id in patient_ids}
+    durations = {protocol_id: duration for protocol_id, duration in protocols}
+    starts = {(patient_id, day): start for day, patient_id, start in book_days(
+        {patient_id: durations[protocol_id] for patient_id, protocol_id in patient_protocols.items()},
+        days, chairs)}
+
+    # The completed sessions all used one parameter version per patient
+    versions = {}
+    if past:
+        versions = {patient_id: version_id for version_id, patient_id in execute_values(c, """
+            INSERT INTO parameter_versions (patient_id, target_laterality, target_region, rmt_left,
+                                            intensity_percent_left, intensity_output_left, coil_type, protocol_id)
+            VALUES %s RETURNING id, patient_id""",
+            [(patient_id, "Left", "DLPFC", 45, 120, 54, "rTMS (figure-8 coil)", protocol_id)
+             for patient_id, protocol_id in patient_protocols.items()], fetch=True)}
+        execute_values(c, "INSERT INTO current_parameters (patient_id, version_id) VALUES %s",
+                       list(versions.items()))
+
+    sessions = []
+    for patient_id, protocol_id in patient_protocols.items():
+        patient_days = [day for day in days if (patient_id, day) in starts]
+        for number, day in enumerate(patient_days, start=1):
+            completed = day < today
+            sessions.append((patient_id, number, day, protocol_id, "Completed" if completed else "Scheduled",
+                             versions.get(patient_id) if completed else None))
+
+    session_rows = execute_values(c, """
+        INSERT INTO tms_sessions (patient_id, session_number, session_date, protocol_id, status,
+                                  parameter_version_id,
+                                  target_laterality, target_region, rmt_left, intensity_percent_left)
+        SELECT patient_id, session_number, session_date, protocol_id, status, parameter_version_id::int,
+               'Left', 'DLPFC', 45, 120
+        FROM (VALUES %s) AS v (patient_id, session_number, session_date, protocol_id, status,
+                               parameter_version_id)
+        RETURNING id, patient_id, session_date, status, protocol_id""",
+        sessions, fetch=True)
+
+    slots = []
+    for session_id, patient_id, day, status, protocol_id in session_rows:
+        start = starts[patient_id, day]
+        slots.append((day, session_id, f"{start // 60:02d}:{start % 60:02d}", durations[protocol_id], status))
+
+    execute_values(c, """INSERT INTO daily_slots (slot_date, session_id, scheduled_time, slot_duration, status)
+                         VALUES %s""", slots)
+    conn.commit()
+    c.close()
+    return len(patient_ids), len(session_rows), len(slots)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Seed synthetic TMS data")
+    parser.add_argument("--patients", type=int, default=60)
+    parser.add_argument("--past-days", type=int, default=10)
+    parser.add_argument("--future-days", type=int, default=10)
+    parser.add_argument("--chairs", type=int, default=CLINIC_CHAIRS)
+    args = parser.parse_args(argv)
+
+    with raise_errors():
+        create_tables()
+        with get_conn() as conn:
+            counts = seed(conn, args.patients, args.past_days, args.future_days, chairs=args.chairs)
+    print("Seeded %d patients, %d sessions, %d slots" % counts)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar analytics snapshot: Parquet files on local disk, off the live tables.
+
+    python -m tms_app.batch snapshot        # also part of `all`
+
+Layout under SNAPSHOT_DIR (default ~/.tms_dashboard/snapshot):
+
+    sessions/month=YYYY-MM/part-0.parquet   tms_sessions + tms_sessions_archive
+    slots/month=YYYY-MM/part-0.parquet      daily_slots + daily_slots_archive
+    parameters/part-0.parquet               parameter_versions
+    patients/part-0.parquet                 patients (cohort columns only)
+    protocols/part-0.parquet                protocol_library
+    courses/part-0.parquet                  treatment_courses
+    _state.json                             high-water mark
+
+Sessions and slots are incremental: the change feed (tms_app/change_feed.py)
+names the sessions changed since the last export's change_log version, and
+only the months those changes touched are rewritten. Rows moved to the
+archive tables stay in the snapshot; deleted ones are dropped. Parameters,
+patients, protocols and courses are small and rewritten in full. A full rebuild happens on the
+first run, or when the last export is older than the change log keeps.
+
+Analytics pages read through load_snapshot(), which opens only the requested
+columns and months.
+"""
+import json
+import os
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import streamlit as st
+
+from tms_app.change_feed import CHANGE_LOG_KEEP_DAYS, CHANGE_OVERLAP_SECONDS
+from tms_app.db import get_setting
+
+SNAPSHOT_DIR = get_setting("SNAPSHOT_DIR", os.path.join(os.path.expanduser("~"), ".tms_dashboard", "snapshot"))
+STATE_FILE = "_state.json"
+MONTH_PARTITIONING = ds.partitioning(pa.schema([("month", pa.string())]), flavor="hive")
+
+# Monthly tables: (live table, archive table, key column the change feed reports, date column, schema)
+MONTHLY_TABLES = {
+    "sessions": ("tms_sessions", "tms_sessions_archive", "id", "session_date", pa.schema([
+        ("id", pa.int32()),
+        ("patient_id", pa.int32()),
+        ("session_number", pa.int32()),
+        ("session_date", pa.date32()),
+        ("status", pa.string()),
+        ("protocol_id", pa.int32()),
+        ("course_id", pa.int32()),
+        ("parameter_version_id", pa.int32()),
+        ("target_laterality", pa.string()),
+        ("target_region", pa.string()),
+        ("rmt_left", pa.float32()),
+        ("rmt_right", pa.float32()),
+        ("intensity_percent_left", pa.float32()),
+        ("intensity_percent_right", pa.float32()),
+        ("intensity_output_left", pa.int32()),
+        ("intensity_output_right", pa.int32()),
+        ("coil_type", pa.string()),
+        ("side_effects", pa.string()),
+    ])),
+    "slots": ("daily_slots", "daily_slots_archive", "session_id", "slot_date", pa.schema([
+        ("id", pa.int32()),
+        ("slot_date", pa.date32()),
+        ("session_id", pa.int32()),
+        ("scheduled_time", pa.string()),
+        ("slot_duration", pa.int32()),
+        ("status", pa.string()),
+    ])),
+}
+# Small tables, rewritten in full: (table, schema)
+FULL_TABLES = {
+    "parameters": ("parameter_versions", pa.schema([
+        ("id", pa.int32()),
+        ("patient_id", pa.int32()),
+        ("target_laterality", pa.string()),
+        ("target_region", pa.string()),
+        ("coord_left_x", pa.float32()),
+        ("coord_left_y", pa.float32()),
+        ("coord_right_x", pa.float32()),
+        ("coord_right_y", pa.float32()),
+        ("rmt_left", pa.float32()),
+        ("rmt_right", pa.float32()),
+        ("intensity_percent_left", pa.float32()),
+        ("intensity_percent_right", pa.float32()),
+        ("intensity_output_left", pa.int32()),
+        ("intensity_output_right", pa.int32()),
+        ("coil_type", pa.string()),
+        ("protocol_id", pa.int32()),
+        ("created_at", pa.timestamp("us")),
+    ])),
+    # No names or MRNs: analytics only need the cohort attributes
+    "patients": ("patients", pa.schema([
+        ("id", pa.int32()),
+        ("primary_diagnosis", pa.string()),
+        ("status", pa.string()),
+        ("referred_date", pa.date32()),
+    ])),
+    "protocols": ("protocol_library", pa.schema([
+        ("id", pa.int32()),
+        ("protocol_name", pa.string()),
+        ("waveform_type", pa.string()),
+        ("session_duration", pa.int32()),
+    ])),
+    "courses": ("treatment_courses", pa.schema([
+        ("id", pa.int32()),
+        ("patient_id", pa.int32()),
+        ("protocol_id", pa.int32()),
+        ("start_date", pa.date32()),
+        ("session_count", pa.int32()),
+        ("status", pa.string()),
+    ])),
+}
+
+
+def month_key(day):
+    return f"{day:%Y-%m}" if day else "none"
+
+
+def snapshot_state(directory=SNAPSHOT_DIR):
+    """The last export's {"version", "since", "exported_at"}, or {} if there is none"""
+    try:
+        with open(os.path.join(directory, STATE_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+# ==================== EXPORT ====================
+
+def _write(table, path):
+    """Write a Parquet file atomically (readers never see a half-written file)"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pq.write_table(table, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+def _fetch(c, sql, params, schema):
+    c.execute(sql, params)
+    rows = c.fetchall()
+    return pa.Table.from_pydict({field.name: [row[i] for row in rows] for i, field in enumerate(schema)},
+                                schema=schema)
+
+def _fetch_monthly(c, name, session_ids=None):
+    """Live and archived rows of a monthly table, optionally only for some sessions"""
+    live, archive, key, _, schema = MONTHLY_TABLES[name]
+    columns = ", ".join(schema.names)
+    where = f"WHERE {key} = ANY(%(ids)s)" if session_ids is not None else ""
+    return _fetch(c, f"SELECT {columns} FROM {live} {where} UNION ALL SELECT {columns} FROM {archive} {where}",
+                  {"ids": session_ids}, schema)
+
+def _by_month(table, date_column):
+    months = pd.Series([month_key(day) for day in table.column(date_column).to_pylist()], dtype=object)
+    return {month: table.take(pa.array(months.index[months == month])) for month in months.unique()}
+
+def _month_path(directory, name, month):
+    return os.path.join(directory, name, f"month={month}", "part-0.parquet")
+
+def _export_monthly(c, directory, name, changes):
+    """Rewrite the months touched by `changes` ({session ids}, {months}); None = full rebuild"""
+    _, _, key, date_column, schema = MONTHLY_TABLES[name]
+    if changes is None:
+        fresh = _by_month(_fetch_monthly(c, name), date_column)
+        for month, rows in fresh.items():
+            _write(rows, _month_path(directory, name, month))
+        # Months with no rows left
+        root = os.path.join(directory, name)
+        for entry in os.listdir(root) if os.path.isdir(root) else []:
+            if entry.startswith("month=") and entry[len("month="):] not in fresh:
+                os.remove(_month_path(directory, name, entry[len("month="):]))
+        return sum(len(rows) for rows in fresh.values())
+
+    session_ids, months = changes
+    fresh = _by_month(_fetch_monthly(c, name, sorted(session_ids)), date_column)
+    for month in months | set(fresh):
+        path = _month_path(directory, name, month)
+        parts = []
+        if os.path.exists(path):
+            kept = pq.read_table(path, schema=schema)
+            parts.append(kept.filter(pc.invert(pc.is_in(
+                kept.column(key), value_set=pa.array(sorted(session_ids), pa.int32())))))
+        if month in fresh:
+            parts.append(fresh[month])
+        rows = pa.concat_tables(parts) if parts else schema.empty_table()
+        if len(rows):
+            _write(rows, path)
+        elif os.path.exists(path):
+            os.remove(path)
+    return sum(len(rows) for rows in fresh.values())
+
+def export_snapshot(conn, directory=SNAPSHOT_DIR):
+    """Bring the snapshot up to date; returns {table: rows written} and whether it was a full rebuild"""
+    state = snapshot_state(directory)
+    conn.commit()
+    c = conn.cursor()
+    # One consistent view of every table and the change log
+    c.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+    c.execute("SELECT NOW(), COALESCE(MAX(version), 0) FROM change_log")
+    now, version = c.fetchone()
+
+    full = not state or datetime.fromisoformat(state["since"]) < now - timedelta(days=CHANGE_LOG_KEEP_DAYS)
+    changes = None
+    if not full:
+        # The overlap re-reads entries a slow transaction may have committed late
+        c.execute("""SELECT session_id, change_date FROM change_log
+                     WHERE version > %s OR changed_at > %s""", (state["version"], state["since"]))
+        rows = c.fetchall()
+        changes = ({session_id for session_id, _ in rows if session_id is not None},
+                   {month_key(day) for _, day in rows})
+
+    written = {}
+    for name in MONTHLY_TABLES:
+        written[name] = _export_monthly(c, directory, name, changes)
+    for name, (table, schema) in FULL_TABLES.items():
+        rows = _fetch(c, f"SELECT {', '.join(schema.names)} FROM {table} ORDER BY id", (), schema)
+        _write(rows, os.path.join(directory, name, "part-0.parquet"))
+        written[name] = len(rows)
+    c.close()
+    conn.commit()
+
+    _write_state(directory, {
+        "version": version,
+        "since": (now - timedelta(seconds=CHANGE_OVERLAP_SECONDS)).isoformat(),
+        "exported_at": now.isoformat(),
+    })
+    return written, full
+
+def _write_state(directory, state):
+    path = os.path.join(directory, STATE_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(path + ".tmp", path)
+
+# ==================== READ ====================
+
+def load_snapshot(name, columns=None, start=None, end=None, directory=SNAPSHOT_DIR):
+    """DataFrame of a snapshot table, reading only `columns` and (monthly tables) the months in start..end.
+
+    Cached until the next export.
+    """
+    return _load_snapshot(name, tuple(columns) if columns else None, start, end, directory,
+                          snapshot_state(directory).get("exported_at"))
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _load_snapshot(name, columns, start, end, directory, exported_at):
+    schema = MONTHLY_TABLES[name][4] if name in MONTHLY_TABLES else FULL_TABLES[name][1]
+    columns = list(columns or schema.names)
+    path = os.path.join(directory, name)
+    if not exported_at or not os.path.isdir(path):
+        return schema.empty_table().select(columns).to_pandas()
+
+    if name not in MONTHLY_TABLES:
+        return pq.read_table(os.path.join(path, "part-0.parquet"), columns=columns).to_pandas()
+
+    date_column = MONTHLY_TABLES[name][3]
+    dataset = ds.dataset(path, format="parquet", schema=schema.append(pa.field("month", pa.string())),
+                         partitioning=MONTH_PARTITIONING)
+    # The month tests prune whole files; the date tests trim the edge months
+    tests = []
+    if start is not None:
+        tests += [ds.field("month") >= month_key(start), ds.field(date_column) >= pa.scalar(start, pa.date32())]
+    if end is not None:
+        tests += [ds.field("month") <= month_key(end), ds.field(date_column) <= pa.scalar(end, pa.date32())]
+    condition = None
+    for test in tests:
+        condition = test if condition is None else condition & test
+    return dataset.to_table(columns=columns, filter=condition).to_pandas()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Per-patient treatment trends: RMT, intensity output and side effects by session.
+
+The whole series comes from one indexed query (the `patient_series` hot
+query: live and archived completed sessions, with their parameter version as
+a fallback). Rolling statistics, RMT drift and chart downsampling are
+vectorized NumPy over the series, so a course of hundreds of sessions costs
+one round trip and a few array operations.
+"""
+import warnings
+from collections import namedtuple
+
+import numpy as np
+
+from tms_app.db import execute_named, report_error
+
+ROLLING_WINDOW = 5         # sessions
+BASELINE_SESSIONS = 3      # RMT baseline = median of the first few sessions
+DRIFT_THRESHOLD = 0.10     # rolling RMT this far from the baseline (fraction) counts as drift
+MAX_CHART_POINTS = 300
+
+SERIES_COLUMNS = ["session_number", "session_date", "protocol_name", "rmt_left", "rmt_right",
+                  "intensity_output_left", "intensity_output_right", "side_effects"]
+
+
+class Drift(namedtuple("Drift", "side baseline current change first_session")):
+    """RMT drift on one side; first_session is None when it stayed within DRIFT_THRESHOLD"""
+    __slots__ = ()
+
+    @property
+    def drifting(self):
+        return self.first_session is not None
+
+
+def get_patient_series(patient_id):
+    """The patient's completed sessions in session order: {column: numpy array} (SERIES_COLUMNS).
+
+    RMT and intensity output of 0 or less mean the side wasn't measured (the Session
+    Parameters inputs default to 0) and come back as NaN, like NULLs.
+    """
+    try:
+        rows = execute_named("patient_series", (patient_id,)) or []
+    except Exception as e:
+        report_error(f"Error fetching treatment history: {e}")
+        rows = []
+    columns = list(zip(*rows)) if rows else [()] * len(SERIES_COLUMNS)
+    series = {name: np.array(values, dtype=object) for name, values in zip(SERIES_COLUMNS, columns)}
+    for name in ("session_number", "rmt_left", "rmt_right", "intensity_output_left", "intensity_output_right"):
+        series[name] = series[name].astype(float)  # None -> nan
+    for name in ("rmt_left", "rmt_right", "intensity_output_left", "intensity_output_right"):
+        series[name][series[name] <= 0] = np.nan
+    return series
+
+
+def rolling_stats(values, window=ROLLING_WINDOW):
+    """Rolling mean and standard deviation over the last `window` values (NaNs ignored)"""
+    if not len(values):
+        return values.copy(), values.copy()
+    padded = np.concatenate([np.full(window - 1, np.nan), values])
+    windows = np.lib.stride_tricks.sliding_window_view(padded, window)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # windows with no values yet
+        return np.nanmean(windows, axis=1), np.nanstd(windows, axis=1)
+
+
+def rmt_drift(session_numbers, rmt, side, window=ROLLING_WINDOW):
+    """Compare the rolling RMT with the baseline; returns a Drift, or None without enough RMT values.
+
+    Only RMT values above 0 count as measured.
+    """
+    with np.errstate(invalid="ignore"):
+        measured = rmt > 0  # NaN compares False
+    if measured.sum() < BASELINE_SESSIONS + 1:
+        return None
+    values, numbers = rmt[measured], session_numbers[measured]
+    baseline = float(np.median(values[:BASELINE_SESSIONS]))
+    if baseline <= 0:
+        return None
+    mean, _ = rolling_stats(values, window)
+    change = (mean - baseline) / baseline
+    # Only windows after the baseline sessions can drift
+    beyond = np.flatnonzero(np.abs(change[BASELINE_SESSIONS:]) > DRIFT_THRESHOLD)
+    first = int(numbers[BASELINE_SESSIONS + beyond[0]]) if len(beyond) else None
+    return Drift(side, baseline, float(mean[-1]), float(change[-1]), first)
+
+
+def downsample(values, max_points=MAX_CHART_POINTS):
+    """Indices of at most ~max_points values keeping each bucket's minimum and maximum (and both ends)"""
+    n = len(values)
+    if n <= max_points:
+        return np.arange(n)
+    filled = np.where(np.isnan(values), np.nanmean(values), values)
+    starts = np.linspace(0, n, max_points // 2, endpoint=False).astype(int)
+    counts = np.diff(np.append(starts, n))
+    bucket = np.repeat(np.arange(len(starts)), counts)
+    keep = [np.array([0, n - 1])]
+    for reduce in (np.minimum, np.maximum):
+        hits = np.flatnonzero(filled == np.repeat(reduce.reduceat(filled, starts), counts))
+        _, first = np.unique(bucket[hits], return_index=True)
+        keep.append(hits[first])
+    return np.unique(np.concatenate(keep))
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Waitlist and gap back-fill.
+
+Patients in 'Review Done' status with no scheduled sessions are the
+waitlist; the `waitlist` table adds their priority and the protocol and
+number of sessions they will start on. It is ordered by priority (highest
+first), then referral date.
+
+When a scheduled slot still ahead of now is deleted (data.delete_session,
+data.bulk_delete_sessions), backfill_slots() books the best-fitting waiting
+patient into it in the deleting transaction. The patient must be allowed in
+by the slot's time (allowed_time, if set, no later than it) and their
+protocol must fit in the slot's minutes; among those the highest priority
+wins, then the least unused time, then the allowed time closest to the slot,
+then the earliest referral. They get a treatment course starting on the
+slot's date with the slot's time as its preferred time (tms_app/courses.py),
+and become 'Started', which takes them off the waitlist. The freed slot is
+theirs; later sessions keep that time only on days with a chair free then,
+else take the day's first free window, else wait for plan-next-day.
+"""
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from tms_app.clinic_calendar import DEFAULT_SESSION_MINUTES, get_clinic_calendar
+from tms_app.courses import (
+    COURSE_HORIZON_DAYS,
+    COURSE_WEEKDAYS,
+    DEFAULT_COURSE_SESSIONS,
+    materialize_course,
+)
+from tms_app.db import execute_query, execute_update, report_error
+
+PRIORITIES = {2: "Urgent", 1: "High", 0: "Routine"}
+
+
+class WaitlistEntry(namedtuple("WaitlistEntry", "patient_id name mrn referred_date allowed_time priority "
+                                                "protocol_id protocol_name session_count duration")):
+    __slots__ = ()
+
+    @property
+    def label(self):
+        return f"{self.name} (MRN: {self.mrn})"
+
+
+class Backfill(namedtuple("Backfill", "patient_name slot_date scheduled_time course_id booked")):
+    """A freed slot given to a waiting patient; `booked` counts their course sessions booked so far"""
+    __slots__ = ()
+
+
+# Waiting patients with their waitlist settings; %(default_minutes)s and %(default_sessions)s fill the gaps
+WAITLIST_SELECT = """
+    SELECT p.id, p.name, p.mrn, p.referred_date, p.allowed_time, COALESCE(w.priority, 0),
+           w.protocol_id, pl.protocol_name, COALESCE(w.session_count, %(default_sessions)s),
+           COALESCE(pl.session_duration, %(default_minutes)s) AS duration
+    FROM patients p
+    LEFT JOIN waitlist w ON w.patient_id = p.id
+    LEFT JOIN protocol_library pl ON pl.id = w.protocol_id
+    WHERE p.status = 'Review Done'
+      AND NOT EXISTS (SELECT 1 FROM tms_sessions ts WHERE ts.patient_id = p.id AND ts.status = 'Scheduled')
+"""
+WAITLIST_ORDER = " ORDER BY COALESCE(w.priority, 0) DESC, p.referred_date NULLS LAST, p.id"
+DEFAULTS = {"default_sessions": DEFAULT_COURSE_SESSIONS, "default_minutes": DEFAULT_SESSION_MINUTES}
+
+
+def get_waitlist():
+    """Waiting patients as WaitlistEntry rows, in waitlist order"""
+    try:
+        rows = execute_query(WAITLIST_SELECT + WAITLIST_ORDER, DEFAULTS)
+        return [WaitlistEntry(*row) for row in rows or []]
+    except Exception as e:
+        report_error(f"Error fetching waitlist: {e}")
+        return []
+
+def save_waitlist_entry(patient_id, priority, protocol_id, session_count):
+    return execute_update(
+        """INSERT INTO waitlist (patient_id, priority, protocol_id, session_count) VALUES (%s, %s, %s, %s)
+        ON CONFLICT (patient_id) DO UPDATE SET priority = EXCLUDED.priority, protocol_id = EXCLUDED.protocol_id,
+            session_count = EXCLUDED.session_count, updated_at = NOW()""",
+        (patient_id, priority, protocol_id, session_count)
+    )
+
+# ==================== BACK-FILL ====================
+
+def _slot_start(slot_date, scheduled_time):
+    try:
+        return datetime.combine(slot_date, datetime.strptime(scheduled_time.strip()[:5], "%H:%M").time())
+    except (AttributeError, ValueError):
+        return None
+
+def backfill_slots(c, freed):
+    """Book waiting patients into freed (slot_date, scheduled_time, slot_duration) slots that are still ahead.
+
+    Runs on the caller's cursor, inside its transaction; returns a Backfill per booked slot.
+    """
+    now = datetime.now()
+    booked = []
+    for slot_date, scheduled_time, slot_duration in sorted(freed, key=lambda slot: (slot[0], slot[1] or "")):
+        start = _slot_start(slot_date, scheduled_time)
+        if start is None or start <= now or not slot_duration:
+            continue
+        # SKIP LOCKED: two deletions at once never hand the same patient two slots
+        c.execute(WAITLIST_SELECT + """
+              AND COALESCE(pl.session_duration, %(default_minutes)s) <= %(minutes)s
+              AND (p.allowed_time IS NULL OR p.allowed_time <= %(start)s::time)
+            ORDER BY COALESCE(w.priority, 0) DESC,
+                     %(minutes)s - COALESCE(pl.session_duration, %(default_minutes)s),
+                     %(start)s::time - p.allowed_time NULLS LAST,
+                     p.referred_date NULLS LAST, p.id
+            LIMIT 1
+            FOR UPDATE OF p SKIP LOCKED""",
+            {**DEFAULTS, "minutes": slot_duration, "start": start.time()})
+        row = c.fetchone()
+        if row is None:
+            continue
+        entry = WaitlistEntry(*row)
+        time_text = f"{start:%H:%M}"
+        c.execute("""INSERT INTO treatment_courses
+                     (patient_id, protocol_id, start_date, session_count, weekdays, preferred_time)
+                     VALUES (%s, %s, %s, %s, %s, %s) RETURNING id""",
+                  (entry.patient_id, entry.protocol_id, slot_date, entry.session_count, COURSE_WEEKDAYS, time_text))
+        course_id = c.fetchone()[0]
+        sessions = materialize_course(c, course_id, get_clinic_calendar(slot_date.year - 1),
+                                      max(slot_date, now.date()) + timedelta(days=COURSE_HORIZON_DAYS))
+        c.execute("UPDATE patients SET status = 'Started' WHERE id = %s", (entry.patient_id,))
+        booked.append(Backfill(entry.name, slot_date, time_text, course_id, sessions))
+    return booked